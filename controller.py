@@ -94,8 +94,12 @@ class SaveDocumentCmd(SimpleCommand, ICommand):
                                   (docproxy, False, _T("Empty document")))
             return
 
+        def progress(stored, total):
+            self.sendNotification(main.DOC_SAVE_PROGRESS,
+                                  (docproxy, stored, total))
+
         try:
-            docproxy.document.save_as(filename)
+            docproxy.document.save_as(filename, progress)
             docproxy.docname = filename
 
         except (IOError, TypeError), e:
@@ -369,7 +373,7 @@ class LoadImageAsLayerCmd(UndoableCommand):
             # get the position to be sure
             vo.pos = docproxy.document.get_layer_index(layer)
 
-        self.sendNotification(main.DOC_DIRTY, (docproxy, layer.area))
+        self.sendNotification(model.DocumentProxy.DOC_DIRTY, (docproxy, layer.area))
 
     def getCommandName(self):
         return self.__name
@@ -384,13 +388,16 @@ class SetLayerMatrixCmd(UndoableCommand):
     def executeCommand(self):
         note = self.getNote()
         docproxy, layer, old_mat, new_mat = note.getBody()
+        area = layer.area  # layer space
         layer.matrix = old_mat
-        old_area = layer.area.copy()  # area in document space with current matrix
+        old_area = area and layer.document_relative_area(*area)
         layer.matrix = new_mat
-        new_area = layer.area
         note.setBody((docproxy, layer, new_mat, old_mat))  # inverse matrixes for undo/redo
 
-        self.sendNotification(main.DOC_DIRTY, (docproxy, old_area.join(new_area)))
+        if area:
+            new_area = layer.document_relative_area(*area)
+            self.sendNotification(model.DocumentProxy.DOC_DIRTY,
+                                  (docproxy, model._cutils.Region([old_area, new_area])))
 
     def getCommandName(self):
         return self.__name
@@ -40,6 +40,7 @@ DOC_ACTIVATE = 'doc-activate'
 DOC_ACTIVATED = 'doc-activated'                       # gives the working document
 DOC_SAVE = 'doc-save'
 DOC_SAVE_RESULT = 'doc-save-result'
+DOC_SAVE_PROGRESS = 'doc-save-progress'               # gives (docproxy, stored, total)
 DOC_DELETE = 'doc-delete'
 DOC_RELEASE = 'doc-release'
 
@@ -25,6 +25,7 @@
 
 import cairo
 import re
+import random
 from puremvc.patterns.proxy import Proxy
 from itertools import imap
 
@@ -38,6 +39,9 @@ from model import _cutils
 from .document import Document
 from .layer import Layer
 from .palette import Palette
+from .replay import StrokeSnapshot
+from .painter import painter
+from .damage import DamageAccumulator
 from ._prefs import prefs, IPrefHandler
 
 
@@ -85,6 +89,9 @@ class LayerProxy(Proxy):
 
     LAYER_DIRTY = 'layer-dirty'
 
+    # Dirty areas of all documents, merged until the next display frame
+    damage = DamageAccumulator()
+
     ###
     ### Object API
 
@@ -95,20 +102,35 @@ class LayerProxy(Proxy):
     ###
     ### Public API
 
-    def handle_dirty(self, layer, area):
+    def handle_dirty(self, layer, area, flush=False):
+        """Report a layer modified area (layer coordinates).
+
+        LAYER_DIRTY is sent at most once per display frame with merged areas,
+        unless flush is True.
+        """
+
         if layer.dirty:
-            self.sendNotification(self.LAYER_DIRTY, (self.docproxy, layer, area))
+            self.damage.add(self, layer, area)
             layer.dirty = 0
+        self.flush_damages(flush)
+
+    @classmethod
+    def flush_damages(cls, force=True):
+        "Send LAYER_DIRTY for pending damages, if forced or the frame interval is elapsed"
+
+        if force or cls.damage.is_due():
+            for layerproxy, layer, area in cls.damage.flush():
+                layerproxy.sendNotification(cls.LAYER_DIRTY, (layerproxy.docproxy, layer, area))
 
     def clear(self, layer):
         snapshot = layer.snapshot()
         layer.clear()
-        self.handle_dirty(layer, snapshot.area)
+        self.handle_dirty(layer, snapshot.area, True)
         return snapshot
 
     def unsnapshot(self, layer, snapshot, *a):
         layer.unsnapshot(snapshot, *a)
-        self.handle_dirty(layer, snapshot.dirty_area)
+        self.handle_dirty(layer, snapshot.dirty_area, True)
 
 
 class DocumentProxy(Proxy):
@@ -134,6 +156,7 @@ class DocumentProxy(Proxy):
     layerproxy = None
     active = None
     refcnt = 0
+    _painter = None   # PaintingWorker used by the current stroke
 
     def __init__(self, doc):
         assert isinstance(doc, Document)
@@ -347,37 +370,63 @@ class DocumentProxy(Proxy):
         surface = layer.surface
         self._dev = device
         self._layer = layer
-        self._snapshot = layer.snapshot()  # for undo
         state = device.current
         self._stroke = [state]
+
+        # New jitters for each stroke, but replayable
+        doc.brush.seed = random.getrandbits(31)
+        # Grain comes from a global texture that may be replaced before undo,
+        # such strokes can't be drawn again and keep their tiles
+        if prefs['undo-replay-strokes'] and doc.brush.grain <= 0:
+            self._snapshot = StrokeSnapshot(layer, doc.brush, self._stroke)  # for undo
+        else:
+            self._snapshot = layer.snapshot()  # for undo
         doc.brush.start(surface, state)
 
+        # Dabs are drawn by a worker thread if wanted
+        self._painter = painter if prefs['paint-thread'] else None
+
     def draw_end(self):
         layer = self._layer
         doc = self.data
-        area = doc.brush.stop() # layer relative area
-        if area:
-            layer.dirty = True
-            self.layerproxy.handle_dirty(layer, layer.document_relative_area(*area))
-
-        ss = self._snapshot
-        if ss.reduce(layer.surface):
-            self.sendNotification(
-                main.DOC_RECORD_STROKE,
-                model.vo.LayerCmdVO(docproxy=self,
-                                    layer=layer,
-                                    snapshot=ss,
-                                    stroke=self._stroke))
-            del self._snapshot, self._layer, self._stroke, self._dev
+        try:
+            # Re-raise a painting thread error after the stroke is recorded:
+            # its already painted pixels must be undoable
+            if self._painter:
+                self._painter.wait()
+        finally:
+            if self._painter:
+                self._handle_painted(layer, self._painter.pop_dirty())
+
+            self._handle_painted(layer, doc.brush.stop()) # layer relative area
+            self.layerproxy.flush_damages()
+
+            ss = self._snapshot
+            if ss.reduce(layer.surface):
+                self.sendNotification(
+                    main.DOC_RECORD_STROKE,
+                    model.vo.LayerCmdVO(docproxy=self,
+                                        layer=layer,
+                                        snapshot=ss,
+                                        stroke=self._stroke))
+                del self._snapshot, self._layer, self._stroke, self._dev
 
     def _record(self):
         state = self._dev.current
         self._stroke.append(state)
-        area = self.data.brush.draw_stroke(state) # layer relative area
-        if area:
+        if self._painter:
             layer = self._layer
+            self._painter.draw(self.data.brush, state,
+                               lambda area: self._handle_painted(layer, area))
+            area = self._painter.pop_dirty() # drawn since the last call
+        else:
+            area = self.data.brush.draw_stroke(state) # layer relative area
+        self._handle_painted(self._layer, area)
+
+    def _handle_painted(self, layer, area):
+        if area:
             layer.dirty = True
-            self.layerproxy.handle_dirty(layer, layer.document_relative_area(*area))
+            self.layerproxy.handle_dirty(layer, area) # layer relative area
 
     ####
     #### Document layers handling ####
@@ -445,22 +494,24 @@ class DocumentProxy(Proxy):
         layer = self.data.active
         if layer.empty:
             return
-        area = layer.area.copy()
+        area = layer.area
         if not area:
             return
+        old_area = layer.document_relative_area(*area)
 
         layer.translate(*delta)
 
         # Refresh the old area + the new layer area
-        self.sendNotification(self.DOC_DIRTY, (self, area.join(layer.area)))
+        self.sendNotification(self.DOC_DIRTY, (self, _cutils.Region([old_area, layer.document_relative_area(*area)])))
 
     def layer_rotate(self, angle, ox=0, oy=0):
         layer = self.data.active
         if layer.empty:
             return
-        area = layer.area.copy()
+        area = layer.area
         if not area:
             return
+        old_area = layer.document_relative_area(*area)
 
         matrix = layer.matrix
         matrix.translate(ox, oy)
@@ -470,7 +521,7 @@ class DocumentProxy(Proxy):
         layer.matrix = matrix
 
         # Refresh the old area + the new layer area
-        self.sendNotification(self.DOC_DIRTY, (self, area.join(layer.area)))
+        self.sendNotification(self.DOC_DIRTY, (self, _cutils.Region([old_area, layer.document_relative_area(*area)])))
 
     def get_layer_pos(self, *pos):
         layer = self.data.active
@@ -51,6 +51,7 @@ class Preferences(dict):
         'view-color-wheel-sel': (1, 0, 0, .80),
         'view-color-handler-bg': (.9, .9, 1., .8),
         'view-color-handler-ol': (.0, .2, .4, .8),
+        'mipmap-max-level': 4,  # MIP-map pyramid costs 1/4+1/16+... of tile memory
     }
 
     def __init__(self):
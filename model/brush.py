@@ -30,6 +30,9 @@ import os
 import math
 
 from math import sin, pi
+from array import array
+
+import PIL.Image
 
 import _brush
 import _pixbuf
@@ -38,17 +41,44 @@ from devices import DeviceState
 from colorspace import ColorSpaceRGB
 from surface import BoundedPlainSurface
 
-__all__ = ['Brush', 'DrawableBrush']
+__all__ = ['Brush', 'DrawableBrush', 'pack_states', 'load_grain_texture']
+
+
+def pack_states(states):
+    """Pack device states into an array of doubles for Brush.draw_strokes().
+
+    Each state gives _brush.STROKE_STATE_SIZE values:
+    spos, vpos, time, xtilt, ytilt and pressure.
+    """
+    buf = array('d')
+    for state in states:
+        buf.extend(state.spos)
+        buf.extend(state.vpos)
+        buf.extend((state.time, state.xtilt, state.ytilt, state.pressure))
+    return buf
+
+
+def load_grain_texture(filename, scale=4.0):
+    """Use the given image as grain texture for all brushes.
+
+    The image luminance gives the grain factors, its sizes must be powers of 2.
+    'scale' is the number of texels per grain noise unit.
+    """
+    im = PIL.Image.open(filename)
+    if im.mode != 'L':
+        im = im.convert('L')
+    w, h = im.size
+    _brush.set_grain_texture(scale, w, h, im.tostring())
 
 
 class Brush(object):
     """Brush base class"""
 
-    __version__ = 2.7
+    __version__ = 2.9
     ALLBRUSHES = "brushes.data"
     PROPERTIES = 'radius_min radius_max yratio angle spacing opacity_min opacity_max opa_comp hardness erase grain'.split()
     PROPERTIES += 'motion_track hi_speed_track smudge smudge_var direction_jitter dab_pos_jitter dab_radius_jitter'.split()
-    PROPERTIES += 'color_shift_h color_shift_v color_shift_s alpha_lock'.split()
+    PROPERTIES += 'color_shift_h color_shift_v color_shift_s alpha_lock smudge_samples accumulate'.split()
     PROPERTIES += 'icon eraser'.split()
 
     RADIUS_MIN = 0.5
@@ -81,6 +111,8 @@ class Brush(object):
     group = None
     icon_preview = None  # runtime usage only, not saved
     eraser = False # 2.7
+    smudge_samples = 512.0 # 2.8, pixels read per smudge dab (0 = all)
+    accumulate = 0.0 # 2.9, stroke accumulation mode (0 = off, 1 = max, 2 = add)
 
     def __init__(self, name='brush', icon=None, **kwds):
         self.name = name
@@ -232,8 +264,7 @@ class DrawableBrush(_brush.Brush, Brush):
         surface.clear_value(1.0 if self.erase == 1.0 else 0.0)
         self.surface = surface
         self.stroke_start(states[0])
-        for state in states:
-            self.draw_stroke(state)
+        self.draw_strokes(pack_states(states))
         self.stroke_end()
 
         return surface.get_rawbuf()
@@ -0,0 +1,223 @@
+###############################################################################
+# Copyright (c) 2009-2013 Guillaume Roguez
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+###############################################################################
+
+"""
+On-disk cache of brush preview pixbufs.
+
+Previews given by DrawableBrush.paint_rgb_preview() are saved in files
+named by a hash of the brush properties, the preview size and pixels format.
+Missing previews are rendered by a worker thread, the GUI thread gets
+them back by calling pop_ready().
+Least recently used files are removed when the cache is over the
+'brush-preview-cache-size' preference (in MB), down to 3/4 of it.
+"""
+
+# Python 2.5 compatibility
+from __future__ import with_statement
+
+import os
+import sys
+import hashlib
+import threading
+import Queue
+
+import _pixbuf
+
+from model._prefs import prefs
+from model.brush import Brush, DrawableBrush
+
+__all__ = ['PreviewCache', 'preview_cache']
+
+if os.name == 'morphos':
+    CACHE_PATH = 'ENVARC:Gribouillis/previews'
+else:
+    CACHE_PATH = os.path.expanduser('~/.gribouillis/previews')
+
+# Change it when brushes drawing changes to not use old previews
+VERSION = 1
+
+# Brush properties without effect on the preview
+_IGNORED = ('icon', 'eraser')
+
+prefs.add_default('brush-preview-cache-size', 16)
+
+
+class PreviewCache(object):
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._ready = []
+        self._pending = 0
+        self._size = None  # bytes of cached files, None until the directory is scanned
+        self._thread = None
+
+    @staticmethod
+    def get_values(brush, **overrides):
+        "Return brush properties used to draw its preview, as a dict"
+
+        values = dict((name, getattr(brush, name)) for name in Brush.PROPERTIES if name not in _IGNORED)
+        values.update(overrides)
+        return values
+
+    @staticmethod
+    def get_key(values, width, height, fmt):
+        data = repr((VERSION, sorted(values.iteritems()), width, height, fmt))
+        return hashlib.sha1(data).hexdigest()
+
+    def _load(self, key, width, height, fmt):
+        filename = os.path.join(self.path, key)
+        try:
+            with open(filename, 'rb') as fd:
+                data = fd.read()
+            os.utime(filename, None)  # recently used
+        except (IOError, OSError):
+            return
+
+        buf = _pixbuf.Pixbuf(fmt, width, height)
+        if len(data) != buf.stride * height:
+            return
+        buf.from_buffer(fmt, data, buf.stride, 0, 0, width, height, False)
+        return buf
+
+    def _save(self, key, buf):
+        filename = os.path.join(self.path, key)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            data = buffer(buf)
+            with open(filename + '_', 'wb') as fd:
+                fd.write(data)
+            os.rename(filename + '_', filename)
+        except (IOError, OSError), e:
+            print "[DBG] error during brush preview saving:", e
+            return
+
+        # The directory is scanned by the first save, then only when over budget
+        budget = prefs['brush-preview-cache-size'] * 1024 * 1024
+        with self._lock:
+            if self._size is None:
+                self._size = self._evict(budget)
+            else:
+                self._size += len(data)
+                if self._size > budget:
+                    self._size = self._evict(budget * 3 / 4)
+
+    def _evict(self, budget):
+        "Remove least recently used files until the cache fits budget bytes, return the cache size"
+
+        files = []
+        total = 0
+        for name in os.listdir(self.path):
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        files.sort()
+        for mtime, size, name in files:
+            if total <= budget:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+        return total
+
+    def _paint(self, drawbrush, values, width, height, fmt):
+        for name, value in values.iteritems():
+            setattr(drawbrush, name, value)
+        return drawbrush.paint_rgb_preview(width, height, fmt=fmt)
+
+    def render(self, brush, width, height, fmt, **overrides):
+        """Return the preview of brush, rendered now if not cached.
+
+        'overrides' are properties values to use instead of brush ones.
+        """
+
+        values = self.get_values(brush, **overrides)
+        key = self.get_key(values, width, height, fmt)
+        buf = self._load(key, width, height, fmt)
+        if buf is None:
+            buf = self._paint(DrawableBrush(), values, width, height, fmt)
+            self._save(key, buf)
+        return buf
+
+    def get(self, brush, width, height, fmt, **overrides):
+        """Return the cached preview of brush, or None.
+
+        Missing previews are rendered by the worker thread and given
+        by pop_ready() later.
+        """
+
+        values = self.get_values(brush, **overrides)
+        key = self.get_key(values, width, height, fmt)
+        buf = self._load(key, width, height, fmt)
+        if buf is None:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='BrushPreview')
+                self._thread.daemon = True
+                self._thread.start()
+            with self._lock:
+                self._pending += 1
+            self._queue.put((brush, key, values, width, height, fmt))
+        return buf
+
+    def _run(self):
+        drawbrush = DrawableBrush()
+        while True:
+            brush, key, values, width, height, fmt = self._queue.get()
+            try:
+                buf = self._paint(drawbrush, values, width, height, fmt)
+            except:
+                buf = None
+                sys.excepthook(*sys.exc_info())
+            else:
+                self._save(key, buf)
+
+            with self._lock:
+                self._pending -= 1
+                if buf is not None:
+                    self._ready.append((brush, buf))
+            del brush, buf
+
+    def pop_ready(self):
+        "Return a list of (brush, preview) rendered since the last call"
+
+        with self._lock:
+            ready, self._ready = self._ready, []
+        return ready
+
+    @property
+    def pending(self):
+        "True if previews are not rendered or not popped yet"
+
+        with self._lock:
+            return bool(self._pending or self._ready)
+
+preview_cache = PreviewCache()
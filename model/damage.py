@@ -0,0 +1,130 @@
+###############################################################################
+# Copyright (c) 2009-2013 Guillaume Roguez
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+###############################################################################
+
+"""
+Coalescing of layers dirty areas between display frames.
+
+Painting gives a dirty area for each device event (hundreds per second
+with a tablet), where displays only need one repaint per frame.
+Areas are merged per key and layer in a Region until the frame interval is elapsed,
+as given by the 'view-frame-rate' preference (0 to not merge anything).
+"""
+
+import time
+
+from model import _cutils
+from model._prefs import prefs
+
+__all__ = ['DamageAccumulator']
+
+prefs.add_default('view-frame-rate', 60)
+
+
+class DamageAccumulator(object):
+    """DamageAccumulator(rate=None) -> accumulator instance
+
+    Merges dirty areas added for a same key and layer until flush().
+    A None area means a full repaint. If rate is None, the
+    'view-frame-rate' preference is used.
+    When set, scheduler(delay) is called when a damage is added to an empty
+    accumulator, it must arrange a flush after 'delay' seconds.
+    """
+
+    scheduler = None
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._damages = {}  # (key, layer) -> Region or None
+        self._last = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.added = 0    # areas given to add()
+        self.merged = 0   # areas joined to a pending area
+        self.dropped = 0  # areas already covered by a pending area
+        self.frames = 0   # flushes with damages
+
+    @property
+    def stats(self):
+        return dict(added=self.added, merged=self.merged,
+                    dropped=self.dropped, frames=self.frames)
+
+    @property
+    def interval(self):
+        rate = self.rate
+        if rate is None:
+            rate = prefs['view-frame-rate']
+        return 1.0 / rate if rate > 0 else 0.0
+
+    @property
+    def pending(self):
+        return bool(self._damages)
+
+    def add(self, key, layer, area):
+        self.added += 1
+        if area is not None:
+            area = _cutils.Region([area])
+
+        # Areas are in layer coordinates, they're merged only for a same layer
+        damage = (key, layer)
+        if damage not in self._damages:
+            if not self._damages and self.scheduler:
+                self.scheduler(max(0.0, self._last + self.interval - time.time()))
+            self._damages[damage] = area
+            return
+
+        pending = self._damages[damage]
+        if pending is None:
+            self.dropped += 1
+        elif area is None:
+            self._damages[damage] = None
+            self.merged += 1
+        else:
+            pixels = pending.pixels
+            if pending.union_in(area).pixels == pixels:
+                self.dropped += 1
+            else:
+                self.merged += 1
+
+    def is_due(self, now=None):
+        "True if damages are pending and the frame interval is elapsed"
+
+        if not self._damages:
+            return False
+        if now is None:
+            now = time.time()
+        return now - self._last >= self.interval
+
+    def flush(self):
+        """Return pending damages as a list of (key, layer, area) and forget them.
+
+        area is a Region or None.
+        """
+
+        damages, self._damages = self._damages, {}
+        if damages:
+            self._last = time.time()
+            self.frames += 1
+        return [(key, layer, area) for (key, layer), area in damages.iteritems()]
@@ -41,6 +41,7 @@ except:
     pass
 
 import _pixbuf
+import _cutils
 
 try:
     import _savers
@@ -51,8 +52,9 @@ from .colorspace import ColorSpace
 from .layer import TiledLayer
 from .brush import DrawableBrush
 from .openraster import OpenRasterFileWriter, OpenRasterFileReader
+from .workers import WorkerPool
 
-from model.surface import UnboundedTiledSurface
+from model.surface import UnboundedTiledSurface, TILE_SIZE
 from utils import _T
 
 __all__ = [ 'Document' ]
@@ -195,15 +197,34 @@ class Document(list):
             layer.surface.from_buffer(_pixbuf.FORMAT_RGBA8_NOA, data, stride, 0, 0, w, h)
 
     def load_from_ora(self, filename):
+        # Without our PNG decoder, layers are decoded using PIL
+        if '_savers' not in globals():
+            with OpenRasterFileReader(filename) as ora:
+                for name, operator, area, visible, opa, data in ora.GetLayersContents():
+                    layer = self._create_layer(name, operator=operator, opacity=opa)
+                    layer.visible = visible
+                    if data:
+                        layer.surface.from_buffer(_pixbuf.FORMAT_RGBA8_NOA, data, area[2]*4, *area)
+                    self.insert(0, layer)
+            return
+
+        # PNG are decoded directly into layers tiles, layers in parallel
+        jobs = []
         with OpenRasterFileReader(filename) as ora:
-            for name, operator, area, visible, opa, data in ora.GetLayersContents():
+            for name, operator, area, visible, opa, data in ora.GetLayersPNG():
                 layer = self._create_layer(name, operator=operator, opacity=opa)
                 layer.visible = visible
                 if data:
-                    layer.surface.from_buffer(_pixbuf.FORMAT_RGBA8_NOA, data, area[2]*4, *area)
+                    jobs.append((data, layer.surface.tile_manager, area[0], area[1]))
                 self.insert(0, layer)
 
-    def save_as(self, filename=None):
+        pool = WorkerPool()
+        try:
+            pool.map(lambda args: _savers.png_load_tiles(*args), jobs)
+        finally:
+            pool.close()
+
+    def save_as(self, filename=None, progress=None):
         # First be sure to have a clean document
         for layer in self.layers:
             layer.surface.cleanup()
@@ -213,7 +234,7 @@ class Document(list):
         if ext:
             saver = getattr(self, 'save_as_' + ext[1:], None)
             if saver:
-                saver(filename)
+                saver(filename, progress)
                 self.add_to_lasts(filename)
                 self.filename = filename
                 self._dirty = False
@@ -221,17 +242,20 @@ class Document(list):
             raise TypeError("Unknown extension")
         raise TypeError("No extension given")
 
-    def save_as_ora(self, filename):
-        with OpenRasterFileWriter(self, filename) as ora:
-            layers = list(self)
-            layers.reverse() # ORA uses FG-to-BG layers order convention
-            for layer in layers:
-                ora.AddLayer(layer, self.as_png_buffer)
+    def save_as_ora(self, filename, progress=None):
+        # Layers are rendered and encoded in parallel
+        pool = WorkerPool()
+        try:
+            with OpenRasterFileWriter(self, filename) as ora:
+                layers = list(self)
+                layers.reverse() # ORA uses FG-to-BG layers order convention
+                ora.AddLayers(layers, self.as_png_buffer, pool, progress)
+        finally:
+            pool.close()
 
-    def save_as_png(self, filename):
-        surface = self.as_cairo_surface()
-        if surface:
-            surface.write_to_png(filename)
+    def save_as_png(self, filename, progress=None):
+        with open(filename, 'wb') as fd:
+            self.export_png(fd, progress=progress)
 
     def _clear(self):
         del self[:]
@@ -353,11 +377,13 @@ class Document(list):
 
     ### Rendering API ###
 
-    def rasterize_to_surface(self, surface, clip, m2s_mat, layers=None, force=False, back=True):
+    def rasterize_to_surface(self, surface, clip, m2s_mat, layers=None, force=False, back=True, pool=None):
         # Start to paint each layers, bottom-top order.
-        for layer in self:
+        # If given, only layers of the 'layers' sequence are painted.
+        # If a WorkerPool is given, tiles of a layer are blended in parallel.
+        for layer in (self if layers is None else layers):
             if layer.visible and not force:
-                layer.rasterize_to_surface(surface, clip, m2s_mat)
+                layer.rasterize_to_surface(surface, clip, m2s_mat, pool)
 
     def _1():
         # Finish by rendering the background
@@ -386,34 +412,70 @@ class Document(list):
 
         return surface
 
-    def as_png_buffer(self, comp=4, layers=None, all=False, **kwds):
+    def export_png(self, output, layers=None, all=False, back=True, pool=None,
+                   compression=-1, filters=None, progress=None):
+        """Encode layers as a PNG image written into the file object 'output'.
+
+        Layers are composited by bands of TILE_SIZE rows, each band being
+        given to the encoder before the next one is rendered,
+        so memory usage doesn't depend on the image height.
+        Only solid colors are supported as background.
+        'progress' is called as progress(rows, total) after each band.
+        Return the count of written bytes, None if there is nothing to encode.
+        """
+
         rect = self.get_bbox(layers, all)
         if not rect: return
 
-        x,y,w,h = rect
+        x, y, w, h = rect
         w -= x - 1
         h -= y - 1
 
-        # PNG buffer is need RGBA8 format (no alpha-premul)
-        pixelbuf = _pixbuf.Pixbuf(_pixbuf.FORMAT_RGBA8_NOA, w, h)
+        layers = [layer for layer in (layers or self) if layer.visible or all]
 
-        # Rendering
-        surface = self.as_cairo_surface(layers, all, **kwds)
-        pixelbuf.from_buffer(_pixbuf.FORMAT_ARGB8,
-                             surface.get_data(),
-                             surface.get_stride(),
-                             0, 0,
-                             surface.get_width(), surface.get_height())
+        # Bands are aligned on the compositing surface tiles
+        surface = UnboundedTiledSurface(_pixbuf.FORMAT_ARGB15X, TILE_SIZE)
+        d2s_mat = cairo.Matrix(x0=-x, y0=-y)
 
-        # Encode pixels data to PNG
+        # Background tile, copied into each destination tile before compositing
+        fill = self.__fill if back else None
+        if fill is not None and not isinstance(fill, cairo.Pattern):
+            rgba = ''.join(chr(int(round(c * 255))) for c in tuple(fill)[:3]) + '\xff'
+            fill = _pixbuf.Pixbuf(_pixbuf.FORMAT_ARGB15X, TILE_SIZE, TILE_SIZE)
+            fill.from_buffer(_pixbuf.FORMAT_RGBA8_NOA, rgba * (TILE_SIZE * TILE_SIZE),
+                             TILE_SIZE * 4, 0, 0, TILE_SIZE, TILE_SIZE)
+        else:
+            fill = None
+
+        # PNG encoder needs RGBA8 format (no alpha-premul)
+        band = _pixbuf.Pixbuf(_pixbuf.FORMAT_RGBA8_NOA, w, TILE_SIZE)
+
+        if filters is None:
+            filters = _savers.FILTER_ALL
+        encoder = _savers.PNGEncoder(w, h, output, compression, filters)
+        for by in xrange(0, h, TILE_SIZE):
+            clip = _cutils.Area(0, by, w, min(TILE_SIZE, h - by))
+
+            surface.clear()
+            if fill is not None:
+                for tile in surface.get_tiles(clip, 1):
+                    fill.blit(tile)
 
-        # DEPRECATED
-        #pngbuf = StringIO()
-        #writer = png.Writer(w, h, alpha=True, bitdepth=8, compression=comp)
-        #writer.write_array(pngbuf, _IntegerBuffer(pixelbuf))
-        #return pngbuf.getvalue()
+            for layer in layers:
+                layer.rasterize_to_surface(surface, clip, d2s_mat, pool)
+
+            band.clear()
+            surface.rasterize(clip, 0, by, destination=band)
+            rows = encoder.write_pixbuf(band, clip.height)
+            if progress:
+                progress(rows, h)
 
-        return _savers.save_pixbuf_as_png_buffer(pixelbuf);
+        return encoder.finish()
+
+    def as_png_buffer(self, comp=4, layers=None, all=False, **kwds):
+        buf = StringIO()
+        if self.export_png(buf, layers, all, compression=comp, **kwds) is not None:
+            return buf.getvalue()
 
     ### Properties ###
 
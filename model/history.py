@@ -0,0 +1,164 @@
+###############################################################################
+# Copyright (c) 2009-2013 Guillaume Roguez
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+###############################################################################
+
+"""
+Memory management of undo snapshots.
+
+Recorded snapshots are compressed by a background thread. When the memory
+used by all of them exceeds the 'undo-memory-budget' preference (in MB),
+the oldest ones are moved into a temporary file. File parts of forgotten
+snapshots are reused by next spilled ones.
+"""
+
+# Python 2.5 compatibility
+from __future__ import with_statement
+
+import bisect
+import threading
+import tempfile
+import weakref
+import Queue
+
+from model._prefs import prefs
+
+__all__ = ['SnapshotHistory', 'history']
+
+prefs.add_default('undo-memory-budget', 256)
+
+
+class SnapshotHistory(object):
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._queue = Queue.Queue()
+        self._snapshots = []  # weak references, oldest first
+        self._file = None
+        self._end = 0  # spill file length
+        self._extents = {}  # id of snapshot weak reference -> (offset, length) in the file
+        self._free = []  # (offset, length) of unused file parts, sorted
+        self._thread = None
+
+    def _get_snapshots(self):
+        with self._lock:
+            snapshots = (ref() for ref in self._snapshots)
+            return [s for s in snapshots if s is not None]
+
+    def _forget(self, ref):
+        with self._lock:
+            self._snapshots.remove(ref)
+
+            # History flushed: spilled data are garbage now
+            if not self._snapshots and self._file is not None:
+                self._file.close()
+                self._file = None
+                self._end = 0
+                self._extents.clear()
+                del self._free[:]
+            elif id(ref) in self._extents:
+                self._release(*self._extents.pop(id(ref)))
+
+    def _release(self, offset, length):
+        # Lock must be held, merge the part with its free neighbours
+        free = self._free
+        i = bisect.bisect(free, (offset, length))
+        if i < len(free) and offset + length == free[i][0]:
+            length += free.pop(i)[1]
+        if i > 0 and sum(free[i-1]) == offset:
+            i -= 1
+            offset, length = free[i][0], free.pop(i)[1] + length
+        if offset + length == self._end:
+            self._end = offset
+            self._file.truncate(offset)
+        else:
+            free.insert(i, (offset, length))
+
+    def _allocate(self, length):
+        # Lock must be held, first fit or at end of file
+        for i, (offset, size) in enumerate(self._free):
+            if size >= length:
+                if size > length:
+                    self._free[i] = offset + length, size - length
+                else:
+                    del self._free[i]
+                return offset
+        offset = self._end
+        self._end += length
+        return offset
+
+    def _run(self):
+        while True:
+            snapshot = self._queue.get()()
+            if snapshot is not None:
+                snapshot.pack()
+                del snapshot
+            if self._queue.empty():
+                self.enforce_budget()
+
+    def add(self, snapshot):
+        "Record a snapshot, it will be packed as soon as possible"
+
+        ref = weakref.ref(snapshot, self._forget)
+        with self._lock:
+            self._snapshots.append(ref)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='SnapshotHistory')
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put(ref)
+
+    def enforce_budget(self):
+        "Spill oldest snapshots until memory usage fits the budget"
+
+        budget = prefs['undo-memory-budget'] * 1024 * 1024
+        snapshots = self._get_snapshots()
+        total = sum(s.memsize for s in snapshots)
+        for snapshot in snapshots:
+            if total <= budget:
+                break
+            total -= snapshot.spill(self)
+
+    def write(self, snapshot, data):
+        "Store data of the given snapshot into the spill file, return its offset"
+
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix='gb-undo-')
+            ref = next(ref for ref in self._snapshots if ref() is snapshot)
+            offset = self._allocate(len(data))
+            self._file.seek(offset)
+            self._file.write(data)
+            self._extents[id(ref)] = offset, len(data)
+            return offset
+
+    def read(self, offset, length):
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    @property
+    def memsize(self):
+        return sum(s.memsize for s in self._get_snapshots())
+
+history = SnapshotHistory()
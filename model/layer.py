@@ -30,6 +30,7 @@ from operator import itemgetter
 
 from model.surface import *
 from model import _pixbuf, _cutils
+from model._prefs import prefs
 from utils import virtualmethod
 
 __all__ = [ 'Layer', 'PlainLayer', 'TiledLayer' ]
@@ -206,7 +207,7 @@ class TiledLayer(Layer):
     def empty(self):
         return len(self._surface.tiles) == 0
 
-    def rasterize_to_surface(self, surface, clip, m2s_mat):
+    def rasterize_to_surface(self, surface, clip, m2s_mat, pool=None):
         opa = self.opacity
 
         l2s_mat = m2s_mat * self._matrix
@@ -224,11 +225,14 @@ class TiledLayer(Layer):
         s = abs(xx)
         if s > 1.0:
             s = log(s, 2)
-            level = int(s)
+            level = min(int(s), prefs['mipmap-max-level'])
             # compute remaining scale factor to apply to mipmap'ed tile
             s = 2 ** (s - level)
             xx = s if xx > 0 else -s
             yy = s if yy > 0 else -s
+            # translation is also expressed in the MIP-map level space
+            tx /= 2 ** level
+            ty /= 2 ** level
             subsampling = _pixbuf.SAMPLING_BRESENHAM
             del s
         else:
@@ -246,13 +250,23 @@ class TiledLayer(Layer):
         f = surface.get_tiles
         for tile in self._surface.get_tiles(clip.transform(s2l_mat.transform_point)):
             dst_tiles.update(f(_cutils.Area(tile.x, tile.y, tile.width, tile.height).transform_in(lpt2s), 1))
-            if tile.damaged:
-                tile.gen_mipmap()
-                tile.damaged = False
 
-        args = (self._surface.get_raw_tile, subsampling, opa, xx, yy, tx, ty, level)
-        for tile in dst_tiles:
-            tile.blend(*args)
+            # Pyramid is rebuilt only when needed,
+            # the tile may be painted by another thread
+            if level and (tile.damaged or tile.mipmap_levels < level):
+                tile.gen_mipmap(level, self._surface.tile_manager)
+
+        # Destination tiles outside the clipping area are not wanted
+        dst_tiles.intersection_update(f(clip))
+
+        args = (self._surface.tile_manager, subsampling, opa, xx, yy, tx, ty, level)
+        if pool is None:
+            for tile in dst_tiles:
+                tile.blend(*args)
+        else:
+            # Each destination tile is blended by only one thread,
+            # so the result is the same as the serial loop.
+            pool.map(lambda tile: tile.blend(*args), dst_tiles)
 
     def merge_to(self, dst):
         """Merging the layer on a given layer (dst).
@@ -305,7 +319,7 @@ class TiledLayer(Layer):
             pb_trans.y = y
 
             # do the affine transformation
-            tile.slow_transform_affine(self.surface.get_row_tile, pb_trans, inv_matrix)
+            tile.slow_transform_affine(self.surface.tile_manager, pb_trans, inv_matrix)
 
             # convert buffers to cairo buffer and use cairo to do compositing (operators needed!)
             # TODO: replace this code by an internal compositor when operators/opacity are supported!
@@ -23,7 +23,7 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 ###############################################################################
 
-import zipfile, itertools, os
+import zipfile, itertools, os, struct
 import xml.etree.ElementTree as ET
 import PIL.Image as pil
 from StringIO import StringIO
@@ -49,6 +49,8 @@ _SVG_OP_2_GB = {
     'plus': 'add',
     }
 
+_PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
 _GB_OP_2_SVG = {}
 for k, v in _SVG_OP_2_GB.iteritems():
     _GB_OP_2_SVG[v] = k
@@ -80,7 +82,9 @@ class OpenRasterFileWriter:
         self.layer_cnt = 1
         self.doc_fill = document.fill
 
-    def AddLayer(self, layer, layers2png):
+    def _add_layer_element(self, layer):
+        "Add the layer in the stack, return its PNG path in the archive"
+
         if not layer.empty:
             lx, ly, w, h = layer.area
             srcpath = 'data/layer_%u.png' % self.layer_cnt
@@ -102,12 +106,42 @@ class OpenRasterFileWriter:
                                 w=str(w),
                                 h=str(h))
         self.layers.append(xml_layer)
+        return srcpath
 
-        if not layer.empty:
+    def AddLayer(self, layer, layers2png):
+        self.AddLayers([layer], layers2png)
+
+    def AddLayers(self, layers, layers2png, pool=None, progress=None):
+        """Add layers in the given order.
+
+        If a WorkerPool is given, layers are encoded concurrently
+        and stored in the archive as soon as possible, keeping the layers order.
+        'progress' is called as progress(stored, total) after each layer is stored.
+        """
+
+        entries = [(layer, srcpath) for layer, srcpath in
+                   ((layer, self._add_layer_element(layer)) for layer in layers)
+                   if srcpath]
+
+        def encode(entry):
+            layer = entry[0]
             opa = layer.opacity # save opacity and force it to 1.0 for rasterizing
             layer.opacity = 1.0
-            self.z.writestr(srcpath, layers2png(self.compression, [layer], all=True, back=False))
-            layer.opacity = opa
+            try:
+                return layers2png(self.compression, [layer], all=True, back=False)
+            finally:
+                layer.opacity = opa
+
+        if pool is None:
+            results = itertools.imap(encode, entries)
+        else:
+            results = pool.imap(encode, entries)
+
+        total = len(entries)
+        for i, data in ienumerate(results):
+            self.z.writestr(entries[i][1], data)
+            if progress:
+                progress(i+1, total)
 
     def close(self):
         if not self.layers:
@@ -159,7 +193,9 @@ class OpenRasterFileReader:
     def GetImageAttributes(self):
         return self.image.attrib
 
-    def GetLayersContents(self):
+    def _iter_layers(self):
+        "Yield (attributes, name, operator, visible, opacity) for each layer"
+
         for layer in self.top_stack:
             if layer.tag != 'layer':
                 print "[*DBG*] Warning: ignoring item %s in stack" % layer.tag
@@ -179,6 +215,10 @@ class OpenRasterFileReader:
 
             opacity = float(a.get('opacity', "1.0"))
 
+            yield a, a['name'], cpop, visible, opacity
+
+    def GetLayersContents(self):
+        for a, name, cpop, visible, opacity in self._iter_layers():
             srcpath = a.get('src')
             if srcpath:
                 if not srcpath.lower().endswith('.png'):
@@ -196,9 +236,39 @@ class OpenRasterFileReader:
                     print "[*DBG*] Warning: ignoring unwanted size (%lux%lu)" % (w, h)
                     continue
 
-                yield a['name'], cpop, (x, y, w, h), visible, opacity, im.tostring()
+                yield name, cpop, (x, y, w, h), visible, opacity, im.tostring()
+            else:
+                yield name, cpop, (0, 0, 0, 0), visible, opacity, None
+
+    def GetLayersPNG(self):
+        """Same as GetLayersContents() but layers contents are not decoded:
+        PNG file contents are given instead of pixels.
+        """
+
+        for a, name, cpop, visible, opacity in self._iter_layers():
+            srcpath = a.get('src')
+            if srcpath:
+                if not srcpath.lower().endswith('.png'):
+                    print "[*DBG*] Warning: ignoring layer src %s" % srcpath
+                    continue
+
+                x = int(a.get('x', 0)) + self.ox # optional
+                y = int(a.get('y', 0)) + self.oy # optional
+
+                data = self.z.read(srcpath)
+                if data[:8] != _PNG_SIGNATURE:
+                    print "[*DBG*] Warning: ignoring non PNG layer src %s" % srcpath
+                    continue
+
+                # Image size from the IHDR chunk
+                w, h = struct.unpack('>II', data[16:24])
+                if w != int(a.get('w', w)) or h != int(a.get('h', h)):
+                    print "[*DBG*] Warning: ignoring unwanted size (%lux%lu)" % (w, h)
+                    continue
+
+                yield name, cpop, (x, y, w, h), visible, opacity, data
             else:
-                yield a['name'], cpop, (0, 0, 0, 0), visible, opacity, None
+                yield name, cpop, (0, 0, 0, 0), visible, opacity, None
 
     def close(self):
         self.z.close()
@@ -0,0 +1,160 @@
+###############################################################################
+# Copyright (c) 2009-2013 Guillaume Roguez
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+###############################################################################
+
+"""
+Brush painting thread.
+
+Device states are queued by the GUI thread and drawn by a worker thread,
+so a slow brush doesn't block events handling and repaints.
+The brush releases the GIL when writing pixels of a tile and locks it
+for writing, renders lock tiles for reading (see _tilemgr C API).
+Areas modified by the worker are posted to the GUI thread through the
+scheduler given by the view (e.g. gobject.idle_add), or collected by pop_dirty().
+"""
+
+# Python 2.5 compatibility
+from __future__ import with_statement
+
+import sys
+import threading
+import Queue
+
+from model._prefs import prefs
+from model.brush import pack_states
+
+__all__ = ['PaintingWorker', 'painter']
+
+prefs.add_default('paint-thread', True)
+
+
+class PaintingWorker(object):
+    # Callable running the given function later in the GUI thread, set by the view
+    scheduler = None
+
+    def __init__(self):
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._dirty = None
+        self._painted = None
+        self._posted = False
+        self._exc_info = None
+        self._thread = None
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            brush, state = queue.get()
+
+            # Draw all pending states at once
+            # (the GUI thread waits the end of a stroke before starting another one)
+            states = [state]
+            try:
+                while True:
+                    states.append(queue.get_nowait()[1])
+            except Queue.Empty:
+                pass
+
+            try:
+                area = brush.draw_strokes(pack_states(states))
+            except:
+                area = None
+                with self._lock:
+                    if self._exc_info is None:
+                        self._exc_info = sys.exc_info()
+
+            if area:
+                self._add_dirty(area)
+
+            count = len(states)
+            del brush, state, states
+            for i in xrange(count):
+                queue.task_done()
+
+    def _add_dirty(self, area):
+        x, y, w, h = area
+        scheduler = self.scheduler
+        with self._lock:
+            if self._dirty is None:
+                self._dirty = area
+            else:
+                x0, y0, w0, h0 = self._dirty
+                x1 = max(x + w, x0 + w0)
+                y1 = max(y + h, y0 + h0)
+                x = min(x, x0)
+                y = min(y, y0)
+                self._dirty = x, y, x1 - x, y1 - y
+
+            # At most one pending post
+            post = scheduler is not None and not self._posted
+            self._posted |= post
+        if post:
+            scheduler(self._post_dirty)
+
+    def _post_dirty(self):
+        # Called in the GUI thread
+        with self._lock:
+            self._posted = False
+            painted = self._painted
+        area = self.pop_dirty()
+        if area and painted:
+            painted(area)
+        return False
+
+    def draw(self, brush, state, painted=None):
+        """Queue a device state to be drawn by the given brush.
+
+        'painted' is called in the GUI thread with each modified area
+        if a scheduler is set.
+        """
+
+        with self._lock:
+            self._painted = painted
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name='PaintingWorker')
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((brush, state))
+
+    def pop_dirty(self):
+        "Return the area modified since the last call (brush surface coordinates) or None"
+
+        with self._lock:
+            area, self._dirty = self._dirty, None
+        return area
+
+    def wait(self):
+        """Return when all queued states are drawn.
+
+        An exception raised by the brush is re-raised here.
+        """
+
+        self._queue.join()
+        with self._lock:
+            exc_info, self._exc_info = self._exc_info, None
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+painter = PaintingWorker()
@@ -0,0 +1,201 @@
+###############################################################################
+# Copyright (c) 2009-2013 Guillaume Roguez
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+###############################################################################
+
+"""
+Replay-based undo of brush strokes.
+
+When the 'undo-replay-strokes' preference is set, a stroke snapshot doesn't
+keep modified tiles: on redo the stroke is drawn again from its recorded
+device states, with the same brush values and random seed.
+Strokes done on a layer without other modifications between them are chained:
+a stroke keeps only old tiles not already modified by the previous strokes
+of the chain, other ones are rebuilt on undo by replaying the chain.
+A new chain (a keyframe) is started every 'undo-keyframe-interval' strokes.
+Smudging strokes read pixels around the chain tiles, so they are never chained.
+Grained strokes are not replayed: the grain texture is global and may change.
+"""
+
+import weakref
+
+from model import _brush
+from model._prefs import prefs
+from model.brush import Brush, DrawableBrush, pack_states
+from model.surface import UnboundedTiledSurface
+
+__all__ = ['StrokeSnapshot']
+
+prefs.add_default('undo-replay-strokes', False)
+prefs.add_default('undo-keyframe-interval', 8)
+
+# Brush values needed to draw again a stroke
+BRUSH_VALUES = [name for name in Brush.PROPERTIES if hasattr(_brush.Brush, name)]
+BRUSH_VALUES += ['rgb', 'seed']
+
+_last_strokes = weakref.WeakKeyDictionary()  # layer -> ref on its last stroke
+_player = None  # brush used to replay strokes
+
+
+def _get_player():
+    global _player
+    if _player is None:
+        _player = DrawableBrush()
+    return _player
+
+
+class StrokeSnapshot(object):
+    """StrokeSnapshot(layer, brush, stroke) -> snapshot instance
+
+    Undo snapshot of a stroke drawn by 'brush' on 'layer'.
+    Must be created before the stroke start, 'stroke' is the list
+    of device states, filled during the stroke.
+    """
+
+    prev = None     # previous stroke in the chain, None for a keyframe
+    depth = 0       # position in the chain
+    covered = frozenset()  # positions of tiles modified by the chain
+    touched = frozenset()  # positions of tiles modified by this stroke
+    _tail = None    # tiles at covered positions after the stroke
+    smudge = False  # the stroke reads the surface, it can't be replayed on a scratch one
+
+    def __init__(self, layer, brush, stroke):
+        self.layer = layer
+        self._stroke = stroke
+        self.values = [(name, getattr(brush, name)) for name in BRUSH_VALUES]
+        self.smudge = brush.smudge > 0
+
+        # Chain only if the layer has not been modified since the last stroke
+        ref = _last_strokes.get(layer)
+        prev = ref and ref()
+        if prev is not None \
+                and not (self.smudge or prev.smudge) \
+                and prev.depth + 1 < prefs['undo-keyframe-interval'] \
+                and prev._check_tail(layer.surface.tiles):
+            self.prev = prev
+            self.depth = prev.depth + 1
+            self.covered = prev.covered
+
+        self._snapshot = layer.snapshot()
+        self.area = self._snapshot.area
+
+    def _check_tail(self, tiles):
+        tail = self._tail
+        if tail is None or len(tail) != len(self.covered):
+            return False
+        for pos, tile in tail.items():
+            if tiles.get(pos) is not tile:
+                return False
+        return True
+
+    def _set_last(self, tiles):
+        "Record surface tiles produced by the chain, self becomes the last stroke"
+
+        tail = weakref.WeakValueDictionary()
+        for pos in self.covered:
+            tile = tiles.get(pos)
+            if tile is not None:
+                # Any later modification replaces the tile
+                tile.ro = True
+                tail[pos] = tile
+        self._tail = tail
+        _last_strokes[self.layer] = weakref.ref(self)
+
+    def _replay(self, surface):
+        brush = _get_player()
+        for name, value in self.values:
+            setattr(brush, name, value)
+        brush.surface = surface
+        brush.stroke_start(self._start)
+        brush.draw_strokes(self._states)
+        brush.stroke_end()
+
+    def reduce(self, surface):
+        "Drop tiles that can be rendered again"
+
+        ss = self._snapshot
+        if not ss.reduce(surface, self.covered):
+            return
+
+        self.touched = ss.touched
+        self.covered = self.covered | ss.touched
+        stroke = self._stroke
+        self._start = stroke[0]
+        self._states = pack_states(stroke[1:])
+        del self._stroke
+        self._set_last(surface.tiles)
+        return True
+
+    def blit(self, tiles, redo):
+        layer = self.layer
+        if redo:
+            self._replay(layer.surface)
+            self._set_last(tiles)
+            return
+
+        old = dict(self._snapshot._get_tiles()[0])
+        prev = self.prev
+        if prev is not None:
+            # Replay the chain from its keyframe on a scratch surface
+            chain = []
+            while prev is not None:
+                chain.insert(0, prev)
+                prev = prev.prev
+
+            surface = UnboundedTiledSurface(layer.surface.pixfmt,
+                                            layer.surface.tile_size)
+            scratch = surface.tiles
+            for stroke in chain:
+                scratch.update(stroke._snapshot._get_tiles()[0])
+            for stroke in chain:
+                stroke._replay(surface)
+
+            for pos in self.touched & self.prev.covered:
+                tile = scratch[pos]
+                tile.ro = True
+                old[pos] = tile
+
+        # Undo: remove modified tiles and restore old contents
+        for pos in self.touched:
+            tile = old.get(pos)
+            if tile is None:
+                tiles.pop(pos, None)
+            else:
+                tiles[pos] = tile
+
+        if self.prev is not None:
+            self.prev._set_last(tiles)
+        else:
+            _last_strokes.pop(layer, None)
+
+    @property
+    def dirty_area(self):
+        return self._snapshot.dirty_area
+
+    @property
+    def size(self):
+        return self._snapshot.size
+
+    @property
+    def memsize(self):
+        return self._snapshot.memsize
@@ -30,12 +30,15 @@ as UnboundedTiledSurface.
 """
 
 import sys
+import zlib
+import threading
 import cairo
 
 import _pixbuf
 import _tilemgr
 import _cutils
 
+from history import history
 from utils import virtualmethod
 
 __all__ = ['Surface', 'UnboundedTiledSurface', 'BoundedPlainSurface',
@@ -130,10 +133,18 @@ class TileSurfaceSnapshot(dict):
     # These values are set in order to dirty_area returns 0 sized area
     dirty_area = _cutils.Area()
 
+    # Packed form, see pack()
+    _index = None   # list of (modified, pos, x, y), tiles order in data
+    _data = None    # zlib'ed tiles contents
+    _spill = None   # (offset, length) of _data in the history file
+    _size = 0       # unpacked size
+    touched = ()    # positions of modified tiles, set by reduce(rebuilt=...)
+
     def __init__(self, tiles, area=None):
         # Fast tiles copy
         dict.__init__(self, tiles)
         self._mod = {}  # will contains added tiles after reduce()
+        self._lock = threading.Lock()
         self.area = area
 
         # mark all tiles as readonly:
@@ -142,8 +153,13 @@ class TileSurfaceSnapshot(dict):
         for tile in tiles.itervalues():
             tile.ro = True
 
-    def reduce(self, surface):
-        "Split modified and unmodified tiles by make a difference with the given surface content"
+    def reduce(self, surface, rebuilt=None):
+        """Split modified and unmodified tiles by make a difference with the given surface content
+
+        If 'rebuilt' is given, the caller knows how to render again
+        modified tiles and old tiles at 'rebuilt' positions: they are dropped
+        and only positions of modified tiles are kept, as 'touched'.
+        """
 
         # Set dirty area to invalid values
         # (but usefull with min/max computations)
@@ -176,25 +192,118 @@ class TileSurfaceSnapshot(dict):
             else:
                 del self[pos]
 
-        if self._mod or self:
+        if rebuilt is not None:
+            self.touched = frozenset(self._mod).union(self)
+            self._mod.clear()
+            for pos in rebuilt:
+                self.pop(pos, None)
+
+        if self._mod or self or self.touched:
             self.dirty_area = _cutils.area_from_bbox(xmin, ymin, xmax, ymax)
+            history.add(self)
             return True
 
+    def pack(self):
+        "Compress tiles contents, drop tiles objects"
+
+        with self._lock:
+            if self._index is not None:
+                return
+
+            index = []
+            data = []
+            for modified, tiles in ((False, self), (True, self._mod)):
+                for pos, tile in tiles.iteritems():
+                    index.append((modified, pos, tile.x, tile.y))
+                    data.append(str(buffer(tile)))
+
+            if index:
+                self._pixfmt = tile.pixfmt
+                self._tile_size = tile.width
+            self._size = self._get_size()
+            self._data = zlib.compress(''.join(data), 1)
+            self._index = index
+            self.clear()
+            self._mod.clear()
+
+    def spill(self, history):
+        "Move packed data into the history file, return memory saved"
+
+        with self._lock:
+            if self._data is None:
+                return 0
+            length = len(self._data)
+            self._spill = history.write(self, self._data), length
+            self._data = None
+            return length
+
+    def _get_tiles(self):
+        "Return (old, modified) tiles dictionnaries, never the snapshot ones"
+
+        with self._lock:
+            if self._index is None:
+                # copies: pack() may clear ours from another thread
+                return dict(self), dict(self._mod)
+            if not self._index:
+                return {}, {}
+
+            data = self._data
+            if data is None:
+                data = history.read(*self._spill)
+            data = zlib.decompress(data)
+
+            old = {}
+            mod = {}
+            pixfmt = self._pixfmt
+            size = self._tile_size
+            length = len(data) / len(self._index)
+            offset = 0
+            for modified, pos, x, y in self._index:
+                tile = Tile(pixfmt, x, y, size)
+                tile.from_buffer(pixfmt, buffer(data, offset, length),
+                                 tile.stride, x, y, size, size)
+                # tiles given to the surface must never modify ours
+                tile.ro = True
+                (mod if modified else old)[pos] = tile
+                offset += length
+            return old, mod
+
     def blit(self, tiles, redo):
+        old, mod = self._get_tiles()
         if redo:
             # Redo: remove touched tiles and restore modified/added ones
-            map(tiles.pop, self)
-            tiles.update(self._mod)
+            map(tiles.pop, old)
+            tiles.update(mod)
         else:
             # Undo: remove modified tiles and restore old contents
-            map(tiles.pop, self._mod)
-            tiles.update(self)
+            map(tiles.pop, mod)
+            tiles.update(old)
 
-    @property
-    def size(self):
+    def _get_size(self):
+        # Lock must be held
+        if self._index is not None:
+            return self._size
         return sum(t.memsize for t in self.itervalues()) + \
             sum(t.memsize for t in self._mod.itervalues())
 
+    @property
+    def size(self):
+        "Unpacked size of saved tiles"
+
+        with self._lock:
+            return self._get_size()
+
+    @property
+    def memsize(self):
+        "Memory really used by saved tiles"
+
+        with self._lock:
+            if self._index is None:
+                return self._get_size()
+            if self._data is None:
+                return 0
+            return len(self._data)
+
 
 class Tile(_pixbuf.Pixbuf):
     def __new__(cls, pixfmt, x, y, s, *args):
@@ -215,9 +324,6 @@ class Tile(_pixbuf.Pixbuf):
         dst, x, y = args
         self.blit(dst, self.x - x, self.y - y)
 
-    def gen_mipmap(self):
-        pass
-
 
 class UnboundedTiledSurface(Surface):
     def __init__(self, pixfmt, size=_tilemgr.TILE_DEFAULT_SIZE):
@@ -312,6 +418,11 @@ class UnboundedTiledSurface(Surface):
     def tile_size(self):
         return self.__tilemgr.tile_size
 
+    @property
+    def tile_manager(self):
+        "Underlaying UnboundedTileManager, tiles source for Pixbuf.blend()"
+        return self.__tilemgr
+
     @property
     def pixfmt(self):
         return self.__tilemgr.pixfmt
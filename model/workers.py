@@ -0,0 +1,233 @@
+###############################################################################
+# Copyright (c) 2009-2013 Guillaume Roguez
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+###############################################################################
+
+"""
+Pool of worker threads used to split long operations on tiles.
+
+Jobs are only efficient if they release the GIL (like Pixbuf.blend).
+"""
+
+# Python 2.5 compatibility
+from __future__ import with_statement
+
+import sys
+import threading
+
+__all__ = ['WorkerPool', 'cpu_count']
+
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+class _Job(object):
+    def __init__(self, func, items):
+        self.func = func
+        self.items = items
+        self.index = 0
+        self.pending = len(items)
+        self.exc_info = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def run_one(self):
+        "Process the next item, return False if the job is exhausted"
+
+        items = self.items
+        with self.lock:
+            i = self.index
+            if i >= len(items):
+                return False
+            self.index = i + 1
+
+        try:
+            self.func(items[i])
+        except:
+            with self.lock:
+                if self.exc_info is None:
+                    self.exc_info = sys.exc_info()
+                self.stop()
+
+        with self.lock:
+            self.pending -= 1
+            if self.pending <= 0:
+                self.done.set()
+        return True
+
+    def run(self):
+        "Process items until the job is exhausted"
+
+        while self.run_one():
+            pass
+
+    def stop(self):
+        "Cancel items not started yet (lock must be held)"
+
+        self.pending -= len(self.items) - self.index
+        self.index = len(self.items)
+        if self.pending <= 0:
+            self.done.set()
+
+
+class WorkerPool(object):
+    """WorkerPool(count=None) -> pool instance
+
+    Runs a function over a list of items using 'count' threads
+    (the caller thread included). If count is None, use one thread per CPU.
+    With count < 2 all work is done by the caller thread.
+    """
+
+    def __init__(self, count=None):
+        self.count = count or cpu_count()
+        self._cond = threading.Condition()
+        self._job = None
+        self._closing = False
+        self._threads = []
+
+    def _worker(self):
+        cond = self._cond
+        last = None
+        while True:
+            with cond:
+                while self._job is last and not self._closing:
+                    cond.wait()
+                if self._closing:
+                    return
+                job = last = self._job
+            job.run()
+
+    def _start(self):
+        for i in xrange(self.count - 1):
+            t = threading.Thread(target=self._worker, name='WorkerPool-%u' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def map(self, func, items):
+        """Call func(item) for each item of the given iterable.
+
+        Return when all items are processed. The first raised exception
+        is re-raised in the caller thread.
+        Calls order is not guaranteed, so func() calls must be independents.
+        """
+
+        items = list(items)
+        if self.count < 2 or len(items) < 2:
+            for item in items:
+                func(item)
+            return
+
+        job = self._post(func, items)
+
+        # Caller works too
+        job.run()
+        job.done.wait()
+
+        # Release references, late workers will find an exhausted job
+        job.items = ()
+        job.func = None
+
+        if job.exc_info:
+            raise job.exc_info[0], job.exc_info[1], job.exc_info[2]
+
+    def imap(self, func, items):
+        """Iterate over func(item) results, in items order.
+
+        Items are processed in parallel, results are yielded as soon as
+        they are available. When the next result is not ready yet
+        the caller thread processes pending items.
+        An exception raised by func() is re-raised when its result is reached.
+        """
+
+        items = list(items)
+        if self.count < 2 or len(items) < 2:
+            for item in items:
+                yield func(item)
+            return
+
+        results = {}
+        cond = threading.Condition()
+
+        def run(i):
+            try:
+                res = True, func(items[i])
+            except:
+                res = False, sys.exc_info()
+            with cond:
+                results[i] = res
+                cond.notify()
+
+        job = self._post(run, range(len(items)))
+        try:
+            for i in xrange(len(items)):
+                with cond:
+                    ready = i in results
+                while not ready:
+                    if not job.run_one():
+                        # nothing left to start, wait for workers
+                        with cond:
+                            while i not in results:
+                                cond.wait()
+                    with cond:
+                        ready = i in results
+
+                ok, res = results.pop(i)
+                if not ok:
+                    raise res[0], res[1], res[2]
+                yield res
+                del res
+        finally:
+            # Interrupted iteration: cancel remaining items
+            with job.lock:
+                job.stop()
+            job.done.wait()
+            job.items = ()
+            job.func = None
+
+    def _post(self, func, items):
+        "Give a new job to workers"
+
+        if not self._threads:
+            self._start()
+
+        job = _Job(func, items)
+        with self._cond:
+            self._job = job
+            self._cond.notify_all()
+        return job
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        self._job = None
+        self._closing = False
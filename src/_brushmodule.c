@@ -27,10 +27,15 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 #include "common.h"
 #include "_pixbufmodule.h"
+#include "_tilemgrmodule.h"
 #include "math.h"
 
 #include <string.h>
 
+#ifdef __SSE2__
+#include <emmintrin.h>
+#endif
+
 #ifndef INITFUNC
 #define INITFUNC init_brush
 #endif
@@ -50,11 +55,33 @@ OTHER DEALINGS IN THE SOFTWARE.
 #define PyBrush_Check(op) PyObject_TypeCheck(op, &PyBrush_Type)
 #define PyBrush_CheckExact(op) ((op)->ob_type == &PyBrush_Type)
 
-#define PB_CACHE_SIZE 15 /* good value for the case of big brushes */
+#define PB_CACHE_GRID 8 /* pixbufs cache is a grid of PB_CACHE_GRID^2 tiles (power of 2) */
 #define DABS_PER_SECONDS 0
 
 #define HERMITE_NUMPOINTS 3
 
+#define DAB_SPAN_CHUNK 64 /* pixels per dab opacity computation pass */
+#define DAB_UNBLOCK_PIXELS 1024 /* GIL released to write more pixels into a tile */
+
+/* Dab masks cache (constant parameters strokes) */
+#define DAB_MASK_CACHE_SIZE 64
+#define DAB_MASK_MIN_RADIUS 4.0
+#define DAB_MASK_MAX_RADIUS 64.0
+#define DAB_MASK_SUBPIXELS 8            /* sub-pixel positions per axis */
+#define DAB_MASK_RADIUS_STEPS 16        /* radius buckets per pixel */
+#define DAB_MASK_YRATIO_STEPS 256
+#define DAB_MASK_ANGLE_STEPS 4096       /* cos/sin quantisation */
+#define DAB_MASK_HARDNESS_STEPS 1024
+
+/* Stroke accumulation buffer (see accum_composite()) */
+#define ACCUM_BLOCK_SHIFT 6             /* blocks of 64x64 pixels */
+#define ACCUM_BLOCK_SIZE (1 << ACCUM_BLOCK_SHIFT)
+#define ACCUM_HASH_SIZE 256             /* power of 2 */
+
+/* Grain texture (tileable noise replacing per-pixel noise_2d calls) */
+#define GRAIN_DEFAULT_SIZE 1024         /* texels per side (power of 2) */
+#define GRAIN_DEFAULT_SCALE 4.0         /* texels per noise unit */
+
 //#define STAT_TIMING
 
 #define GET_INT_FROM_STROKE(state, var, name) \
@@ -114,17 +141,59 @@ enum
     BV_COLOR_SHIFT_S,
     BV_COLOR_SHIFT_V,
     BV_ALPHA_LOCK,
+    BV_SMUDGE_SAMPLES,
+    BV_ACCUMULATE,
     BASIC_VALUES_MAX
 };
 
-struct PBNode;
-typedef struct PBNode
+/* BV_ACCUMULATE values */
+enum
+{
+    ACCUMULATE_NONE=0,  /* dabs drawn directly on the surface */
+    ACCUMULATE_MAX,     /* stroke coverage is the maximal dabs opacity */
+    ACCUMULATE_ADD,     /* dabs opacities are added like alpha layers */
+};
+
+/* Packed device state fields, as doubles (see Brush.draw_strokes) */
+enum
+{
+    SS_SX=0,
+    SS_SY,
+    SS_VX,
+    SS_VY,
+    SS_TIME,
+    SS_XTILT,
+    SS_YTILT,
+    SS_PRESSURE,
+    STROKE_STATE_SIZE
+};
+
+/* Pre-computed dab opacity factors, opacity excluded */
+struct DabMask;
+typedef struct DabMask
+{
+    struct DabMask * dm_Previous;
+    struct DabMask * dm_Next;
+    int              dm_Valid;
+    int              dm_Key[7];     /* quantised radius, yratio, cos, sin, hardness and sub-pixel position */
+    int              dm_Origin;     /* distance between the mask top-left pixel and the dab center pixel */
+    int              dm_Size;       /* mask width and height */
+    int *            dm_Spans;      /* [k1, k2] range of pixels inside the ellipse, per row */
+    float *          dm_Alpha;      /* dm_Size^2 factors, negative outside the ellipse */
+    unsigned int     dm_AllocSize;  /* number of pixels allocated */
+} DabMask;
+
+/* Grain factors in [0, 1], wrapping in both directions.
+ * Shared by brushes: modified and referenced only with the GIL held.
+ */
+typedef struct GrainTexture
 {
-    struct PBNode * pbn_Previous;
-    struct PBNode * pbn_Next;
-    PyObject *      pbn_Pixbuf;
-    int             pbn_Valid;
-} PBNode;
+    int              gt_RefCount;
+    int              gt_Width;      /* power of 2 */
+    int              gt_Height;     /* power of 2 */
+    float            gt_Scale;      /* texels per noise unit */
+    float *          gt_Data;
+} GrainTexture;
 
 typedef struct MyRec
 {
@@ -132,6 +201,25 @@ typedef struct MyRec
     int32_t x2, y2;
 } MyRec;
 
+/* A square of pixels of the stroke accumulation buffer.
+ * Dabs only modify the coverage and color of the block,
+ * pixels are written in the surface by accum_composite(),
+ * computed from the surface pixels saved at the first block use.
+ */
+typedef struct AccumBlock
+{
+    struct AccumBlock * ab_Next;        /* next block of the same hash slot */
+    struct AccumBlock * ab_NextDirty;   /* next block to composite */
+    PyPixbuf *          ab_Pixbuf;      /* NR, surface pixels buffer containing the block */
+    int                 ab_X, ab_Y;     /* block position (surface units, multiple of ACCUM_BLOCK_SIZE) */
+    int                 ab_Queued;      /* in the blocks to composite list */
+    MyRec               ab_Dirty;       /* pixels to composite (block units) */
+    float *             ab_Cover;       /* stroke opacity per pixel */
+    float *             ab_Erase;       /* stroke erase factor per pixel */
+    float *             ab_Color;       /* stroke color per pixel (3 floats) */
+    uint8_t *           ab_Orig;        /* surface pixels before the stroke */
+} AccumBlock;
+
 typedef struct
 {
     int     p_IX, p_IY;
@@ -151,10 +239,25 @@ typedef struct PyBrush
     /* Object Data */
     PyObject *      b_Surface;
     PyObject *      b_GetPixBufFunc; /* cached method from b_Surface */
-    PBNode          b_PBCache[PB_CACHE_SIZE];
-    PBNode *        b_PBFirst;
-    PBNode *        b_PBLast;
-    PBNode *        b_FirstInvalid;
+    PyObject *      b_TileMgr;       /* tiles manager of b_Surface if any, to lock tiles */
+
+    /* Pixbufs cache, direct-mapped by tile position (modulo PB_CACHE_GRID) */
+    PyPixbuf *      b_PBCache[PB_CACHE_GRID*PB_CACHE_GRID]; /* BR */
+    int             b_PBShift;       /* log2 of tiles size, -1 if unknown */
+
+    /* Dab masks LRU cache */
+    DabMask         b_MaskCache[DAB_MASK_CACHE_SIZE];
+    DabMask *       b_MaskFirst;
+    DabMask *       b_MaskLast;
+    unsigned long   b_MaskHits;
+    unsigned long   b_MaskMisses;
+
+    GrainTexture *  b_Grain;         /* NR, texture used by the current dabs */
+
+    /* Stroke accumulation buffer, used between stroke_start() and stroke_end() */
+    int             b_AccumMode;     /* ACCUMULATE_xxx, set at stroke start */
+    AccumBlock *    b_AccumHash[ACCUM_HASH_SIZE];
+    AccumBlock *    b_AccumDirty;    /* blocks to composite */
 
     /* Brush Model */
     float           b_RemainSteps; /* remaining dabs between last drawn dabs and last control knot */
@@ -167,6 +270,9 @@ typedef struct PyBrush
 
     float           b_BasicValues[BASIC_VALUES_MAX];
 
+    unsigned int    b_Seed;        /* random generators seed, used at stroke start */
+    unsigned int    b_RandState[2];
+
     float           b_HSVColor[3]; /* HSV colorspace */
     float           b_RGBColor[3]; /* RGB colorspace */
     float           b_Color[3];    /* Stroke saving */
@@ -181,6 +287,7 @@ typedef struct PyBrush
 } PyBrush;
 
 static PyTypeObject PyBrush_Type;
+static GrainTexture *grain_texture = NULL; /* NR, set lazily or by set_grain_texture() */
 
 #define CS_TABLE_SIZE 2048
 
@@ -252,127 +359,731 @@ ppc_getcounter(uint64_t *v)
 
 #endif /* STAT_TIMING */
 
+/* Return the surface pixbuf containing the point (x, y) (BR),
+ * (void *)-1 if the surface has none, or NULL on error.
+ * Tiles around a dab use different slots of the cache, so they never
+ * evict each others. Tiles of an UnboundedTileManager are directly
+ * obtained through the _tilemgr C API, without interpreter calls.
+ */
 static PyPixbuf *
 obtain_pixbuffer(PyBrush *self, PyObject *surface, int x, int y)
 {
-    PyObject *cached = NULL, *o = NULL;
-    PBNode *node, *first_invalid = NULL;
+    PyPixbuf **slot, *pb;
 
 #ifdef STAT_TIMING
     self->b_CacheAccesses++;
 #endif
 
-    /* Find the (x,y) point pixbuf container
-     * by using cached ones first.
-     */
-    node = self->b_PBFirst;
-    while (NULL != node)
+    if (self->b_PBShift >= 0)
+        slot = &self->b_PBCache[((x >> self->b_PBShift) & (PB_CACHE_GRID-1))
+                                + ((y >> self->b_PBShift) & (PB_CACHE_GRID-1)) * PB_CACHE_GRID];
+    else
+        slot = &self->b_PBCache[0];
+
+    pb = *slot;
+    if ((NULL != pb)
+        && (x >= pb->x) && (x < (pb->x + pb->width))
+        && (y >= pb->y) && (y < (pb->y + pb->height)))
+        return pb;
+
+#ifdef STAT_TIMING
+    self->b_CacheMiss++;
+#endif
+
+    if (NULL != self->b_TileMgr)
     {
-        PyPixbuf *pb;
+        pb = (PyPixbuf *)TileMgrAPI->get_writable_tile(self->b_TileMgr, x, y); /* BR */
+        if (NULL == pb)
+            return NULL;
+    }
+    else
+    {
+        /* Not in cache, so ask to the surface to give it */
+        PyObject *o = PyObject_CallFunction(self->b_GetPixBufFunc, "ii", x, y); /* NR */
 
-        /* Stop on first invalid node */
-        if (!node->pbn_Valid)
+        if (NULL == o)
+            return NULL;
+
+        if (o == Py_None)
         {
-            first_invalid = node;
-            break;
+            Py_DECREF(o);
+            return (void *)-1;
+        }
+
+        /* the object is supposed to exist until the end of stroke.
+         * So decref it now is supposed to not delete the object.
+         */
+        Py_DECREF(o);
+
+        if (!PyPixbuf_Check(o))
+            return (void *)PyErr_Format(PyExc_TypeError,
+                                        "Surface get_pixbuf() method shall return Pixbuf instance only, not %s",
+                                        OBJ_TNAME(o));
+        pb = (PyPixbuf *)o;
+    }
+
+    *slot = pb;
+    return pb;
+}
+
+/* Give the range [*k1, *k2] of pixels of a dab row that may be inside the ellipse.
+ * The row has n pixels, rr(k) = (rx+k*rxdx)^2 + (ry+k*rydx)^2 is the square
+ * of the relative radius of the pixel k. Solving rr(k) = 1 gives the span,
+ * widened by one pixel to absorb rounding errors (pixels are still tested).
+ * Return FALSE if the row doesn't cross the ellipse.
+ */
+static int
+dab_row_span(float rx, float ry, float rxdx, float rydx, int n, int *k1, int *k2)
+{
+    double a = (double)rxdx*rxdx + (double)rydx*rydx;
+    double b = 2. * ((double)rx*rxdx + (double)ry*rydx);
+    double c = (double)rx*rx + (double)ry*ry - 1.;
+    double d = b*b - 4.*a*c;
+    int lo, hi;
+
+    if ((d < 0.) || (a <= 0.))
+        return FALSE;
+
+    d = sqrt(d);
+    lo = MAX(floor((-b - d) / (2.*a)) - 1., -1.);
+    hi = MIN(ceil((-b + d) / (2.*a)) + 1., (double)n);
+
+    *k1 = MAX(lo, 0);
+    *k2 = MIN(hi, n-1);
+
+    return *k1 <= *k2;
+}
+
+static GrainTexture *
+grain_new(int width, int height, float scale)
+{
+    GrainTexture *tex;
+
+    tex = AllocVecTaskPooled(sizeof(GrainTexture) + width*height*sizeof(float));
+    if (NULL == tex)
+    {
+        PyErr_NoMemory();
+        return NULL;
+    }
+
+    tex->gt_RefCount = 1;
+    tex->gt_Width = width;
+    tex->gt_Height = height;
+    tex->gt_Scale = scale;
+    tex->gt_Data = (float *)&tex[1];
+
+    return tex;
+}
+
+static void
+grain_release(GrainTexture *tex)
+{
+    if ((NULL != tex) && (--tex->gt_RefCount == 0))
+        FreeVecTaskPooled(tex);
+}
+
+/* Fill the texture with noise_2d() values.
+ * The noise is made tileable by blending it with its copies shifted
+ * by one texture period on each axis, weighted by the distance to the borders.
+ * The blend is renormalized to keep the noise contrast in the middle.
+ */
+static void
+grain_generate(GrainTexture *tex)
+{
+    float pu = tex->gt_Width / tex->gt_Scale;
+    float pv = tex->gt_Height / tex->gt_Scale;
+    float *data = tex->gt_Data;
+    int i, j;
+
+    for (j=0; j < tex->gt_Height; j++)
+    {
+        float v = j / tex->gt_Scale;
+        float wv = v / pv;
+
+        for (i=0; i < tex->gt_Width; i++)
+        {
+            float u = i / tex->gt_Scale;
+            float wu = u / pu;
+            float w00 = (1.f-wu) * (1.f-wv);
+            float w10 = wu * (1.f-wv);
+            float w01 = (1.f-wu) * wv;
+            float w11 = wu * wv;
+            float n;
+
+            n = w00 * noise_2d(u, v) + w10 * noise_2d(u-pu, v)
+                + w01 * noise_2d(u, v-pv) + w11 * noise_2d(u-pu, v-pv);
+            n /= sqrtf(w00*w00 + w10*w10 + w01*w01 + w11*w11);
+
+            *data++ = CLAMP((n + 1.f) * .5f, 0.f, 1.f);
+        }
+    }
+}
+
+/* Bilinear lookup of the grain texture at noise position (x, y) */
+static inline float
+grain_value(const GrainTexture *tex, float x, float y)
+{
+    float u = x * tex->gt_Scale;
+    float v = y * tex->gt_Scale;
+    float fu = floorf(u), fv = floorf(v);
+    float du = u - fu, dv = v - fv;
+    int i0 = (int)fu & (tex->gt_Width-1);
+    int j0 = (int)fv & (tex->gt_Height-1);
+    int i1 = (i0 + 1) & (tex->gt_Width-1);
+    int j1 = (j0 + 1) & (tex->gt_Height-1);
+    const float *row0 = &tex->gt_Data[j0*tex->gt_Width];
+    const float *row1 = &tex->gt_Data[j1*tex->gt_Width];
+    float a = row0[i0] + du * (row0[i1] - row0[i0]);
+    float b = row1[i0] + du * (row1[i1] - row1[i0]);
+
+    return a + dv * (b - a);
+}
+
+/* Take a reference on the current grain texture for the next dabs.
+ * The texture is generated at first use.
+ * The GIL must be held.
+ */
+static int
+brush_use_grain(PyBrush *self)
+{
+    if (NULL == grain_texture)
+    {
+        grain_texture = grain_new(GRAIN_DEFAULT_SIZE, GRAIN_DEFAULT_SIZE, GRAIN_DEFAULT_SCALE);
+        if (NULL == grain_texture)
+            return -1;
+
+        grain_generate(grain_texture);
+    }
+
+    if (self->b_Grain != grain_texture)
+    {
+        grain_release(self->b_Grain);
+        self->b_Grain = grain_texture;
+        grain_texture->gt_RefCount++;
+    }
+
+    return 0;
+}
+
+/* Compute dab opacity of n consecutive pixels of a row.
+ * (rx, ry) is the relative radius vector of the first pixel.
+ * Pixels outside the ellipse get a negative opacity.
+ * Return the number of pixels inside the ellipse.
+ *
+ * SSE2 and scalar code evaluate the same float expressions,
+ * so both give the same results.
+ */
+static int
+dab_span_opacity(float *opa, int n,
+                 float rx, float ry, float rxdx, float rydx,
+                 float opacity, float hardness,
+                 float grain, const GrainTexture *tex, float sx, float sy)
+{
+    float hfac = hardness < 1.0 ? hardness / (1.f - hardness) : 0.f;
+    int i=0, count=0;
+
+#ifdef __SSE2__
+    if (grain <= 0)
+    {
+        const __m128 v_one = _mm_set1_ps(1.f);
+        const __m128 v_out = _mm_set1_ps(-1.f);
+        const __m128 v_step = _mm_set_ps(3.f, 2.f, 1.f, 0.f);
+        const __m128 v_rx = _mm_set1_ps(rx);
+        const __m128 v_ry = _mm_set1_ps(ry);
+        const __m128 v_rxdx = _mm_set1_ps(rxdx);
+        const __m128 v_rydx = _mm_set1_ps(rydx);
+        const __m128 v_opa = _mm_set1_ps(opacity);
+        const __m128 v_hard = _mm_set1_ps(hardness);
+        const __m128 v_hfac = _mm_set1_ps(hfac);
+
+        for (; i+4 <= n; i += 4)
+        {
+            __m128 k = _mm_add_ps(_mm_set1_ps((float)i), v_step);
+            __m128 x = _mm_add_ps(v_rx, _mm_mul_ps(k, v_rxdx));
+            __m128 y = _mm_add_ps(v_ry, _mm_mul_ps(k, v_rydx));
+            __m128 rr = _mm_add_ps(_mm_mul_ps(x, x), _mm_mul_ps(y, y));
+            __m128 inside = _mm_cmple_ps(rr, v_one);
+            __m128 o = v_opa;
+            int mask = _mm_movemask_ps(inside);
+
+            if (!mask)
+            {
+                _mm_storeu_ps(&opa[i], v_out);
+                continue;
+            }
+
+            if (hardness < 1.0)
+            {
+                __m128 inner = _mm_mul_ps(v_opa, _mm_sub_ps(_mm_add_ps(rr, v_one), _mm_div_ps(rr, v_hard)));
+                __m128 outer = _mm_mul_ps(v_opa, _mm_mul_ps(v_hfac, _mm_sub_ps(v_one, rr)));
+                __m128 sel = _mm_cmplt_ps(rr, v_hard);
+
+                o = _mm_or_ps(_mm_and_ps(sel, inner), _mm_andnot_ps(sel, outer));
+            }
+
+            _mm_storeu_ps(&opa[i], _mm_or_ps(_mm_and_ps(inside, o), _mm_andnot_ps(inside, v_out)));
+            count += (mask & 1) + ((mask >> 1) & 1) + ((mask >> 2) & 1) + ((mask >> 3) & 1);
+        }
+    }
+#endif
+
+    for (; i < n; i++)
+    {
+        float x = rx + (float)i*rxdx;
+        float y = ry + (float)i*rydx;
+        float rr = x*x + y*y;
+
+        if (rr <= 1.0)
+        {
+            float o = opacity;
+
+            /* Computing inner opacity using hardness value
+             * as split point between two linear interpolations:
+             * - zz <= hardness: between opacity and opacity * hardness
+             * - zz >= hardness: between opacity * hardness and zero
+             *
+             * This gives a simple falloff function for zz in [0, 1]
+             */
+            if (hardness < 1.0)
+            {
+                if (rr < hardness)
+                    o = opacity * ((rr + 1.f) - rr/hardness);
+                else
+                    o = opacity * (hfac * (1.f - rr));
+            }
+
+            /* add a grain factor to opacity */
+            if (grain > 0)
+            {
+                float noise = grain_value(tex, sx + x*grain, sy + y*grain);
+
+                o = MIN(o * noise, 1.0);
+            }
+
+            opa[i] = o;
+            count++;
+        }
+        else
+            opa[i] = -1.f;
+    }
+
+    return count;
+}
+
+/* Specialised writepixel loop for ARGB15X pixels buffers.
+ * Same computations as argb15x_writepixel[_alpha_locked]() from _pixbuf,
+ * but inlined and without per pixel indirect calls.
+ */
+static inline void
+argb15x_write_span(uint16_t *pixel, const float *opa, int n,
+                   float erase, const uint16_t *color, const int alpha_locked)
+{
+    static const float delta = 1.f / (1<<16);
+    int i;
+
+    for (i=0; i < n; i++, pixel += 4)
+    {
+        float opacity = opa[i];
+        uint32_t alpha, one_minus_alpha;
+
+        if (opacity < 0)
+            continue;
+
+        opacity += delta;
+
+        /* Adding delta to round values */
+        alpha = (uint32_t)(opacity * erase * (1<<15));
+        one_minus_alpha = (1<<15) - (uint32_t)(opacity * (1<<15));
+
+        if (!alpha_locked)
+            /* A */ pixel[0] =  alpha          + one_minus_alpha*pixel[0]  / (1<<15);
+        /* R */ pixel[1] = (alpha*color[0] + one_minus_alpha*pixel[1]) / (1<<15);
+        /* G */ pixel[2] = (alpha*color[1] + one_minus_alpha*pixel[2]) / (1<<15);
+        /* B */ pixel[3] = (alpha*color[2] + one_minus_alpha*pixel[3]) / (1<<15);
+    }
+}
+
+/* Generic span writer, using the pixbuf writepixel function */
+static void
+generic_write_span(uint8_t *pixel, int bpp, const float *opa, int n,
+                   float erase, uint16_t *color, writefunc writepixel)
+{
+    int i;
+
+    for (i=0; i < n; i++, pixel += bpp)
+    {
+        if (opa[i] >= 0)
+            writepixel(pixel, opa[i], erase, color);
+    }
+}
+
+static void
+accum_free(PyBrush *self)
+{
+    int i;
+
+    for (i=0; i < ACCUM_HASH_SIZE; i++)
+    {
+        AccumBlock *block, *next;
+
+        for (block=self->b_AccumHash[i]; NULL != block; block=next)
+        {
+            next = block->ab_Next;
+            Py_DECREF(block->ab_Pixbuf);
+            FreeVecTaskPooled(block);
+        }
+
+        self->b_AccumHash[i] = NULL;
+    }
+
+    self->b_AccumDirty = NULL;
+}
+
+/* Return the accumulation block containing the pixel (x, y) of pb.
+ * Surface pixels under the block are saved at its creation.
+ * Return NULL and set a Python exception on error.
+ */
+static AccumBlock *
+accum_obtain_block(PyBrush *self, PyPixbuf *pb, int x, int y)
+{
+    const int count = ACCUM_BLOCK_SIZE*ACCUM_BLOCK_SIZE;
+    int bx = x & ~(ACCUM_BLOCK_SIZE-1);
+    int by = y & ~(ACCUM_BLOCK_SIZE-1);
+    unsigned int slot = ((bx >> ACCUM_BLOCK_SHIFT)*31 + (by >> ACCUM_BLOCK_SHIFT)) & (ACCUM_HASH_SIZE-1);
+    int bpp = (pb->bpc * pb->nc) >> 3;
+    int x1, y1, x2, y2, j;
+    AccumBlock *block;
+
+    for (block=self->b_AccumHash[slot]; NULL != block; block=block->ab_Next)
+    {
+        if ((block->ab_X == bx) && (block->ab_Y == by) && (block->ab_Pixbuf == pb))
+            return block;
+    }
+
+    block = AllocVecTaskPooled(sizeof(AccumBlock) + count*(5*sizeof(float) + bpp));
+    if (NULL == block)
+    {
+        PyErr_NoMemory();
+        return NULL;
+    }
+
+    block->ab_Cover = (float *)&block[1];
+    block->ab_Erase = block->ab_Cover + count;
+    block->ab_Color = block->ab_Erase + count;
+    block->ab_Orig = (uint8_t *)(block->ab_Color + 3*count);
+    bzero(block->ab_Cover, count*(5*sizeof(float) + bpp));
+
+    /* Save pixels of the block part inside the pixbuf */
+    x1 = MAX(bx, pb->x);
+    y1 = MAX(by, pb->y);
+    x2 = MIN(bx + ACCUM_BLOCK_SIZE, pb->x + (int)pb->width) - 1;
+    y2 = MIN(by + ACCUM_BLOCK_SIZE, pb->y + (int)pb->height) - 1;
+    for (j=y1; j <= y2; j++)
+        memcpy(block->ab_Orig + ((j-by)*ACCUM_BLOCK_SIZE + x1-bx)*bpp,
+               pb->data + (j-pb->y)*pb->bpr + (x1-pb->x)*bpp,
+               (x2-x1+1)*bpp);
+
+    Py_INCREF(pb);
+    block->ab_Pixbuf = pb;
+    block->ab_X = bx;
+    block->ab_Y = by;
+    block->ab_Queued = FALSE;
+    block->ab_Dirty.x1 = block->ab_Dirty.y1 = INT32_MAX;
+    block->ab_Dirty.x2 = block->ab_Dirty.y2 = INT32_MIN;
+
+    block->ab_Next = self->b_AccumHash[slot];
+    self->b_AccumHash[slot] = block;
+
+    return block;
+}
+
+/* Accumulate opacities of n pixels of a dab, from pixel (bx, by) of the block */
+static void
+accum_write_span(PyBrush *self, AccumBlock *block, int bx, int by,
+                 const float *opa, int n, float erase, const float *color)
+{
+    int i, j = by*ACCUM_BLOCK_SIZE + bx;
+    float *cover = &block->ab_Cover[j];
+    float *erase_fac = &block->ab_Erase[j];
+    float *stroke_color = &block->ab_Color[3*j];
+
+    for (i=0; i < n; i++, stroke_color += 3)
+    {
+        float o = opa[i], c = cover[i], w;
+
+        if (o <= 0)
+            continue;
+
+        if (ACCUMULATE_MAX == self->b_AccumMode)
+        {
+            if (o <= c)
+                continue;
+            cover[i] = o;
+            w = 1.f;
+        }
+        else
+        {
+            /* Dab over the stroke, values weighted by their opacity part */
+            cover[i] = c + o*(1.f - c);
+            w = o / cover[i];
         }
 
-        pb = (void *)node->pbn_Pixbuf;
+        erase_fac[i] += w * (erase - erase_fac[i]);
+        stroke_color[0] += w * (color[0] - stroke_color[0]);
+        stroke_color[1] += w * (color[1] - stroke_color[1]);
+        stroke_color[2] += w * (color[2] - stroke_color[2]);
+    }
+
+    block->ab_Dirty.x1 = MIN(block->ab_Dirty.x1, bx);
+    block->ab_Dirty.y1 = MIN(block->ab_Dirty.y1, by);
+    block->ab_Dirty.x2 = MAX(block->ab_Dirty.x2, bx+n-1);
+    block->ab_Dirty.y2 = MAX(block->ab_Dirty.y2, by);
 
-        /* (x,y) hits the pixbuf ? */
-        if ((x >= pb->x) && (x < (pb->x + pb->width))
-            && (y >= pb->y) && (y < (pb->y + pb->height)))
+    if (!block->ab_Queued)
+    {
+        block->ab_NextDirty = self->b_AccumDirty;
+        self->b_AccumDirty = block;
+        block->ab_Queued = TRUE;
+    }
+}
+
+/* Write the stroke accumulated since the last call in surface pixels.
+ * Each pixel is the saved surface pixel with the stroke color written over it
+ * using the stroke opacity: pixels are written once per segment, whatever the
+ * number of dabs covering them.
+ * Return -1 and set a Python exception on error.
+ */
+static int
+accum_composite(PyBrush *self)
+{
+    static const float delta = 1.f / (1<<16);
+    AccumBlock *block;
+
+    while (NULL != (block = self->b_AccumDirty))
+    {
+        PyPixbuf *pb = block->ab_Pixbuf;
+        MyRec *r = &block->ab_Dirty;
+        int bpp = (pb->bpc * pb->nc) >> 3;
+        int fast = pb->pixfmt == PyPixbuf_PIXFMT_ARGB_15X;
+        int alpha_locked = self->b_BasicValues[BV_ALPHA_LOCK] && pb->writepixel_alpha_locked;
+        writefunc writepixel = alpha_locked ? pb->writepixel_alpha_locked : pb->writepixel;
+        PyThreadState *ts = NULL;
+        int x, y, j;
+
+        self->b_AccumDirty = block->ab_NextDirty;
+        block->ab_NextDirty = NULL;
+        block->ab_Queued = FALSE;
+
+        /* Copy-on-write */
+        if (PyPixbuf_Unshare(pb))
+            return -1;
+
+        if (NULL != self->b_TileMgr)
         {
-            o = cached = (void *)pb;
+            if ((r->x2-r->x1+1)*(r->y2-r->y1+1) >= DAB_UNBLOCK_PIXELS)
+                ts = PyEval_SaveThread();
+            TileMgrAPI->lock_tile(self->b_TileMgr, pb->x, pb->y, TRUE);
+        }
 
-            /* Put this node in first (next call will be faster) */
-            if (self->b_PBFirst != node)
+        for (y=r->y1; y <= r->y2; y++)
+        {
+            int i = y*ACCUM_BLOCK_SIZE + r->x1;
+            uint8_t *orig = block->ab_Orig + i*bpp;
+            uint8_t *pixel = pb->data + (block->ab_Y + y - pb->y)*pb->bpr + (block->ab_X + r->x1 - pb->x)*bpp;
+
+            for (x=r->x1; x <= r->x2; x++, i++, orig += bpp, pixel += bpp)
             {
-                node->pbn_Previous->pbn_Next = node->pbn_Next;
+                float opacity = block->ab_Cover[i];
+                float *color = &block->ab_Color[3*i];
 
-                if (node->pbn_Next)
-                    node->pbn_Next->pbn_Previous = node->pbn_Previous;
+                if (opacity <= 0)
+                    continue;
+
+                if (fast)
+                {
+                    /* Same as argb15x_write_span() */
+                    uint16_t *src = (uint16_t *)orig;
+                    uint16_t *dst = (uint16_t *)pixel;
+                    uint32_t alpha, one_minus_alpha;
+
+                    opacity += delta;
+                    alpha = (uint32_t)(opacity * block->ab_Erase[i] * (1<<15));
+                    one_minus_alpha = (1<<15) - (uint32_t)(opacity * (1<<15));
+
+                    /* A */ dst[0] = alpha_locked ? src[0] : alpha + one_minus_alpha*src[0] / (1<<15);
+                    /* R */ dst[1] = (alpha*(uint16_t)(color[0] * (1<<15)) + one_minus_alpha*src[1]) / (1<<15);
+                    /* G */ dst[2] = (alpha*(uint16_t)(color[1] * (1<<15)) + one_minus_alpha*src[2]) / (1<<15);
+                    /* B */ dst[3] = (alpha*(uint16_t)(color[2] * (1<<15)) + one_minus_alpha*src[3]) / (1<<15);
+                }
                 else
-                    self->b_PBLast = node->pbn_Previous;
+                {
+                    uint16_t native_color[MAX_CHANNELS];
+
+                    for (j=0; j < pb->nc-1; j++)
+                        pb->cfromfloat(color[j], &native_color[j]);
 
-                node->pbn_Previous = NULL;
-                node->pbn_Next = self->b_PBFirst;
-                self->b_PBFirst->pbn_Previous = node;
-                self->b_PBFirst = node;
+                    memcpy(pixel, orig, bpp);
+                    writepixel(pixel, opacity, block->ab_Erase[i], native_color);
+                }
             }
+        }
 
-            break;
+        pb->damaged = TRUE;
+
+        if (NULL != self->b_TileMgr)
+        {
+            TileMgrAPI->unlock_tile(self->b_TileMgr, pb->x, pb->y);
+            if (NULL != ts)
+                PyEval_RestoreThread(ts);
         }
 
-        node = node->pbn_Next;
+        r->x1 = r->y1 = INT32_MAX;
+        r->x2 = r->y2 = INT32_MIN;
     }
 
-    if (NULL != first_invalid)
-        self->b_FirstInvalid = first_invalid;
+    return 0;
+}
+
+/* Search in the dab masks cache a mask for the given dab parameters,
+ * build it if not found.
+ * (sx, sy) is the dab center position, only its sub-pixel part is used.
+ * Return NULL and set a Python exception on error.
+ */
+static DabMask *
+obtain_dab_mask(PyBrush *self, float sx, float sy,
+                float radius, float yratio, float hardness,
+                float cs, float sn)
+{
+    DabMask *mask;
+    int key[7], j;
+
+    key[0] = lrintf(radius * DAB_MASK_RADIUS_STEPS);
+    key[1] = lrintf(yratio * DAB_MASK_YRATIO_STEPS);
+    key[4] = MAX(lrintf(hardness * DAB_MASK_HARDNESS_STEPS), 1);
+    key[5] = (int)((sx - floorf(sx)) * DAB_MASK_SUBPIXELS);
+    key[6] = (int)((sy - floorf(sy)) * DAB_MASK_SUBPIXELS);
+
+    /* Circles don't depend on the angle */
+    if (key[1] == DAB_MASK_YRATIO_STEPS)
+    {
+        key[2] = DAB_MASK_ANGLE_STEPS;
+        key[3] = 0;
+    }
     else
-        self->b_FirstInvalid = self->b_PBLast;
+    {
+        key[2] = lrintf(cs * DAB_MASK_ANGLE_STEPS);
+        key[3] = lrintf(sn * DAB_MASK_ANGLE_STEPS);
+    }
+
+    /* Rounding may give DAB_MASK_SUBPIXELS */
+    key[5] = MIN(key[5], DAB_MASK_SUBPIXELS-1);
+    key[6] = MIN(key[6], DAB_MASK_SUBPIXELS-1);
 
-    /* Not in cache, so ask to the surface to give it */
-    if (NULL == cached)
+    for (mask=self->b_MaskFirst; NULL != mask; mask=mask->dm_Next)
     {
-#ifdef STAT_TIMING
-        self->b_CacheMiss++;
-#endif
-        PyObject *args = PyTuple_New(2); /* NR */
+        if (!mask->dm_Valid)
+            break;
 
-        if (NULL == args)
-            return NULL;
+        if (!memcmp(mask->dm_Key, key, sizeof(key)))
+        {
+            self->b_MaskHits++;
+            goto found;
+        }
+    }
 
-        /* A bit dangerous in theory (no errors checking)
-         * but harmless in pratice as the tuple deallocation
-         * will call Py_XDECREF() on each items.
-         */
-        PyTuple_SET_ITEM(args, 0, PyInt_FromLong(x));
-        PyTuple_SET_ITEM(args, 1, PyInt_FromLong(y));
+    /* Not found, recycle the least recently used mask */
+    self->b_MaskMisses++;
+    mask = self->b_MaskLast;
+    mask->dm_Valid = FALSE;
 
-        /* Call the cached get_pixbuf surface method */
-        o = PyObject_Call(self->b_GetPixBufFunc, args, NULL); /* NR */
-        Py_DECREF(args);
+    /* Use quantised values, all dabs of a cache entry are identical */
+    radius = (float)key[0] / DAB_MASK_RADIUS_STEPS;
+    yratio = (float)key[1] / DAB_MASK_YRATIO_STEPS;
+    cs = (float)key[2] / DAB_MASK_ANGLE_STEPS;
+    sn = (float)key[3] / DAB_MASK_ANGLE_STEPS;
+    hardness = (float)key[4] / DAB_MASK_HARDNESS_STEPS;
 
-        if (NULL == o)
+    /* Same bounding box as drawdab_solid() one, plus the sub-pixel shift */
+    int origin = ceilf(radius + .5);
+    int size = 2*origin + 2;
+
+    if (mask->dm_AllocSize < (unsigned int)(size*size))
+    {
+        FreeVecTaskPooled(mask->dm_Spans);
+        mask->dm_Spans = AllocVecTaskPooled(size*size*sizeof(float) + 2*size*sizeof(int));
+        if (NULL == mask->dm_Spans)
+        {
+            mask->dm_AllocSize = 0;
+            PyErr_NoMemory();
             return NULL;
+        }
+        mask->dm_Alpha = (float *)&mask->dm_Spans[2*size];
+        mask->dm_AllocSize = size*size;
+    }
 
-        if (o == Py_None)
-            return (void *)-1;
+    memcpy(mask->dm_Key, key, sizeof(key));
+    mask->dm_Origin = origin;
+    mask->dm_Size = size;
 
-        /* the object is supposed to exist until the end of stroke.
-         * So decref it now is supposed to not delete the object.
-         */
-        Py_DECREF(o);
+    /* Dab center, middle of the sub-pixel cell */
+    float cx = origin + (key[5] + .5) / DAB_MASK_SUBPIXELS;
+    float cy = origin + (key[6] + .5) / DAB_MASK_SUBPIXELS;
 
-        if (!PyPixbuf_Check(o))
-            return (void *)PyErr_Format(PyExc_TypeError,
-                                        "Surface get_pixbuf() method shall return Pixbuf instance only, not %s",
-                                        OBJ_TNAME(o));
+    cs /= radius;
+    sn /= radius;
 
-        /* Take the first invalid room, replace pixbuf by this one,
-         * and add it to the cache as first entry.
-         */
-        self->b_FirstInvalid->pbn_Pixbuf = o;
-        self->b_FirstInvalid->pbn_Valid = TRUE;
-        node = self->b_FirstInvalid;
-        if (self->b_PBFirst != node)
-        {
-            node->pbn_Previous->pbn_Next = node->pbn_Next;
+    float rxdx = cs;
+    float rydx = -sn*yratio;
+    float rxdy = sn;
+    float rydy = cs*yratio;
 
-            if (node->pbn_Next)
-                node->pbn_Next->pbn_Previous = node->pbn_Previous;
-            else
-                self->b_PBLast = node->pbn_Previous;
+    for (j=0; j < size; j++)
+    {
+        float *alpha = &mask->dm_Alpha[j*size];
+        float xx0 = .5 - cx;
+        float yy0 = (float)j - cy + .5;
+        float rx = xx0*rxdx + yy0*rxdy;
+        float ry = xx0*rydx + yy0*rydy;
+        int i, k1, k2;
+
+        for (i=0; i < size; i++)
+            alpha[i] = -1.f;
 
-            node->pbn_Previous = NULL;
-            node->pbn_Next = self->b_PBFirst;
-            self->b_PBFirst->pbn_Previous = node;
-            self->b_PBFirst = node;
+        if (dab_row_span(rx, ry, rxdx, rydx, size, &k1, &k2))
+        {
+            dab_span_opacity(&alpha[k1], k2-k1+1,
+                             rx + (float)k1*rxdx, ry + (float)k1*rydx,
+                             rxdx, rydx, 1.0, hardness, 0.0, NULL, 0.0, 0.0);
+            mask->dm_Spans[2*j] = k1;
+            mask->dm_Spans[2*j+1] = k2;
+        }
+        else
+        {
+            mask->dm_Spans[2*j] = 0;
+            mask->dm_Spans[2*j+1] = -1;
         }
     }
 
-    return (void *)o;
+    mask->dm_Valid = TRUE;
+
+found:
+    /* Move as first entry */
+    if (self->b_MaskFirst != mask)
+    {
+        mask->dm_Previous->dm_Next = mask->dm_Next;
+
+        if (mask->dm_Next)
+            mask->dm_Next->dm_Previous = mask->dm_Previous;
+        else
+            self->b_MaskLast = mask->dm_Previous;
+
+        mask->dm_Previous = NULL;
+        mask->dm_Next = self->b_MaskFirst;
+        self->b_MaskFirst->dm_Previous = mask;
+        self->b_MaskFirst = mask;
+    }
+
+    return mask;
 }
 
 /* Solid elliptical filling engine */
@@ -394,19 +1105,39 @@ drawdab_solid(PyBrush *self,        /* In: brush object */
     int minx, miny, maxx, maxy, x, y, need_color=TRUE;
     float grain;
     uint16_t native_color[MAX_CHANNELS];
+    DabMask *mask = NULL;
 
     DPRINT("BDraw: pos=(%f, %f), radius=%f\n", sx, sy, radius);
 
-    /* Compute dab bounding box
-     * FIXME: yratio is not used here,
-     * not optimal for big radius and small ratio.
-     */
-    /* draw something even when radius is below 1 */
-    float rad_box = radius + .5;
-    minx = floorf(sx - rad_box);
-    maxx = ceilf(sx + rad_box);
-    miny = floorf(sy - rad_box);
-    maxy = ceilf(sy + rad_box);
+    grain = self->b_BasicValues[BV_GRAIN_FAC] * radius;
+    if ((grain > 0) && brush_use_grain(self))
+        return -1;
+
+    /* Stamp a cached mask when possible (grain depends on the position) */
+    if ((grain <= 0) && (radius >= DAB_MASK_MIN_RADIUS) && (radius <= DAB_MASK_MAX_RADIUS))
+    {
+        mask = obtain_dab_mask(self, sx, sy, radius, yratio, hardness, cs, sn);
+        if (NULL == mask)
+            return -1;
+
+        minx = (int)floorf(sx) - mask->dm_Origin;
+        miny = (int)floorf(sy) - mask->dm_Origin;
+        maxx = minx + mask->dm_Size - 1;
+        maxy = miny + mask->dm_Size - 1;
+    }
+    else
+    {
+        /* Compute dab bounding box
+         * FIXME: yratio is not used here,
+         * not optimal for big radius and small ratio.
+         */
+        /* draw something even when radius is below 1 */
+        float rad_box = radius + .5;
+        minx = floorf(sx - rad_box);
+        maxx = ceilf(sx + rad_box);
+        miny = floorf(sy - rad_box);
+        maxy = ceilf(sy + rad_box);
+    }
 
     DPRINT("BDraw: bbox = (%d, %d, %d, %d) (radius=%f)\n", minx, miny, maxx, maxy, radius);
 
@@ -419,8 +1150,6 @@ drawdab_solid(PyBrush *self,        /* In: brush object */
     DPRINT("BDraw: update area = (%ld, %ld, %ld, %ld)\n",
             area->x1, area->y1, area->x2, area->y2);
 
-    grain = self->b_BasicValues[BV_GRAIN_FAC] * radius;
-
     cs /= radius;
     sn /= radius;
 
@@ -433,12 +1162,15 @@ drawdab_solid(PyBrush *self,        /* In: brush object */
     /* Loop on all pixels inside a bbox centered on (sx, sy) */
     for (y=miny; y <= maxy;)
     {
+        /* Rows done by the last pixels buffer of the row, one if none */
+        unsigned int by_top=0, by_bottom=0;
+
         for (x=minx; x <= maxx;)
         {
             PyPixbuf *pb;
             uint8_t *buf;
-            unsigned int bx_left, bx_right, by_top, by_bottom;
-            unsigned int bx, by; /* x, y in buffer space */
+            unsigned int bx_left, bx_right;
+            unsigned int by; /* y in buffer space */
             int bpp;
 
             START_TIMER(self, 2);
@@ -457,9 +1189,14 @@ drawdab_solid(PyBrush *self,        /* In: brush object */
                 goto next_pixel;
             }
 
+            /* Copy-on-write */
+            if (PyPixbuf_Unshare(pb))
+                return -1;
+
             writefunc writepixel;
+            int alpha_locked = self->b_BasicValues[BV_ALPHA_LOCK] && pb->writepixel_alpha_locked;
 
-            if (self->b_BasicValues[BV_ALPHA_LOCK] && pb->writepixel_alpha_locked)
+            if (alpha_locked)
                 writepixel = pb->writepixel_alpha_locked;
             else
                 writepixel = pb->writepixel;
@@ -488,6 +1225,19 @@ drawdab_solid(PyBrush *self,        /* In: brush object */
             by_top = y - pb->y;
             by_bottom = MIN(by_top+(maxy-y), pb->height-1);
 
+            /* Accumulated strokes: pixels of one block at a time */
+            AccumBlock *block = NULL;
+
+            if (self->b_AccumMode)
+            {
+                block = accum_obtain_block(self, pb, x, y);
+                if (NULL == block)
+                    return -1;
+
+                bx_right = MIN(bx_right, (unsigned int)(block->ab_X + ACCUM_BLOCK_SIZE - 1 - pb->x));
+                by_bottom = MIN(by_bottom, (unsigned int)(block->ab_Y + ACCUM_BLOCK_SIZE - 1 - pb->y));
+            }
+
             /* Shift pixel pointer on the line containing the first pixel to process */
             bpp = (pb->bpc * pb->nc) >> 3;
             buf = pb->data + by_top*pb->bpr;
@@ -500,8 +1250,8 @@ drawdab_solid(PyBrush *self,        /* In: brush object */
 
             /* linear coef. to compute pixels distance from center
              * using a scanline processing.
-             * This is just a simple ellipse computation evaluated for each pixels,
-             * using left to right and top to bottom processing.
+             * This is just a simple ellipse computation evaluated for each rows,
+             * using top to bottom processing.
              */
 
             /* Set origin at the ellipse center, pixel centered */
@@ -512,63 +1262,89 @@ drawdab_solid(PyBrush *self,        /* In: brush object */
             float rxy = xx0*rxdx + yy0*rxdy;
             float ryy = xx0*rydx + yy0*rydy;
 
-			/* Filling one pixel buffer (inner loop) */
-			int damaged = 0;
+            /* Filling one pixel buffer (inner loop).
+             * Only the span of each row covered by the ellipse is processed:
+             * the wasted surface of pixels of the bbox has a quadratic grow
+             * (Sw(r) = (4-pi) * r^2), a problem for large radius.
+             * Tiles may be read meanwhile by render threads, so the tile
+             * is locked during pixels writing, and the GIL is released
+             * if there are enough pixels to let other threads run.
+             */
+            int damaged = 0;
+            int fast = pb->pixfmt == PyPixbuf_PIXFMT_ARGB_15X;
+            PyThreadState *ts = NULL;
+
+            if ((NULL != self->b_TileMgr) && (NULL == block))
+            {
+                if ((bx_right-bx_left+1)*(by_bottom-by_top+1) >= DAB_UNBLOCK_PIXELS)
+                    ts = PyEval_SaveThread();
+                TileMgrAPI->lock_tile(self->b_TileMgr, pb->x, pb->y, TRUE);
+            }
             for (by=by_top; by <= by_bottom; by++, rxy += rxdy, ryy += rydy, buf += pb->bpr)
             {
-                uint8_t *pixel = buf + bx_left*bpp; /* X-axis offset */
-                float rx = rxy;
-                float ry = ryy;
+                int k, k1, k2;
+                float *mask_row = NULL;
 
-                for (bx=bx_left; bx <= bx_right; bx++, rx += rxdx, ry += rydx, pixel += bpp)
+                if (NULL != mask)
                 {
-                    /* Compute the square of pixel radius: rr^2 = rx^2 + ry^2
-                     * Divide by the square of the ellipse radius to have
-                     * a number relative to this radius (done in cs,sn).
-                     * Here this division is done during computation of rx and ry.
-                     * Any point (x,y) is inside the ellipse, when the distance from
-                     * the center is bellow or equal to the ellipse's radius.
-                     *
-                     * Note: one major problem of this method occures when the radius is large,
-                     * as the wasted surface of pixels (pixels where the following condition is false)
-                     * has a quadratic grow (Sw(r) = (4-pi) * r^2).
-                     */
+                    /* Mask coordinates of the buffer pixel (bx_left, by) */
+                    int mx = pb->x + bx_left - minx;
+                    int my = pb->y + by - miny;
 
-                    float rr = rx*rx + ry*ry;
+                    k1 = MAX(mask->dm_Spans[2*my] - mx, 0);
+                    k2 = MIN(mask->dm_Spans[2*my+1] - mx, (int)(bx_right-bx_left));
+                    if (k1 > k2)
+                        continue;
 
-                    if (rr <= 1.0)
-                    {
-                        float opa = opacity;
-
-						/* Computing inner opacity using hardness value
-						 * as split point between two linear interpolations:
-						 * - zz <= hardness: between opacity and opacity * hardness
-						 * - zz >= hardness: between opacity * hardness and zero
-						 *
-						 * This gives a simple falloff function for zz in [0, 1]
-						 */
-                        if (hardness < 1.0)
-                        {
-                            if (rr < hardness)
-								opa *= rr + 1.0-(rr/hardness);
-                            else
-								opa *= hardness/(1.0-hardness)*(1.0-rr);
-                        }
+                    mask_row = &mask->dm_Alpha[my*mask->dm_Size + mx];
+                }
+                else if (!dab_row_span(rxy, ryy, rxdx, rydx, bx_right-bx_left+1, &k1, &k2))
+                    continue;
 
-						/* add a grain factor to opacity */
-                        if (grain > 0)
-                        {
-                            float noise = (noise_2d(sx + rx*grain, sy + ry*grain)+1.)*.5;
+                for (k=k1; k <= k2; k += DAB_SPAN_CHUNK)
+                {
+                    float opa[DAB_SPAN_CHUNK];
+                    uint8_t *pixel = buf + (bx_left+k)*bpp; /* X-axis offset */
+                    int i, n = MIN(k2-k+1, DAB_SPAN_CHUNK);
 
-                            opa = MIN(opa * noise, 1.0);
-                        }
+                    if (NULL != mask_row)
+                    {
+                        for (i=0; i < n; i++)
+                            opa[i] = mask_row[k+i] * opacity;
+                    }
+                    else if (!dab_span_opacity(opa, n,
+                                               rxy + (float)k*rxdx, ryy + (float)k*rydx,
+                                               rxdx, rydx, opacity, hardness, grain,
+                                               self->b_Grain, sx, sy))
+                        continue;
 
-                        writepixel(pixel, opa, alpha, native_color);
-						damaged = 1;
+                    if (NULL != block)
+                    {
+                        accum_write_span(self, block,
+                                         pb->x + bx_left + k - block->ab_X, pb->y + by - block->ab_Y,
+                                         opa, n, alpha, color);
+                        continue;
                     }
+
+                    if (!fast)
+                        generic_write_span(pixel, bpp, opa, n, alpha, native_color, writepixel);
+                    else if (alpha_locked)
+                        argb15x_write_span((uint16_t *)pixel, opa, n, alpha, native_color, TRUE);
+                    else
+                        argb15x_write_span((uint16_t *)pixel, opa, n, alpha, native_color, FALSE);
+
+                    damaged = 1;
                 }
             }
-			pb->damaged = damaged;
+			if (damaged)
+				pb->damaged = TRUE;
+
+            if ((NULL != self->b_TileMgr) && (NULL == block))
+            {
+                TileMgrAPI->unlock_tile(self->b_TileMgr, pb->x, pb->y);
+                if (NULL != ts)
+                    PyEval_RestoreThread(ts);
+            }
 
 			STOP_TIMER(self, 1);
 
@@ -586,7 +1362,12 @@ next_pixel:
     return 0;
 }
 
-/* Get the average color under a dabs */
+/* Get the average color under a dabs.
+ * When the dab covers more than 'samples' pixels (0 for no limit),
+ * only one pixel per cell of a grid is read, at a position jittered
+ * inside the cell (stratified sampling).
+ * The grid is aligned on the surface, so overlapping dabs read the same pixels.
+ */
 static int
 get_dab_color(PyBrush *self,       /* In: */
               PyObject *surface,   /* In: Give information on color space also */
@@ -596,11 +1377,12 @@ get_dab_color(PyBrush *self,       /* In: */
               float hardness,      /* In: Dabs hardness => gives the pixel weight */
               float cs,            /* In: Dabs angle (cosinus) */
               float sn,            /* In: Dabs angle (sinus) */
+              int samples,         /* In: Maximal number of pixels to read, 0 for all */
               float *color         /* Out: resulting color */
     )
 {
     float sums[MAX_CHANNELS], sum_weight;
-    int minx, miny, maxx, maxy, x, y, i, chan_count;
+    int minx, miny, maxx, maxy, x, y, i, chan_count, step=1;
 
     /* WARNING: code duplication with drawdab_solid */
 
@@ -627,14 +1409,72 @@ get_dab_color(PyBrush *self,       /* In: */
     float rxdy = sn;
     float rydy = cs*yratio;
 
+    if (samples > 0)
+        step = sqrtf(M_PI * radius * radius / (yratio * samples));
+
+    if (step > 1)
+    {
+        int cx, cy;
+
+        for (cy=floor_div(miny, step); cy <= floor_div(maxy, step); cy++)
+        {
+            for (cx=floor_div(minx, step); cx <= floor_div(maxx, step); cx++)
+            {
+                uint32_t h = hash_2d(cx, cy);
+                PyPixbuf *pb;
+
+                x = cx*step + h % step;
+                y = cy*step + (h >> 16) % step;
+
+                float xx = (float)x - sx + .5;
+                float yy = (float)y - sy + .5;
+                float rx = xx*rxdx + yy*rxdy;
+                float ry = xx*rydx + yy*rydy;
+                float rr = rx*rx + ry*ry;
+
+                if (rr > 1.0)
+                    continue;
+
+                pb = obtain_pixbuffer(self, surface, x, y);
+                if (NULL == pb)
+                    return -1;
+
+                if ((void *)-1 == pb)
+                    continue;
+
+                float opa = 1.0;
+                uint16_t tmp_color[MAX_CHANNELS];
+                uint8_t *pixel = pb->data + (y - pb->y)*pb->bpr + (x - pb->x)*((pb->bpc * pb->nc) >> 3);
+
+                if (hardness < 1.0)
+                {
+                    if (rr < hardness)
+                        opa *= rr + 1.0-(rr/hardness);
+                    else
+                        opa *= hardness/(1.0-hardness)*(1.0-rr);
+                }
+                sum_weight += opa;
+
+                pb->readpixel(pixel, tmp_color);
+                for (i=0; i<chan_count; i++)
+                    sums[i] += opa * pb->ctofloat(&tmp_color[i]);
+            }
+        }
+
+        goto average;
+    }
+
     /* Loop on all pixels inside a bbox centered on (sx, sy) */
     for (y=miny; y <= maxy;)
     {
+        /* Rows done by the last pixels buffer of the row, one if none */
+        unsigned int by_top=0, by_bottom=0;
+
         for (x=minx; x <= maxx;)
         {
             PyPixbuf *pb;
             uint8_t *buf;
-            unsigned int bx_left, bx_right, by_top, by_bottom;
+            unsigned int bx_left, bx_right;
             unsigned int bx, by; /* x, y in buffer space */
             int bpp;
 
@@ -711,6 +1551,7 @@ next_pixel:
         }
     }
 
+average:
     /* no weight => no color => full transparency */
     if (!sum_weight)
         return 1;
@@ -790,7 +1631,7 @@ process_smudge(PyBrush *self,
     /* Get the average color under the brush */
     err = get_dab_color(self, self->b_Surface,
                         x, y, radius, yratio, hardness,
-                        cs, sn, avg_color);
+                        cs, sn, (int)self->b_BasicValues[BV_SMUDGE_SAMPLES], avg_color);
     if (err < 0) return 1;
 
     /* fully transparent? */
@@ -840,9 +1681,11 @@ get_opacity_from_pressure(PyBrush *self, float pressure)
  *
  * We can see that this method need to buffer enough points
  * before drawing anything (4 points).
+ *
+ * Return -1 and set a Python exception on error.
  */
 
-static void
+static int
 _draw_stroke(PyBrush *self, Point *pt[4], MyRec *area)
 {
     float hardness, spacing, yratio;
@@ -873,7 +1716,11 @@ _draw_stroke(PyBrush *self, Point *pt[4], MyRec *area)
     //printf("start: p=%g, r=%g\n", p, r);
     //printf("end:   p=%g, r=%g\n", pressure, radius);
 
+    /* Dabs overlapping compensation, not needed if only the max opacity is kept */
     float fac = self->b_BasicValues[BV_OPACITY_COMPENSATION] / spacing;
+    if (ACCUMULATE_MAX == self->b_AccumMode)
+        fac = 1.0;
+
     float opa0 = powf(pt[1]->p_Opacity, fac);
     float opa1 = powf(pt[2]->p_Opacity, fac);
 
@@ -957,15 +1804,15 @@ _draw_stroke(PyBrush *self, Point *pt[4], MyRec *area)
 		/* Per-dab radius jitter */
 		jitter = self->b_BasicValues[BV_DAB_RADIUS_JITTER];
 		if (jitter > 0.0)
-			dab_r *= 1. - myrand2()*jitter;
+			dab_r *= 1. - myrand2(&self->b_RandState[1])*jitter;
 
 		/* Per-dab position jitter (from dab radius) */
 		jitter = self->b_BasicValues[BV_DAB_POS_JITTER];
 		if (jitter > 0.0)
 		{
 			jitter *= dab_r;
-			dab_x += (myrand1()*2-1)*jitter;
-			dab_y += (myrand2()*2-1)*jitter;
+			dab_x += (myrand1(&self->b_RandState[0])*2-1)*jitter;
+			dab_y += (myrand2(&self->b_RandState[1])*2-1)*jitter;
 		}
 
 		/* Direction jitter */
@@ -975,7 +1822,7 @@ _draw_stroke(PyBrush *self, Point *pt[4], MyRec *area)
 			int da;
 
 			/* Dabs are round by nature, so random factor is limited to +-90 */
-			da = dir_angle + ((int)(myrand1()*jitter*512)-256);
+			da = dir_angle + ((int)(myrand1(&self->b_RandState[0])*jitter*512)-256);
 
 			/* Cos/Sin tables are oversized to remove a modulo usage.
 			 * So only negative values protection remains.
@@ -992,7 +1839,7 @@ _draw_stroke(PyBrush *self, Point *pt[4], MyRec *area)
 						   dab_r, yratio, self->b_cs, self->b_sn,
 						   hardness, color, &alpha))
 		{
-			return;
+			return -1;
 		}
 
 		/* Color HSV shift */
@@ -1023,7 +1870,7 @@ _draw_stroke(PyBrush *self, Point *pt[4], MyRec *area)
 						  alpha, opa,
 						  self->b_cs, self->b_sn, color))
 		{
-			return;
+			return -1;
 		}
 
 #ifdef STAT_TIMING
@@ -1041,6 +1888,9 @@ _draw_stroke(PyBrush *self, Point *pt[4], MyRec *area)
     }
 
     self->b_RemainSteps = dabs_frac + dabs_todo;
+
+    /* Accumulated dabs are written once per segment */
+    return accum_composite(self);
 }
 
 /*******************************************************************************************
@@ -1056,22 +1906,24 @@ brush_new(PyTypeObject *type, PyObject *args)
     self = (PyBrush *)type->tp_alloc(type, 0); /* NR */
     if (NULL != self)
     {
-        PBNode *node, *prev=NULL;
         int i;
 
-        /* Init pixbuf cache nodes */
-        for (i=0; i < PB_CACHE_SIZE; i++)
+        self->b_PBShift = -1;
+
+        /* Init dab masks cache */
+        DabMask *mask, *prev_mask=NULL;
+        for (i=0; i < DAB_MASK_CACHE_SIZE; i++)
         {
-            node = &self->b_PBCache[i];
-            node->pbn_Previous = prev;
-            if (NULL != prev)
-                prev->pbn_Next = node;
-            prev = node;
+            mask = &self->b_MaskCache[i];
+            mask->dm_Previous = prev_mask;
+            if (NULL != prev_mask)
+                prev_mask->dm_Next = mask;
+            prev_mask = mask;
         }
-        node->pbn_Next = NULL;
+        mask->dm_Next = NULL;
 
-        self->b_PBFirst = self->b_FirstInvalid = &self->b_PBCache[0];
-        self->b_PBLast = node;
+        self->b_MaskFirst = &self->b_MaskCache[0];
+        self->b_MaskLast = mask;
 
         self->b_BasicValues[BV_RADIUS_MIN] = 2.0;
         self->b_BasicValues[BV_RADIUS_MAX] = 2.0;
@@ -1084,6 +1936,7 @@ brush_new(PyTypeObject *type, PyObject *args)
         self->b_BasicValues[BV_SPACING] = 0.25;
         self->b_BasicValues[BV_MOTION_TRACK] = 0.3;
         self->b_BasicValues[BV_HI_SPEED_TRACK] = 0.0;
+        self->b_BasicValues[BV_SMUDGE_SAMPLES] = 512;
 
         /* let remaining fields to 0 */
     }
@@ -1096,6 +1949,7 @@ brush_traverse(PyBrush *self, visitproc visit, void *arg)
 {
     Py_VISIT(self->b_GetPixBufFunc);
     Py_VISIT(self->b_Surface);
+    Py_VISIT(self->b_TileMgr);
     return 0;
 }
 
@@ -1104,12 +1958,20 @@ brush_clear(PyBrush *self)
 {
     Py_CLEAR(self->b_GetPixBufFunc);
     Py_CLEAR(self->b_Surface);
+    Py_CLEAR(self->b_TileMgr);
     return 0;
 }
 
 static void
 brush_dealloc(PyBrush *self)
 {
+    int i;
+
+    for (i=0; i < DAB_MASK_CACHE_SIZE; i++)
+        FreeVecTaskPooled(self->b_MaskCache[i].dm_Spans);
+    grain_release(self->b_Grain);
+    accum_free(self);
+
     brush_clear(self);
     self->ob_type->tp_free((PyObject *)self);
 }
@@ -1155,23 +2017,28 @@ brush_drawdab_solid(PyBrush *self, PyObject *args)
                       self->b_BasicValues[BV_OPACITY_MAX], 0.707106, 0.707106, self->b_RGBColor))
         Py_RETURN_NONE;
 
+    if (accum_composite(self))
+        return NULL;
+
     return Py_BuildValue("iiii", area.x1, area.y1, area.x2, area.y2);
 }
 
-static PyObject *
-brush_drawstroke(PyBrush *self, PyObject *args)
+/* Add a device state to the stroke and draw dabs if enough points are recorded.
+ * Damaged area is merged into 'area'.
+ * Return -1 and set a Python exception on error.
+ */
+static int
+add_stroke_state(PyBrush *self,
+                 float sx, float sy,    /* In: device position (surface units) */
+                 int ix, int iy,        /* In: device position (view units) */
+                 double time,           /* In: event time (seconds) */
+                 float tiltx, float tilty,
+                 float pressure,
+                 MyRec *area)
 {
     Point *pt[4];
-    PyObject *state;
-	int i, j, ix, iy;
-	float sx, sy, radius, dist, pressure, dx, dy, tiltx, tilty;
-	double time;
-
-    if (NULL == self->b_Surface)
-        return PyErr_Format(PyExc_RuntimeError, "Uninitialized brush");
-
-	if (!PyArg_ParseTuple(args, "O", &state))
-		return NULL;
+	int i, j;
+	float radius, dist, dx, dy;
 
 	/* Compute a points array with following indexes:
 	 * 0 : last starting point
@@ -1189,26 +2056,19 @@ brush_drawstroke(PyBrush *self, PyObject *args)
 		pt[i] = &self->b_Points[(i + j) % 4];
 
 	/* Don't insert new point if no movement */
-	GET_2T_FLOAT_FROM_STROKE(state, sx, sy, "spos");
 	dx = sx - pt[2]->p_SX;
 	dy = sy - pt[2]->p_SY;
 	dist = hypotf(dx, dy);
 
 	if (dist == 0.)
-		Py_RETURN_NONE;
-
-	GET_2T_INT_FROM_STROKE(state, ix, iy, "vpos");
-	GET_FLOAT_FROM_STROKE(state, time, "time");
-	GET_FLOAT_FROM_STROKE(state, tiltx, "xtilt");
-	GET_FLOAT_FROM_STROKE(state, tilty, "ytilt");
+		return 0;
 
 	/* computing dynamic brush parameters */
-	GET_FLOAT_FROM_STROKE(state, pressure, "pressure");
 	pressure = CLAMP(pressure, 0.0, 1.0);
 	radius = get_radius_from_pressure(self, pressure);
 
 	if (0.0 == radius)
-		Py_RETURN_NONE;
+		return 0;
 
 	double dtime = time - pt[2]->p_Time;
 
@@ -1243,21 +2103,89 @@ brush_drawstroke(PyBrush *self, PyObject *args)
 	if (self->b_NeededPoints > 0)
 	{
 		self->b_NeededPoints--;
-		Py_RETURN_NONE;
+		return 0;
 	}
 
 	self->b_PointIndex = (self->b_PointIndex + 1) % 4;
 
     /* Drawing dabs between pt[1] and pt[2] */
+	return _draw_stroke(self, pt, area);
+}
+
+static PyObject *
+brush_drawstroke(PyBrush *self, PyObject *args)
+{
+    PyObject *state;
+	int ix, iy;
+	float sx, sy, pressure, tiltx, tilty;
+	double time;
     MyRec area;
 
+    if (NULL == self->b_Surface)
+        return PyErr_Format(PyExc_RuntimeError, "Uninitialized brush");
+
+	if (!PyArg_ParseTuple(args, "O", &state))
+		return NULL;
+
+	GET_2T_FLOAT_FROM_STROKE(state, sx, sy, "spos");
+	GET_2T_INT_FROM_STROKE(state, ix, iy, "vpos");
+	GET_FLOAT_FROM_STROKE(state, time, "time");
+	GET_FLOAT_FROM_STROKE(state, tiltx, "xtilt");
+	GET_FLOAT_FROM_STROKE(state, tilty, "ytilt");
+	GET_FLOAT_FROM_STROKE(state, pressure, "pressure");
+
+    area.x1 = area.y1 = INT32_MAX;
+    area.x2 = area.y2 = INT32_MIN;
+
+    if (add_stroke_state(self, sx, sy, ix, iy, time, tiltx, tilty, pressure, &area))
+        return NULL;
+
+    /* something drawn? */
+    if (area.x1 != INT32_MAX)
+        return Py_BuildValue("iiII", area.x1, area.y1, area.x2-area.x1+1, area.y2-area.y1+1);
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+brush_drawstrokes(PyBrush *self, PyObject *args)
+{
+    const char *states;
+    double state[STROKE_STATE_SIZE];
+    int size, count, i;
+    MyRec area;
+
+    if (NULL == self->b_Surface)
+        return PyErr_Format(PyExc_RuntimeError, "Uninitialized brush");
+
+	if (!PyArg_ParseTuple(args, "s#", &states, &size))
+		return NULL;
+
+    if (size % (STROKE_STATE_SIZE * sizeof(double)))
+        return PyErr_Format(PyExc_ValueError,
+                            "Buffer size is not a multiple of %u doubles",
+                            STROKE_STATE_SIZE);
+
+    count = size / (STROKE_STATE_SIZE * sizeof(double));
+
     area.x1 = area.y1 = INT32_MAX;
     area.x2 = area.y2 = INT32_MIN;
 
-	_draw_stroke(self, pt, &area);
+    for (i=0; i < count; i++, states += sizeof(state))
+    {
+        /* The buffer may be a str, without any alignment guarantee */
+        memcpy(state, states, sizeof(state));
+
+        if (add_stroke_state(self,
+                             state[SS_SX], state[SS_SY],
+                             state[SS_VX], state[SS_VY],
+                             state[SS_TIME],
+                             state[SS_XTILT], state[SS_YTILT],
+                             state[SS_PRESSURE], &area))
+            return NULL;
+    }
 
     /* something drawn? */
-    //printf("%d %d %d %d\n", area.x1, area.y1, area.x2, area.y2);
     if (area.x1 != INT32_MAX)
         return Py_BuildValue("iiII", area.x1, area.y1, area.x2-area.x1+1, area.y2-area.y1+1);
 
@@ -1294,9 +2222,8 @@ brush_invalid_cache(PyBrush *self)
 #endif
 
     /* invalidate the whole cache */
-    for (i=0; i < PB_CACHE_SIZE; i++)
-        self->b_PBCache[i].pbn_Valid = FALSE;
-    self->b_FirstInvalid = &self->b_PBCache[0];
+    for (i=0; i < PB_CACHE_GRID*PB_CACHE_GRID; i++)
+        self->b_PBCache[i] = NULL;
 
     Py_RETURN_NONE;
 }
@@ -1315,6 +2242,13 @@ brush_stroke_start(PyBrush *self, PyObject *args)
     self->b_PointIndex = 0;
     self->b_NeededPoints = 2;
 
+    accum_free(self);
+    self->b_AccumMode = self->b_BasicValues[BV_ACCUMULATE];
+
+    /* Same seed, same jitters: strokes can be replayed */
+    self->b_RandState[0] = self->b_Seed;
+    self->b_RandState[1] = self->b_Seed ^ 0x1fa9b36;
+
     /* Read first point states (p0) */
     pt = &self->b_Points[0];
 
@@ -1368,6 +2302,7 @@ static PyObject *
 brush_stroke_end(PyBrush *self, PyObject *args)
 {
 	Point *pt[4];
+	PyObject *res = NULL;
 
 	if (!self->b_NeededPoints)
 	{
@@ -1383,19 +2318,29 @@ brush_stroke_end(PyBrush *self, PyObject *args)
 		memcpy(pt[3], pt[2], sizeof(Point));
 		pt[3]->p_SX = pt[3]->p_SXo;
 		pt[3]->p_SY = pt[3]->p_SYo;
-		_draw_stroke(self, pt, &area);
+		if (_draw_stroke(self, pt, &area))
+			goto out;
 
 		for (i=0; i < 4; i++)
 			pt[i] = &self->b_Points[(i + self->b_PointIndex + 1) % 4];
 		memcpy(pt[3], pt[2], sizeof(Point));
-		_draw_stroke(self, pt, &area);
+		if (_draw_stroke(self, pt, &area))
+			goto out;
 
 		/* something drawn? */
 		if (area.x1 != INT32_MAX)
-			return Py_BuildValue("iiII", area.x1, area.y1, area.x2-area.x1+1, area.y2-area.y1+1);
+			res = Py_BuildValue("iiII", area.x1, area.y1, area.x2-area.x1+1, area.y2-area.y1+1);
+		else
+			res = Py_None, Py_INCREF(res);
 	}
+	else
+		res = Py_None, Py_INCREF(res);
 
-    Py_RETURN_NONE;
+out:
+	accum_free(self);
+	self->b_AccumMode = ACCUMULATE_NONE;
+
+    return res;
 }
 
 static PyObject *
@@ -1418,7 +2363,8 @@ brush_get_pixel(PyBrush *self, PyObject *args)
     err = get_dab_color(self, self->b_Surface,
                         x, y,
                         self->b_BasicValues[BV_RADIUS_MAX],
-                        1.0, 1.0, 1.0, 0.0, color);
+                        1.0, 1.0, 1.0, 0.0,
+                        (int)self->b_BasicValues[BV_SMUDGE_SAMPLES], color);
     if (err != 0)
         Py_RETURN_NONE;
 
@@ -1501,12 +2447,45 @@ brush_set_surface(PyBrush *self, PyObject *value, void *closure)
         my_Py_DECREF(self->b_Surface);
     }
 
+    Py_CLEAR(self->b_TileMgr);
+    self->b_PBShift = -1;
+    Py_XDECREF(brush_invalid_cache(self));
+
+    /* Accumulated pixels belong to the previous surface */
+    accum_free(self);
+
     if (NULL == value)
         return 0;
 
     Py_INCREF(value);
     self->b_Surface = value;
 
+    /* Tiled surfaces may be read by other threads while painting */
+    if (NULL != TileMgrAPI)
+    {
+        PyObject *tilemgr = PyObject_GetAttrString(value, "tile_manager"); /* NR */
+
+        if ((NULL != tilemgr) && PyUnboundedTileMgr_Check(tilemgr))
+        {
+            int size = TileMgrAPI->get_tile_size(tilemgr);
+
+            self->b_TileMgr = tilemgr;
+
+            /* Power of 2 tiles size: cache slots by bits shift */
+            if ((size > 0) && !(size & (size - 1)))
+            {
+                self->b_PBShift = 0;
+                while ((1 << self->b_PBShift) < size)
+                    self->b_PBShift++;
+            }
+        }
+        else
+        {
+            Py_XDECREF(tilemgr);
+            PyErr_Clear();
+        }
+    }
+
     /* Cache get_pixbuf method */
     self->b_GetPixBufFunc = PyObject_GetAttrString(value, "get_pixbuf"); /* NR */
 	if (NULL == self->b_GetPixBufFunc)
@@ -1548,6 +2527,8 @@ brush_set_float(PyBrush *self, PyObject *value, int index)
         case BV_YRATIO: v = CLAMP(v, 1.0, 100.0); break;
         case BV_HARDNESS: v = CLAMP(v, 0.01, 1.0); break;
         case BV_SPACING: v = MAX(v, 0.01); break;
+        case BV_SMUDGE_SAMPLES: v = MAX(floor(v), 0.0); break;
+        case BV_ACCUMULATE: v = CLAMP(floor(v), ACCUMULATE_NONE, ACCUMULATE_ADD); break;
     }
 
     *ptr = v;
@@ -1680,6 +2661,37 @@ brush_set_rgb(PyBrush *self, PyObject *value, void *closure)
     return 0;
 }
 
+static PyObject *
+brush_get_seed(PyBrush *self, void *closure)
+{
+    return PyLong_FromUnsignedLong(self->b_Seed);
+}
+
+static int
+brush_set_seed(PyBrush *self, PyObject *value, void *closure)
+{
+    unsigned long seed;
+
+    if (NULL == value)
+    {
+        PyErr_SetString(PyExc_TypeError, "Cannot delete seed attribute");
+        return -1;
+    }
+
+    seed = PyInt_AsUnsignedLongMask(value);
+    if (PyErr_Occurred())
+        return -1;
+
+    self->b_Seed = seed;
+    return 0;
+}
+
+static PyObject *
+brush_get_mask_counter(PyBrush *self, void *closure)
+{
+    return PyLong_FromUnsignedLong(closure ? self->b_MaskMisses : self->b_MaskHits);
+}
+
 static PyGetSetDef brush_getsetters[] = {
     {"surface",         (getter)brush_get_surface, (setter)brush_set_surface,          "Surface to use", NULL},
 
@@ -1705,6 +2717,13 @@ static PyGetSetDef brush_getsetters[] = {
     {"color_shift_s",   (getter)brush_get_float,   (setter)brush_set_float,            "Color S shifting",        (void *)BV_COLOR_SHIFT_S},
     {"color_shift_v",   (getter)brush_get_float,   (setter)brush_set_float,            "Color V shifting",        (void *)BV_COLOR_SHIFT_V},
     {"alpha_lock",      (getter)brush_get_float,   (setter)brush_set_normalized_float, "Alpha Lock",              (void *)BV_ALPHA_LOCK},
+    {"smudge_samples",  (getter)brush_get_float,   (setter)brush_set_float,            "Pixels read per smudge dab, 0 for all", (void *)BV_SMUDGE_SAMPLES},
+    {"accumulate",      (getter)brush_get_float,   (setter)brush_set_float,            "Stroke accumulation mode (ACCUMULATE_xxx)", (void *)BV_ACCUMULATE},
+
+    {"seed",            (getter)brush_get_seed,    (setter)brush_set_seed,             "Random generators seed of next strokes", NULL},
+
+    {"mask_cache_hits",   (getter)brush_get_mask_counter, NULL, "Dabs drawn using a cached mask",   (void *)0},
+    {"mask_cache_misses", (getter)brush_get_mask_counter, NULL, "Dab masks computed",               (void *)1},
 
     {"hsv",             (getter)brush_get_hsv,      (setter)brush_set_hsv,              "HSV Color",                    NULL},
     {"rgb",             (getter)brush_get_rgb,      (setter)brush_set_rgb,              "RGB Color",                    NULL},
@@ -1730,6 +2749,7 @@ static PyGetSetDef brush_getsetters[] = {
 static struct PyMethodDef brush_methods[] = {
     /*{"drawdab_solid", (PyCFunction)brush_drawdab_solid, METH_VARARGS, NULL},*/
     {"draw_stroke",   (PyCFunction)brush_drawstroke,    METH_VARARGS, NULL},
+    {"draw_strokes",  (PyCFunction)brush_drawstrokes,   METH_VARARGS, NULL},
     {"invalid_cache", (PyCFunction)brush_invalid_cache, METH_NOARGS,  NULL},
     {"stroke_start", (PyCFunction)brush_stroke_start, METH_VARARGS, NULL},
     {"stroke_end", (PyCFunction)brush_stroke_end, METH_VARARGS, NULL},
@@ -1757,7 +2777,47 @@ static PyTypeObject PyBrush_Type = {
 ** Module
 */
 
+static PyObject *
+mod_set_grain_texture(PyObject *mod, PyObject *args)
+{
+    float scale;
+    int width=GRAIN_DEFAULT_SIZE, height=GRAIN_DEFAULT_SIZE, size=0, i;
+    const unsigned char *data=NULL;
+    GrainTexture *tex;
+
+    if (!PyArg_ParseTuple(args, "f|iiz#:set_grain_texture", &scale, &width, &height, &data, &size))
+        return NULL;
+
+    if (scale <= 0)
+        return PyErr_Format(PyExc_ValueError, "Grain scale must be positive");
+
+    if ((width <= 0) || (width & (width-1)) || (height <= 0) || (height & (height-1)))
+        return PyErr_Format(PyExc_ValueError, "Texture sizes must be powers of 2, not %dx%d", width, height);
+
+    if ((NULL != data) && (size != width*height))
+        return PyErr_Format(PyExc_ValueError, "Texture data must have %d bytes, not %d", width*height, size);
+
+    tex = grain_new(width, height, scale);
+    if (NULL == tex)
+        return NULL;
+
+    if (NULL != data)
+    {
+        for (i=0; i < width*height; i++)
+            tex->gt_Data[i] = data[i] / 255.f;
+    }
+    else
+        grain_generate(tex);
+
+    /* Brushes keep their reference until their next dab */
+    grain_release(grain_texture);
+    grain_texture = tex;
+
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef _BrushMethods[] = {
+    {"set_grain_texture", (PyCFunction)mod_set_grain_texture, METH_VARARGS, NULL},
     {NULL}
 };
 
@@ -1783,8 +2843,23 @@ static int add_constants(PyObject *m)
     INSI(m, "BV_SCOLOR_SHIFT_S", BV_COLOR_SHIFT_S);
     INSI(m, "BV_COLOR_SHIFT_V", BV_COLOR_SHIFT_V);
     INSI(m, "BV_ALPHA_LOCK", BV_ALPHA_LOCK);
+    INSI(m, "BV_SMUDGE_SAMPLES", BV_SMUDGE_SAMPLES);
+    INSI(m, "BV_ACCUMULATE", BV_ACCUMULATE);
+    INSI(m, "ACCUMULATE_NONE", ACCUMULATE_NONE);
+    INSI(m, "ACCUMULATE_MAX", ACCUMULATE_MAX);
+    INSI(m, "ACCUMULATE_ADD", ACCUMULATE_ADD);
     INSI(m, "BASIC_VALUES_MAX", BASIC_VALUES_MAX);
 
+    INSI(m, "SS_SX", SS_SX);
+    INSI(m, "SS_SY", SS_SY);
+    INSI(m, "SS_VX", SS_VX);
+    INSI(m, "SS_VY", SS_VY);
+    INSI(m, "SS_TIME", SS_TIME);
+    INSI(m, "SS_XTILT", SS_XTILT);
+    INSI(m, "SS_YTILT", SS_YTILT);
+    INSI(m, "SS_PRESSURE", SS_PRESSURE);
+    INSI(m, "STROKE_STATE_SIZE", STROKE_STATE_SIZE);
+
     return 0;
 }
 PyMODINIT_FUNC
@@ -1813,4 +2888,8 @@ INITFUNC(void)
 
     if (!import_pixbuf())
         return;
+
+    /* Optional: tiles locking */
+    if (!import_tilemgr())
+        PyErr_Clear();
 }
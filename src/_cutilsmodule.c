@@ -204,10 +204,13 @@ area_join(PyArea *self, PyObject *args)
 	const int x = self->x;
 	const int y = self->y;
 
-	return _area_new(MIN(x, other->x),
-					 MIN(y, other->y),
-					 MAX(x + self->w, other->x + other->w) - self->x,
-					 MAX(y + self->h, other->y + other->h) - self->y);
+	const int x1 = MIN(x, other->x);
+	const int y1 = MIN(y, other->y);
+
+	return _area_new(x1,
+					 y1,
+					 MAX(x + self->w, other->x + other->w) - x1,
+					 MAX(y + self->h, other->y + other->h) - y1);
 }
 
 static PyObject*
@@ -467,6 +470,722 @@ static PyTypeObject PyArea_Type = {
 	tp_as_sequence  : &area_as_sequence,
 };
 
+/*******************************************************************************************
+** PyRegion_Type
+**
+** A region is a set of non-overlapping rectangles.
+** Rendering a rectangle has a fixed cost (setup, tiles lookup, ...),
+** so added rectangles are merged with existing ones when the merged
+** bounding box wastes less than REGION_MERGE_COST pixels, and the count
+** of rectangles is kept under REGION_MAX_RECTS by merging the closest ones.
+** Intersections and subtractions are exact, they don't merge rectangles.
+*/
+
+#define REGION_MAX_RECTS 32
+#define REGION_MERGE_COST (64*64)
+
+typedef struct RegionRect_STRUCT {
+	int x1, y1, x2, y2; /* x2/y2 excluded */
+} RegionRect;
+
+typedef struct PyRegion_STRUCT {
+	PyObject_HEAD
+	int count, alloc;
+	RegionRect *rects;
+} PyRegion;
+
+static PyTypeObject PyRegion_Type;
+
+#define RECT_EMPTY(r) ((r)->x1 >= (r)->x2 || (r)->y1 >= (r)->y2)
+#define RECT_PIXELS(r) ((long)((r)->x2 - (r)->x1) * ((r)->y2 - (r)->y1))
+
+static PyRegion *
+_region_new(void)
+{
+	PyRegion *region;
+
+	region = (PyRegion *)PyObject_New(PyRegion, &PyRegion_Type); /* NR */
+	if (region)
+	{
+		region->count = 0;
+		region->alloc = 0;
+		region->rects = NULL;
+	}
+
+	return region;
+}
+
+static void
+rect_bbox(const RegionRect *a, const RegionRect *b, RegionRect *res)
+{
+	res->x1 = MIN(a->x1, b->x1);
+	res->y1 = MIN(a->y1, b->y1);
+	res->x2 = MAX(a->x2, b->x2);
+	res->y2 = MAX(a->y2, b->y2);
+}
+
+static int
+rect_intersect(const RegionRect *a, const RegionRect *b, RegionRect *res)
+{
+	res->x1 = MAX(a->x1, b->x1);
+	res->y1 = MAX(a->y1, b->y1);
+	res->x2 = MIN(a->x2, b->x2);
+	res->y2 = MIN(a->y2, b->y2);
+	return !RECT_EMPTY(res);
+}
+
+static int
+rect_contains(const RegionRect *a, const RegionRect *b)
+{
+	return a->x1 <= b->x1 && a->y1 <= b->y1 && a->x2 >= b->x2 && a->y2 >= b->y2;
+}
+
+/* Pixels wasted by replacing a and b by their bounding box */
+static long
+rect_merge_waste(const RegionRect *a, const RegionRect *b)
+{
+	RegionRect bbox, inter;
+	long waste;
+
+	rect_bbox(a, b, &bbox);
+	waste = RECT_PIXELS(&bbox) - RECT_PIXELS(a) - RECT_PIXELS(b);
+	if (rect_intersect(a, b, &inter))
+		waste += RECT_PIXELS(&inter);
+	return waste;
+}
+
+/* Write in pieces the up to 4 rectangles covering a minus b, return their count */
+static int
+rect_subtract(const RegionRect *a, const RegionRect *b, RegionRect *pieces)
+{
+	RegionRect inter;
+	int n = 0;
+
+	if (!rect_intersect(a, b, &inter))
+	{
+		pieces[0] = *a;
+		return 1;
+	}
+
+	/* Full width bands above and below, then left and right parts */
+	if (a->y1 < inter.y1)
+	{
+		pieces[n].x1 = a->x1; pieces[n].y1 = a->y1;
+		pieces[n].x2 = a->x2; pieces[n].y2 = inter.y1;
+		n++;
+	}
+	if (inter.y2 < a->y2)
+	{
+		pieces[n].x1 = a->x1; pieces[n].y1 = inter.y2;
+		pieces[n].x2 = a->x2; pieces[n].y2 = a->y2;
+		n++;
+	}
+	if (a->x1 < inter.x1)
+	{
+		pieces[n].x1 = a->x1; pieces[n].y1 = inter.y1;
+		pieces[n].x2 = inter.x1; pieces[n].y2 = inter.y2;
+		n++;
+	}
+	if (inter.x2 < a->x2)
+	{
+		pieces[n].x1 = inter.x2; pieces[n].y1 = inter.y1;
+		pieces[n].x2 = a->x2; pieces[n].y2 = inter.y2;
+		n++;
+	}
+
+	return n;
+}
+
+static int
+region_reserve(PyRegion *self, int count)
+{
+	RegionRect *rects;
+	int alloc;
+
+	if (count <= self->alloc)
+		return 0;
+
+	alloc = MAX(count, self->alloc * 2);
+	alloc = MAX(alloc, 8);
+	rects = PyMem_Realloc(self->rects, alloc * sizeof(RegionRect));
+	if (NULL == rects)
+	{
+		PyErr_NoMemory();
+		return -1;
+	}
+
+	self->rects = rects;
+	self->alloc = alloc;
+	return 0;
+}
+
+static void
+region_remove(PyRegion *self, int i)
+{
+	self->rects[i] = self->rects[--self->count];
+}
+
+/* Add r grown to contain all rectangles it overlaps (removed) */
+static void
+region_absorb(PyRegion *self, RegionRect r)
+{
+	RegionRect inter;
+	int i;
+
+again:
+	for (i=0; i < self->count; i++)
+	{
+		if (rect_intersect(&self->rects[i], &r, &inter))
+		{
+			rect_bbox(&self->rects[i], &r, &r);
+			region_remove(self, i);
+			goto again;
+		}
+	}
+
+	/* At least one rectangle has been removed by the caller */
+	self->rects[self->count++] = r;
+}
+
+/* Keep at most REGION_MAX_RECTS rectangles, by merging the closest ones */
+static void
+region_reduce(PyRegion *self)
+{
+	while (self->count > REGION_MAX_RECTS)
+	{
+		RegionRect bbox;
+		long waste, best = -1;
+		int i, j, bi=0, bj=1;
+
+		for (i=0; i < self->count; i++)
+		{
+			for (j=i+1; j < self->count; j++)
+			{
+				waste = rect_merge_waste(&self->rects[i], &self->rects[j]);
+				if ((best < 0) || (waste < best))
+				{
+					best = waste;
+					bi = i;
+					bj = j;
+				}
+			}
+		}
+
+		rect_bbox(&self->rects[bi], &self->rects[bj], &bbox);
+		region_remove(self, bj); /* bj > bi */
+		region_remove(self, bi);
+		region_absorb(self, bbox);
+	}
+}
+
+/* Add the rectangle r to the region */
+static int
+region_add_rect(PyRegion *self, RegionRect r)
+{
+	RegionRect *pieces, *tmp, split[4];
+	int i, j, k, count, tmp_count, alloc;
+
+	if (RECT_EMPTY(&r))
+		return 0;
+
+again:
+	for (i=0; i < self->count; i++)
+	{
+		RegionRect *e = &self->rects[i];
+
+		if (rect_contains(e, &r))
+			return 0;
+
+		if (rect_contains(&r, e))
+		{
+			region_remove(self, i--);
+			continue;
+		}
+
+		/* Merge if the bounding box is cheaper than two rectangles */
+		if (rect_merge_waste(e, &r) <= REGION_MERGE_COST)
+		{
+			RegionRect bbox;
+
+			rect_bbox(e, &r, &bbox);
+			r = bbox;
+			region_remove(self, i);
+			goto again;
+		}
+	}
+
+	/* Cut r by existing rectangles to keep them non-overlapping.
+	 * Each cut gives at most 4 pieces from one.
+	 */
+	alloc = 16;
+	pieces = PyMem_Malloc(2 * alloc * sizeof(RegionRect));
+	if (NULL == pieces)
+	{
+		PyErr_NoMemory();
+		return -1;
+	}
+
+	pieces[0] = r;
+	count = 1;
+
+	for (i=0; (i < self->count) && count; i++)
+	{
+		if (4 * count > alloc)
+		{
+			RegionRect *new_pieces;
+
+			alloc = 4 * count;
+			new_pieces = PyMem_Realloc(pieces, 2 * alloc * sizeof(RegionRect));
+			if (NULL == new_pieces)
+			{
+				PyMem_Free(pieces);
+				PyErr_NoMemory();
+				return -1;
+			}
+			pieces = new_pieces;
+		}
+
+		tmp = pieces + alloc;
+		tmp_count = 0;
+		for (j=0; j < count; j++)
+		{
+			int n = rect_subtract(&pieces[j], &self->rects[i], split);
+
+			for (k=0; k < n; k++)
+				tmp[tmp_count++] = split[k];
+		}
+
+		memcpy(pieces, tmp, tmp_count * sizeof(RegionRect));
+		count = tmp_count;
+	}
+
+	if (region_reserve(self, self->count + count))
+	{
+		PyMem_Free(pieces);
+		return -1;
+	}
+
+	memcpy(&self->rects[self->count], pieces, count * sizeof(RegionRect));
+	self->count += count;
+	PyMem_Free(pieces);
+
+	region_reduce(self);
+	return 0;
+}
+
+/* Get a rectangle from an Area or a (x, y, width, height) sequence */
+static int
+region_parse_rect(PyObject *obj, RegionRect *r)
+{
+	int x, y, w, h;
+
+	if (PyObject_TypeCheck(obj, &PyArea_Type))
+	{
+		PyArea *area = (PyArea *)obj;
+
+		x = area->x; y = area->y; w = area->w; h = area->h;
+	}
+	else
+	{
+		PyObject *tuple = PySequence_Tuple(obj); /* NR */
+
+		if (NULL == tuple)
+			return -1;
+
+		if (!PyArg_ParseTuple(tuple, "iiii;area must be a (x, y, width, height) sequence", &x, &y, &w, &h))
+		{
+			Py_DECREF(tuple);
+			return -1;
+		}
+		Py_DECREF(tuple);
+	}
+
+	r->x1 = x;
+	r->y1 = y;
+	r->x2 = x + w;
+	r->y2 = y + h;
+	return 0;
+}
+
+/* Get the rectangles of obj, a Region, an Area or a 4-sequence.
+ * Return the rectangles count, -1 on error.
+ * *rects is only valid while obj is alive.
+ */
+static int
+region_parse(PyObject *obj, RegionRect **rects, RegionRect *buf)
+{
+	if (PyObject_TypeCheck(obj, &PyRegion_Type))
+	{
+		*rects = ((PyRegion *)obj)->rects;
+		return ((PyRegion *)obj)->count;
+	}
+
+	if (region_parse_rect(obj, buf))
+		return -1;
+
+	*rects = buf;
+	return !RECT_EMPTY(buf);
+}
+
+static int
+region_union_inplace_obj(PyRegion *self, PyObject *other)
+{
+	RegionRect *rects, buf;
+	int i, count;
+
+	if (other == (PyObject *)self)
+		return 0;
+
+	count = region_parse(other, &rects, &buf);
+	if (count < 0)
+		return -1;
+
+	for (i=0; i < count; i++)
+	{
+		if (region_add_rect(self, rects[i]))
+			return -1;
+	}
+
+	return 0;
+}
+
+static int
+region_intersect_inplace_obj(PyRegion *self, PyObject *other)
+{
+	RegionRect *rects, *res, buf;
+	int i, j, count, res_count=0;
+
+	count = region_parse(other, &rects, &buf);
+	if (count < 0)
+		return -1;
+
+	/* Intersections of non-overlapping rectangles don't overlap */
+	res = PyMem_Malloc(MAX(self->count * count, 1) * sizeof(RegionRect));
+	if (NULL == res)
+	{
+		PyErr_NoMemory();
+		return -1;
+	}
+
+	for (i=0; i < self->count; i++)
+	{
+		for (j=0; j < count; j++)
+		{
+			if (rect_intersect(&self->rects[i], &rects[j], &res[res_count]))
+				res_count++;
+		}
+	}
+
+	PyMem_Free(self->rects);
+	self->rects = res;
+	self->alloc = MAX(self->count * count, 1);
+	self->count = res_count;
+
+	return 0;
+}
+
+static int
+region_subtract_inplace_obj(PyRegion *self, PyObject *other)
+{
+	RegionRect *rects, buf, split[4];
+	int i, j, k, n, count;
+
+	count = region_parse(other, &rects, &buf);
+	if (count < 0)
+		return -1;
+
+	for (j=0; j < count; j++)
+	{
+		/* New pieces are added at the end and don't intersect rects[j] */
+		for (i=self->count-1; i >= 0; i--)
+		{
+			n = rect_subtract(&self->rects[i], &rects[j], split);
+			if ((1 == n) && !memcmp(&split[0], &self->rects[i], sizeof(RegionRect)))
+				continue;
+
+			if (region_reserve(self, self->count + n))
+				return -1;
+
+			region_remove(self, i);
+			for (k=0; k < n; k++)
+				self->rects[self->count++] = split[k];
+		}
+	}
+
+	return 0;
+}
+
+static int
+region_transform_inplace_ope(PyRegion *self, PyObject *ope)
+{
+	RegionRect *rects = self->rects;
+	int i, count = self->count;
+
+	self->rects = NULL;
+	self->count = self->alloc = 0;
+
+	for (i=0; i < count; i++)
+	{
+		float x1 = rects[i].x1;
+		float y1 = rects[i].y1;
+		float x2 = rects[i].x2 - 1;
+		float y2 = rects[i].y2 - 1;
+		RegionRect r;
+
+		if (transform_bbox(ope, &x1, &y1, &x2, &y2))
+			goto error;
+
+		r.x1 = x1;
+		r.y1 = y1;
+		r.x2 = (int)x2 + 1;
+		r.y2 = (int)y2 + 1;
+
+		if (region_add_rect(self, r))
+			goto error;
+	}
+
+	PyMem_Free(rects);
+	return 0;
+
+error:
+	PyMem_Free(rects);
+	return -1;
+}
+
+static PyRegion *
+region_copy_obj(PyRegion *self)
+{
+	PyRegion *region = _region_new(); /* NR */
+
+	if (NULL == region)
+		return NULL;
+
+	if (region_reserve(region, self->count))
+	{
+		Py_DECREF(region);
+		return NULL;
+	}
+
+	memcpy(region->rects, self->rects, self->count * sizeof(RegionRect));
+	region->count = self->count;
+	return region;
+}
+
+static PyObject*
+region_new(PyTypeObject *type, PyObject *args)
+{
+	PyRegion *self;
+	PyObject *areas = NULL;
+
+	if (!PyArg_ParseTuple(args, "|O:Region", &areas))
+		return NULL;
+
+	self = (void *)type->tp_alloc(type, 0); /* NR */
+	if (self && areas)
+	{
+		PyObject *it, *item;
+
+		it = PyObject_GetIter(areas); /* NR */
+		if (NULL == it)
+		{
+			Py_DECREF(self);
+			return NULL;
+		}
+
+		while (NULL != (item = PyIter_Next(it))) /* NR */
+		{
+			int err = region_union_inplace_obj(self, item);
+
+			Py_DECREF(item);
+			if (err)
+				break;
+		}
+
+		Py_DECREF(it);
+		if (PyErr_Occurred())
+			Py_CLEAR(self);
+	}
+
+	return (PyObject *)self;
+}
+
+static void
+region_dealloc(PyRegion *self)
+{
+	PyMem_Free(self->rects);
+	self->ob_type->tp_free((PyObject *)self);
+}
+
+static PyObject*
+region_copy(PyRegion *self)
+{
+	return (PyObject *)region_copy_obj(self);
+}
+
+#define REGION_METHODS(name)										\
+static PyObject*													\
+region_##name##_inplace(PyRegion *self, PyObject *args)				\
+{																	\
+	PyObject *other;												\
+																	\
+	if (!PyArg_ParseTuple(args, "O", &other))						\
+		return NULL;												\
+																	\
+	if (region_##name##_inplace_obj(self, other))					\
+		return NULL;												\
+																	\
+	Py_INCREF(self);												\
+	return (PyObject *)self;										\
+}																	\
+																	\
+static PyObject*													\
+region_##name(PyRegion *self, PyObject *args)						\
+{																	\
+	PyRegion *region;												\
+	PyObject *res;													\
+																	\
+	region = region_copy_obj(self); /* NR */						\
+	if (NULL == region)												\
+		return NULL;												\
+																	\
+	res = region_##name##_inplace(region, args);					\
+	Py_DECREF(region);												\
+	return res;														\
+}
+
+REGION_METHODS(union)
+REGION_METHODS(intersect)
+REGION_METHODS(subtract)
+
+static PyObject*
+region_transform_inplace(PyRegion *self, PyObject *args)
+{
+	PyObject *ope;
+
+	if (!PyArg_ParseTuple(args, "O", &ope))
+		return NULL;
+
+	if (region_transform_inplace_ope(self, ope))
+		return NULL;
+
+	Py_INCREF(self);
+	return (PyObject *)self;
+}
+
+static PyObject*
+region_transform(PyRegion *self, PyObject *args)
+{
+	PyRegion *region;
+	PyObject *res;
+
+	region = region_copy_obj(self); /* NR */
+	if (NULL == region)
+		return NULL;
+
+	res = region_transform_inplace(region, args);
+	Py_DECREF(region);
+	return res;
+}
+
+static PyObject*
+region_get_bbox(PyRegion *self, void *closure)
+{
+	RegionRect bbox;
+	int i;
+
+	if (!self->count)
+		return _area_new(0, 0, 0, 0);
+
+	bbox = self->rects[0];
+	for (i=1; i < self->count; i++)
+		rect_bbox(&bbox, &self->rects[i], &bbox);
+
+	return _area_new(bbox.x1, bbox.y1, bbox.x2 - bbox.x1, bbox.y2 - bbox.y1);
+}
+
+static PyObject*
+region_get_pixels(PyRegion *self, void *closure)
+{
+	long pixels = 0;
+	int i;
+
+	for (i=0; i < self->count; i++)
+		pixels += RECT_PIXELS(&self->rects[i]);
+
+	return PyInt_FromLong(pixels);
+}
+
+static int
+region_nonzero(PyRegion *self)
+{
+	return self->count > 0;
+}
+
+static Py_ssize_t
+region_length(PyRegion *self)
+{
+	return self->count;
+}
+
+static PyObject*
+region_get_item(PyRegion *self, Py_ssize_t i)
+{
+	RegionRect *r;
+
+	if ((i < 0) || (i >= self->count))
+	{
+		PyErr_SetString(PyExc_IndexError, "invalid index");
+		return NULL;
+	}
+
+	r = &self->rects[i];
+	return _area_new(r->x1, r->y1, r->x2 - r->x1, r->y2 - r->y1);
+}
+
+static struct PyMethodDef region_methods[] = {
+	{"copy", (PyCFunction)region_copy, METH_NOARGS, NULL},
+	{"union", (PyCFunction)region_union, METH_VARARGS, NULL},
+	{"union_in", (PyCFunction)region_union_inplace, METH_VARARGS, NULL},
+	{"intersect", (PyCFunction)region_intersect, METH_VARARGS, NULL},
+	{"intersect_in", (PyCFunction)region_intersect_inplace, METH_VARARGS, NULL},
+	{"subtract", (PyCFunction)region_subtract, METH_VARARGS, NULL},
+	{"subtract_in", (PyCFunction)region_subtract_inplace, METH_VARARGS, NULL},
+	{"transform", (PyCFunction)region_transform, METH_VARARGS, NULL},
+	{"transform_in", (PyCFunction)region_transform_inplace, METH_VARARGS, NULL},
+	{NULL} /* sentinel */
+};
+
+static PyGetSetDef region_getseters[] = {
+	{"bbox", (getter)region_get_bbox, NULL, "Bounding box as an Area", NULL},
+	{"pixels", (getter)region_get_pixels, NULL, "Count of pixels covered by the region", NULL},
+	{NULL} /* sentinel */
+};
+
+static PyNumberMethods region_as_number = {
+	nb_nonzero : (inquiry)region_nonzero,
+};
+
+static PySequenceMethods region_as_sequence = {
+	sq_length : (lenfunc)region_length,
+	sq_item   : (ssizeargfunc)region_get_item,
+};
+
+static PyTypeObject PyRegion_Type = {
+	PyObject_HEAD_INIT(NULL)
+
+	tp_name         : "model.Region",
+	tp_basicsize    : sizeof(PyRegion),
+	tp_flags        : Py_TPFLAGS_DEFAULT,
+	tp_doc          : "Region Objects, sets of non-overlapping areas",
+
+	tp_new          : (newfunc)region_new,
+	tp_dealloc      : (destructor)region_dealloc,
+	tp_methods      : region_methods,
+	tp_getset       : region_getseters,
+	tp_as_number    : &region_as_number,
+	tp_as_sequence  : &region_as_sequence,
+};
+
 
 /******************************************************************************
 ** Module
@@ -536,9 +1255,11 @@ INITFUNC(void)
     PyObject *m;
 
 	if (PyType_Ready(&PyArea_Type) < 0) return;
+	if (PyType_Ready(&PyRegion_Type) < 0) return;
 
     m = Py_InitModule(MODNAME, mod_methods);
     if (!m) return;
 
 	ADD_TYPE(m, "Area", &PyArea_Type);
+	ADD_TYPE(m, "Region", &PyRegion_Type);
 }
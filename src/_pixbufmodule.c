@@ -27,6 +27,7 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 #include "common.h"
 #include "_pixbufmodule.h"
+#include "_tilemgrmodule.h"
 
 #ifdef HAVE_GDK
 #define GLIB_VERSION_MIN_REQUIRED GLIB_VERSION_2_36
@@ -1111,6 +1112,18 @@ argb8_noa_to_argb8_noa(uint8_t *src1, uint8_t *dst1,
         memcpy(dst1, src1, w*sizeof(dst1));
 }
 
+/* Copy of 4 x 8-bits channels pixels, whatever the channels order */
+static void
+rgbx8_to_rgbx8(uint8_t *src1, uint8_t *dst1,
+               uint32_t w, uint32_t h,
+               Py_ssize_t src_stride, Py_ssize_t dst_stride)
+{
+    uint32_t y;
+
+    for (y=0; y < h; y++, src1 += src_stride, dst1 += dst_stride)
+        memcpy(dst1, src1, w*4);
+}
+
 static void
 rgbx15x_to_rgbx15x(uint16_t *src1, uint16_t *dst1,
                    uint32_t w, uint32_t h,
@@ -1319,6 +1332,7 @@ get_blit_function(int src_fmt, int dst_fmt, int endian_care)
         switch (dst_fmt)
         {
             case PyPixbuf_PIXFMT_ARGB_15X:      return (blitfunc)argb8_to_argb15x;
+            case PyPixbuf_PIXFMT_ARGB_8:        return (blitfunc)rgbx8_to_rgbx8;
             case PyPixbuf_PIXFMT_RGBA_8:        return (blitfunc)argb8_to_rgba8;
             case PyPixbuf_PIXFMT_ARGB_8_NOA:    return (blitfunc)argb8_to_argb8_noa;
             case PyPixbuf_PIXFMT_RGBA_8_NOA:    return (blitfunc)argb8_to_rgba8_noa;
@@ -1329,6 +1343,7 @@ get_blit_function(int src_fmt, int dst_fmt, int endian_care)
         switch (dst_fmt)
         {
             case PyPixbuf_PIXFMT_ARGB_15X:      return (blitfunc)rgba8_noa_to_argb15x;
+            case PyPixbuf_PIXFMT_RGBA_8_NOA:    return (blitfunc)rgbx8_to_rgbx8;
         }
     }
     else if (src_fmt == PyPixbuf_PIXFMT_ARGB_8_NOA)
@@ -1472,38 +1487,284 @@ get_pixel_size(int pixfmt)
     return -1;
 }
 
-static PyPixbuf *g_cache_pb=NULL; /* cache result of last get_tile_cb() call */
+/********* MIP-mapping **********************************/
+
+/* Each level halves the size of the previous one (minimal size is 1 pixel).
+ * Levels are stored one after the other in the mipmap buffer,
+ * level 0 being the pixbuf data itself.
+ */
 
 static int
-get_pixel_color(PyObject *get_tile_cb, const int x, const int y,
-				uint16_t color[MAX_CHANNELS])
+mipmap_level_width(PyPixbuf *self, unsigned int level)
 {
-    PyPixbuf *tile;
+    return MAX(self->width >> level, 1);
+}
 
-    if (g_cache_pb
-        && BETWEEN(x, g_cache_pb->x, g_cache_pb->x + g_cache_pb->width)
-        && BETWEEN(y, g_cache_pb->y, g_cache_pb->y + g_cache_pb->height))
+static int
+mipmap_level_height(PyPixbuf *self, unsigned int level)
+{
+    return MAX(self->height >> level, 1);
+}
+
+static Py_ssize_t
+mipmap_size(PyPixbuf *self, unsigned int levels)
+{
+    Py_ssize_t size = 0;
+    unsigned int l;
+
+    for (l=1; l <= levels; l++)
+        size += (Py_ssize_t)mipmap_level_width(self, l) * mipmap_level_height(self, l) * self->bpp;
+
+    return size;
+}
+
+/* Return pixels data of given level, or NULL if this level is not built */
+static uint8_t *
+get_mipmap_level(PyPixbuf *self, unsigned int level, unsigned int *bpr)
+{
+    if (!level)
     {
-        tile = g_cache_pb;
+        *bpr = self->bpr;
+        return self->data;
     }
-    else
+
+    if (level > self->mipmap_levels)
+        return NULL;
+
+    *bpr = mipmap_level_width(self, level) * self->bpp;
+    return self->mipmap + mipmap_size(self, level-1);
+}
+
+static void
+free_mipmap(PyPixbuf *self)
+{
+    if (NULL != self->mipmap)
+        FreeVecTaskPooled(self->mipmap);
+    self->mipmap = NULL;
+    self->mipmap_levels = 0;
+}
+
+/* (Re)compute the MIP-map pyramid, each pixel is the average of 4 pixels of
+ * the previous level. As colors are alpha-premultiplied this box filter
+ * doesn't need any alpha weighting.
+ */
+static int
+build_mipmap(PyPixbuf *self, unsigned int levels)
+{
+    unsigned int l, max_levels = 0;
+
+    while ((self->width >> (max_levels+1)) || (self->height >> (max_levels+1)))
+        max_levels++;
+    levels = MIN(levels, max_levels);
+
+    if (levels != self->mipmap_levels)
     {
-		/* Note: we keep pb cache valid if next call fails */
-        tile = (PyPixbuf *)PyObject_CallFunction(get_tile_cb, "iii", x, y, 0); /* NR */
-        if (!tile)
+        free_mipmap(self);
+        if (!levels)
+            return 0;
+
+        self->mipmap = AllocVecTaskPooled(mipmap_size(self, levels));
+        if (NULL == self->mipmap)
+        {
+            PyErr_NoMemory();
             return -1;
+        }
+        self->mipmap_levels = levels;
+    }
 
-		if ((PyObject *)tile != Py_None)
-		{
-			Py_XDECREF(g_cache_pb);
-			g_cache_pb = tile;
-		} else
-			Py_CLEAR(tile);
+    for (l=1; l <= levels; l++)
+    {
+        unsigned int src_bpr, dst_bpr;
+        uint8_t *src = get_mipmap_level(self, l-1, &src_bpr);
+        uint8_t *dst = get_mipmap_level(self, l, &dst_bpr);
+        const int sw = mipmap_level_width(self, l-1);
+        const int sh = mipmap_level_height(self, l-1);
+        const int dw = mipmap_level_width(self, l);
+        const int dh = mipmap_level_height(self, l);
+        int x, y, i;
+
+        for (y=0; y < dh; y++, dst += dst_bpr)
+        {
+            uint8_t *row0 = src + (2*y) * src_bpr;
+            uint8_t *row1 = src + MIN(2*y+1, sh-1) * src_bpr;
+            uint8_t *pixel = dst;
+
+            for (x=0; x < dw; x++, pixel += self->bpp)
+            {
+                const int x0 = 2*x * self->bpp;
+                const int x1 = MIN(2*x+1, sw-1) * self->bpp;
+                uint16_t c0[MAX_CHANNELS], c1[MAX_CHANNELS], c2[MAX_CHANNELS], c3[MAX_CHANNELS];
+
+                self->readpixel(row0 + x0, c0);
+                self->readpixel(row0 + x1, c1);
+                self->readpixel(row1 + x0, c2);
+                self->readpixel(row1 + x1, c3);
+
+                for (i=0; i < self->nc; i++)
+                    c0[i] = ((uint32_t)c0[i] + c1[i] + c2[i] + c3[i] + 2) / 4;
+
+                self->write2pixel(pixel, c0);
+            }
+        }
     }
 
+    return 0;
+}
+
+/* Source pixels are read from tiles given by an UnboundedTileManager object,
+ * using the _tilemgr C API, or by a get_tile_cb() callable for other surfaces.
+ * Coordinates are given in the space of the MIP-map 'level'.
+ * The last obtained tile is cached as pixels are usually read in sequence.
+ * If 'ts' is set the GIL has been released by the caller, it's only
+ * re-acquired during get_tile_cb() calls.
+ * Tiles of a manager may be painted by another thread: the cached one
+ * is kept locked for reading until the next tile or the GIL re-acquisition.
+ */
+typedef struct TileSampler_STRUCT {
+	PyObject *		tilemgr;
+	PyObject *		get_tile_cb;
+	PyPixbuf *		cache;
+	PyThreadState *	ts;
+	unsigned int	level;
+} TileSampler;
+
+static int
+sampler_init(TileSampler *sampler, PyObject *source)
+{
+	sampler->tilemgr = NULL;
+	sampler->get_tile_cb = NULL;
+	sampler->cache = NULL;
+	sampler->ts = NULL;
+	sampler->level = 0;
+
+	if (PyUnboundedTileMgr_Check(source))
+		sampler->tilemgr = source;
+	else if (PyCallable_Check(source))
+		sampler->get_tile_cb = source;
+	else
+	{
+		PyErr_Format(PyExc_TypeError,
+					 "tiles source must be an UnboundedTileManager or a callable, not %s",
+					 OBJ_TNAME(source));
+		return -1;
+	}
+
+	return 0;
+}
+
+static void
+sampler_release_gil(TileSampler *sampler)
+{
+	sampler->ts = PyEval_SaveThread();
+}
+
+static void
+sampler_unlock(TileSampler *sampler)
+{
+	PyPixbuf *tile = sampler->cache;
+
+	if ((NULL != sampler->tilemgr) && (NULL != tile))
+	{
+		TileMgrAPI->unlock_tile(sampler->tilemgr, tile->x, tile->y);
+		sampler->cache = NULL;
+	}
+}
+
+static void
+sampler_acquire_gil(TileSampler *sampler)
+{
+	sampler_unlock(sampler);
+	PyEval_RestoreThread(sampler->ts);
+	sampler->ts = NULL;
+}
+
+/* GIL must be held */
+static void
+sampler_clear(TileSampler *sampler)
+{
+	if (NULL != sampler->tilemgr)
+		sampler->cache = NULL;
+	else
+		Py_CLEAR(sampler->cache);
+}
+
+static int
+sampler_get_tile(TileSampler *sampler, const int x, const int y, PyPixbuf **tile_p)
+{
+	PyPixbuf *tile = sampler->cache;
+	int err = 0;
+
+	if (tile
+		&& BETWEEN(x, tile->x, tile->x + tile->width)
+		&& BETWEEN(y, tile->y, tile->y + tile->height))
+	{
+		*tile_p = tile;
+		return 0;
+	}
+
+	/* Direct access, tiles are owned by the manager */
+	if (NULL != sampler->tilemgr)
+	{
+		sampler_unlock(sampler);
+		tile = (PyPixbuf *)TileMgrAPI->get_tile(sampler->tilemgr, x, y); /* BR */
+		if (NULL != tile)
+		{
+			TileMgrAPI->lock_tile(sampler->tilemgr, tile->x, tile->y, FALSE);
+			sampler->cache = tile;
+		}
+		*tile_p = tile;
+		return 0;
+	}
+
+	if (sampler->ts)
+		PyEval_RestoreThread(sampler->ts);
+
+	/* Note: we keep the cache valid if next call fails */
+	tile = (PyPixbuf *)PyObject_CallFunction(sampler->get_tile_cb, "iii", x, y, 0); /* NR */
+	if (NULL == tile)
+		err = -1;
+	else if ((PyObject *)tile != Py_None)
+	{
+		Py_XDECREF(sampler->cache);
+		sampler->cache = tile;
+	}
+	else
+		Py_CLEAR(tile);
+
+	if (sampler->ts)
+		sampler->ts = PyEval_SaveThread();
+
+	if (err)
+		return -1;
+
+	*tile_p = tile; /* BR */
+	return 0;
+}
+
+static int
+get_pixel_color(TileSampler *sampler, const int x, const int y,
+				uint16_t color[MAX_CHANNELS])
+{
+    PyPixbuf *tile;
+	const int scale = 1 << sampler->level;
+
+	if (sampler_get_tile(sampler, x * scale, y * scale, &tile))
+		return -1;
+
     if (tile)
     {
-        void *src_data = tile->data + (y - tile->y) * tile->bpr + (x - tile->x) * tile->bpp;
+		uint8_t *src_data = NULL;
+		unsigned int bpr;
+
+		/* Read from the MIP-map level if built */
+		if (sampler->level && !(tile->x % scale) && !(tile->y % scale))
+			src_data = get_mipmap_level(tile, sampler->level, &bpr);
+
+		if (NULL != src_data)
+			src_data += (y - tile->y / scale) * bpr + (x - tile->x / scale) * tile->bpp;
+		else
+			src_data = tile->data + (y * scale - tile->y) * tile->bpr + (x * scale - tile->x) * tile->bpp;
+
         tile->readpixel(src_data, color);
     }
     else
@@ -1515,18 +1776,18 @@ get_pixel_color(PyObject *get_tile_cb, const int x, const int y,
 /********* Sampling *************************************/
 
 static int
-pixel_sampling_direct(PyObject *get_tile_cb, const int ix, const int iy,
+pixel_sampling_direct(TileSampler *sampler, const int ix, const int iy,
 					  uint16_t color[MAX_CHANNELS], const float coeffs[6])
 {
 	const float ixf = ix + 0.5;
 	const float iyf = iy + 0.5;
 	const float ox = floorf(ixf * coeffs[0] + iyf * coeffs[1] + coeffs[2]);
 	const float oy = floorf(ixf * coeffs[3] + iyf * coeffs[4] + coeffs[5]);
-	return get_pixel_color(get_tile_cb, (int)ox, (int)oy, color);
+	return get_pixel_color(sampler, (int)ox, (int)oy, color);
 }
 
 static int
-pixel_sampling_bilinear(PyObject *get_tile_cb, const int ix, const int iy,
+pixel_sampling_bilinear(TileSampler *sampler, const int ix, const int iy,
 						uint16_t color[MAX_CHANNELS], const float coeffs[6],
 						int channels)
 {
@@ -1548,16 +1809,16 @@ pixel_sampling_bilinear(PyObject *get_tile_cb, const int ix, const int iy,
 	const int y_hi = ceil(oy);
 
 	/* Read four pixels for interpolations */
-	if (get_pixel_color(get_tile_cb, x_lo, y_lo, c0))
+	if (get_pixel_color(sampler, x_lo, y_lo, c0))
 		return -1;
 
-	if (get_pixel_color(get_tile_cb, x_hi, y_lo, c1))
+	if (get_pixel_color(sampler, x_hi, y_lo, c1))
 		return -1;
 
-	if (get_pixel_color(get_tile_cb, x_hi, y_hi, c2))
+	if (get_pixel_color(sampler, x_hi, y_hi, c2))
 		return -1;
 
-	if (get_pixel_color(get_tile_cb, x_lo, y_hi, c3))
+	if (get_pixel_color(sampler, x_lo, y_hi, c3))
 		return -1;
 
 	/* Compute interpolation factors */
@@ -1581,7 +1842,7 @@ pixel_sampling_bilinear(PyObject *get_tile_cb, const int ix, const int iy,
 }
 
 static int
-pixel_sampling_bresenham_redux(PyObject *get_tile_cb, const int ix, const int iy,
+pixel_sampling_bresenham_redux(TileSampler *sampler, const int ix, const int iy,
 							   uint16_t color[MAX_CHANNELS], const float coeffs[4],
 							   int channels)
 {
@@ -1599,16 +1860,16 @@ pixel_sampling_bresenham_redux(PyObject *get_tile_cb, const int ix, const int iy
 	const int y_hi = ceilf(oy);
 
 	/* Read four pixels for interpolations */
-	if (get_pixel_color(get_tile_cb, x_lo, y_lo, c0))
+	if (get_pixel_color(sampler, x_lo, y_lo, c0))
 		return -1;
 
-	if (get_pixel_color(get_tile_cb, x_hi, y_lo, c1))
+	if (get_pixel_color(sampler, x_hi, y_lo, c1))
 		return -1;
 
-	if (get_pixel_color(get_tile_cb, x_hi, y_hi, c2))
+	if (get_pixel_color(sampler, x_hi, y_hi, c2))
 		return -1;
 
-	if (get_pixel_color(get_tile_cb, x_lo, y_hi, c3))
+	if (get_pixel_color(sampler, x_lo, y_hi, c3))
 		return -1;
 
 	/* Compute interpolation factors */
@@ -1668,18 +1929,31 @@ initialize_pixbuf(PyPixbuf *self, int width, int height, int pixfmt, PyPixbuf *s
     self->bpr = width * self->bpp;
 
 	if (!data) {
-		self->data_alloc = AllocVecTaskPooled((self->bpr*height)+15);
-		if (!self->data_alloc)
+		/* Copy-on-write: share pixels data with the source */
+		if ((NULL != src) && (NULL != src->data_alloc) && !PyPixbuf_DATA(src)->exported)
 		{
-			PyErr_NoMemory();
-			return 1;
+			self->data_alloc = src->data_alloc;
+			self->data = src->data;
+			PyPixbuf_DATA(self)->refcnt++;
 		}
+		else
+		{
+			self->data_alloc = AllocVecTaskPooled(PyPixbuf_ALLOC_SIZE(self->bpr*height));
+			if (!self->data_alloc)
+			{
+				PyErr_NoMemory();
+				return 1;
+			}
+
+			PyPixbuf_DATA(self)->refcnt = 1;
+			PyPixbuf_DATA(self)->exported = 0;
 
-		/* 16-bytes alignment */
-		self->data = (void*)((((unsigned long)self->data_alloc)+15) & ~15);
+			/* 16-bytes alignment */
+			self->data = PyPixbuf_ALIGN_DATA(self->data_alloc);
 
-		if (NULL != src)
-			memcpy(self->data, src->data, self->bpr * height);
+			if (NULL != src)
+				memcpy(self->data, src->data, self->bpr * height);
+		}
 	} else {
 		self->data_alloc = NULL;
 		self->data = data;
@@ -1697,6 +1971,21 @@ initialize_pixbuf(PyPixbuf *self, int width, int height, int pixfmt, PyPixbuf *s
     self->readpixel = init_values->readpixel;
     self->writepixel_alpha_locked = init_values->writepixel_alpha_locked;
 
+    /* Copy also the MIP-map pyramid */
+    if ((NULL != src) && (NULL != src->mipmap))
+    {
+        Py_ssize_t size = mipmap_size(src, src->mipmap_levels);
+
+        self->mipmap = AllocVecTaskPooled(size);
+        if (NULL != self->mipmap)
+        {
+            memcpy(self->mipmap, src->mipmap, size);
+            self->mipmap_levels = src->mipmap_levels;
+        }
+        else
+            self->damaged = TRUE; /* rebuild it later */
+    }
+
     return 0;
 }
 
@@ -1727,7 +2016,9 @@ pixbuf_new(PyTypeObject *type, PyObject *args)
 static void
 pixbuf_dealloc(PyPixbuf *self)
 {
-    if (NULL != self->data_alloc) FreeVecTaskPooled(self->data_alloc);
+    if ((NULL != self->data_alloc) && !--PyPixbuf_DATA(self)->refcnt)
+        FreeVecTaskPooled(self->data_alloc);
+    free_mipmap(self);
     self->ob_type->tp_free((PyObject *)self);
 }
 
@@ -1794,8 +2085,12 @@ pixbuf_set_pixel(PyPixbuf *self, PyObject *args)
     x = MIN(MAX(0, x), self->width-1);
     y = MIN(MAX(0, y), self->height-1);
 
+    if (PyPixbuf_Unshare(self))
+        return NULL;
+
     pix = &self->data[y*self->bpr + x*(self->bpc/8)*self->nc];
     self->writepixel(pix, 1.f, 1.f, color);
+    self->damaged = TRUE;
 
     Py_RETURN_NONE;
 }
@@ -1842,15 +2137,19 @@ pixbuf_get_pixel(PyPixbuf *self, PyObject *args)
     return py_color;
 }
 
+/* Average color of pixels inside a disc.
+ * If the disc covers more than 'samples' pixels (0 for no limit),
+ * only one pixel per cell of a grid is read (stratified sampling).
+ */
 static PyObject *
 pixbuf_get_average_pixel(PyPixbuf *self, PyObject *args)
 {
     float radius, sums[MAX_CHANNELS];
-    int minx, miny, maxx, maxy, sx, sy, x, y, i;
+    int minx, miny, maxx, maxy, sx, sy, x, y, i, samples=0, step=1;
     PyObject *py_color;
     float color[MAX_CHANNELS];
 
-    if (!PyArg_ParseTuple(args, "fii", &radius, &sx, &sy))
+    if (!PyArg_ParseTuple(args, "fii|i", &radius, &sx, &sy, &samples))
         return NULL;
 
     if ((sx < 0) || (sy < 0) || (sx >= self->width) || (sy >= self->height))
@@ -1869,11 +2168,54 @@ pixbuf_get_average_pixel(PyPixbuf *self, PyObject *args)
     maxy = ceilf(sy + rad_box);
     //printf("area: %u,%u -> %u,%u\n", minx, miny, maxx, maxy);
 
+    /* Don't read outside the pixbuf */
+    minx = MAX(minx, 0);
+    miny = MAX(miny, 0);
+    maxx = MIN(maxx, (int)self->width-1);
+    maxy = MIN(maxy, (int)self->height-1);
+
     /* Prepare some data */
     int bpp = self->bpp;
     unsigned int sum_weight = 0;
     bzero(sums, sizeof(sums));
 
+    int chan_count = self->nc;
+
+    if (samples > 0)
+        step = sqrtf(M_PI * radius * radius / samples);
+
+    if (step > 1)
+    {
+        int cx, cy;
+
+        for (cy=miny/step; cy <= maxy/step; cy++)
+        {
+            for (cx=minx/step; cx <= maxx/step; cx++)
+            {
+                uint32_t h = hash_2d(cx, cy);
+                uint16_t tmp_color[MAX_CHANNELS];
+
+                x = cx*step + h % step;
+                y = cy*step + (h >> 16) % step;
+                if ((x < minx) || (x > maxx) || (y < miny) || (y > maxy))
+                    continue;
+
+                float rx = ((float)(x - sx) + .5) / radius;
+                float ry = ((float)(y - sy) + .5) / radius;
+
+                if (rx*rx + ry*ry > 1.0)
+                    continue;
+
+                sum_weight++;
+                self->readpixel(self->data + y*self->bpr + x*bpp, tmp_color);
+                for (i=0; i<chan_count; i++)
+                    sums[i] += self->ctofloat(&tmp_color[i]);
+            }
+        }
+
+        goto average;
+    }
+
     /* Radius derivatives */
     const float rd = 1.0 / radius;
     const float xx0 = (float)(minx - sx) + .5; /* center of pixel */
@@ -1881,7 +2223,6 @@ pixbuf_get_average_pixel(PyPixbuf *self, PyObject *args)
     float rxy = xx0*rd;
     float ryy = yy0*rd;
 
-    int chan_count = self->nc;
     uint8_t *buf = self->data + miny*self->bpr;
 
     /* Loop on all pixels inside a bbox centered on (x, y) */
@@ -1911,6 +2252,7 @@ pixbuf_get_average_pixel(PyPixbuf *self, PyObject *args)
         }
     }
 
+average:
     //printf("sums: %f %f %f %f, w=%u\n", sums[0], sums[1], sums[2], sums[3], sum_weight);
 
     if (!sum_weight)
@@ -1961,10 +2303,54 @@ pixbuf_get_average_pixel(PyPixbuf *self, PyObject *args)
     return py_color;
 }
 
+/* gen_mipmap(levels[, tilemgr]): build the pyramid and clear the damaged flag.
+ * If the pixbuf is a tile of the given manager, it's locked for writing
+ * as another thread may paint it.
+ */
+static PyObject *
+pixbuf_gen_mipmap(PyPixbuf *self, PyObject *args)
+{
+    unsigned int levels;
+    PyObject *tilemgr = NULL;
+    int err;
+
+    if (!PyArg_ParseTuple(args, "I|O", &levels, &tilemgr))
+        return NULL;
+
+    if (self->write2pixel == dummy_write2pixel)
+        return PyErr_Format(PyExc_TypeError, "MIP-mapping not supported by format 0x%08x",
+                            self->pixfmt);
+
+    if ((NULL != tilemgr) && !PyUnboundedTileMgr_Check(tilemgr))
+        return PyErr_Format(PyExc_TypeError, "UnboundedTileManager instance required, not %s",
+                            OBJ_TNAME(tilemgr));
+
+    if (NULL != tilemgr)
+        TileMgrAPI->lock_tile(tilemgr, self->x, self->y, TRUE);
+
+    /* Cleared first: pixels written after the lock release damage it again */
+    self->damaged = FALSE;
+    err = build_mipmap(self, levels);
+
+    if (NULL != tilemgr)
+        TileMgrAPI->unlock_tile(tilemgr, self->x, self->y);
+
+    if (err)
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
 static PyObject *
 pixbuf_get_mem_size(PyPixbuf *self, void *closure)
 {
-    return PyLong_FromUnsignedLong(self->bpr * self->height);
+    Py_ssize_t size = self->bpr * self->height;
+
+    /* Shared pixels data are equally accounted to each owner */
+    if (NULL != self->data_alloc)
+        size /= PyPixbuf_DATA(self)->refcnt;
+
+    return PyLong_FromUnsignedLong(size + mipmap_size(self, self->mipmap_levels));
 }
 
 static PyObject *
@@ -2007,6 +2393,9 @@ pixbuf_blit(PyPixbuf *self, PyObject *args)
     if (clip_area(self, dst_pixbuf, &dxoff, &dyoff, &sxoff, &syoff, &width, &height))
         Py_RETURN_NONE;
 
+    if (PyPixbuf_Unshare(dst_pixbuf))
+        return NULL;
+
     dst_pix_size = get_pixel_size(dst_pixbuf->pixfmt); //dst_pixbuf->bpp;
 	int toto = get_pixel_size(self->pixfmt);
 
@@ -2026,6 +2415,7 @@ pixbuf_blit(PyPixbuf *self, PyObject *args)
 
     /* Rasterize pixels to the given buffer */
     blit(src_data, dst_data, width, height, self->bpr, dst_pixbuf->bpr);
+    dst_pixbuf->damaged = TRUE;
 
     Py_RETURN_NONE;
 }
@@ -2055,6 +2445,9 @@ pixbuf_compose(PyPixbuf *self, PyObject *args)
     if (clip_area(self, dst_pixbuf, &dxoff, &dyoff, &sxoff, &syoff, &width, &height))
         Py_RETURN_NONE;
 
+    if (PyPixbuf_Unshare(dst_pixbuf))
+        return NULL;
+
     dst_pix_size = dst_pixbuf->bpp;
     src_pix_size = self->bpp;
 
@@ -2074,6 +2467,7 @@ pixbuf_compose(PyPixbuf *self, PyObject *args)
 
     /* Rasterize pixels to the given buffer */
     compose(src_data, dst_data, width, height, self->bpr, dst_pixbuf->bpr);
+    dst_pixbuf->damaged = TRUE;
 
     Py_RETURN_NONE;
 }
@@ -2137,12 +2531,16 @@ pixbuf_from_buffer(PyPixbuf *self, PyObject *args)
         dh = MIN(sh, self->height - dyoff);
     }
 
+    if (PyPixbuf_Unshare(self))
+        return NULL;
+
     dst_pix_size = self->bpp;
 
     /* Rasterize pixels to the given buffer */
     blit((void *)(src + syoff*src_stride + sxoff*src_pix_size),
          (void *)(self->data + dyoff*self->bpr + dxoff*dst_pix_size),
          dw, dh, src_stride, self->bpr);
+    self->damaged = TRUE;
 
     Py_RETURN_NONE;
 }
@@ -2150,7 +2548,11 @@ pixbuf_from_buffer(PyPixbuf *self, PyObject *args)
 static PyObject *
 pixbuf_clear(PyPixbuf *self)
 {
+    if (PyPixbuf_Unshare(self))
+        return NULL;
+
     bzero(self->data, self->bpr * self->height);
+    self->damaged = TRUE;
     Py_RETURN_NONE;
 }
 
@@ -2188,10 +2590,14 @@ pixbuf_clear_area(PyPixbuf *self, PyObject *args)
     h = y2-y1+1;
 
     /* clear */
+    if (PyPixbuf_Unshare(self))
+        return NULL;
+
     pixel_size = self->bpp;
-    ptr += y1*self->bpr + x1*pixel_size;
+    ptr = self->data + y1*self->bpr + x1*pixel_size;
     for (y=0; y < h; y++, ptr += self->bpr)
         bzero(ptr, w*pixel_size);
+    self->damaged = TRUE;
 
 bye:
     Py_RETURN_NONE;
@@ -2205,6 +2611,10 @@ pixbuf_clear_white(PyPixbuf *self, PyObject *args)
     int pixoff = (self->bpc * self->nc) / 8;
     static uint16_t white[] = {0x7fff, 0x7fff, 0x7fff};
 
+    if (PyPixbuf_Unshare(self))
+        return NULL;
+
+    pix = self->data;
     for (y=0; y < self->height; y++)
     {
         for (x=0; x < self->width; x++)
@@ -2213,6 +2623,7 @@ pixbuf_clear_white(PyPixbuf *self, PyObject *args)
             pix += pixoff;
         }
     }
+    self->damaged = TRUE;
 
     Py_RETURN_NONE;
 }
@@ -2233,6 +2644,11 @@ pixbuf_clear_value(PyPixbuf *self, PyObject *args)
     for (i=0; i < self->nc; i++)
         self->cfromfloat(value, &color[i]);
 
+    if (PyPixbuf_Unshare(self))
+        return NULL;
+
+    pix = self->data;
+
     for (y=0; y < self->height; y++)
     {
         for (x=0; x < self->width; x++)
@@ -2241,6 +2657,7 @@ pixbuf_clear_value(PyPixbuf *self, PyObject *args)
             pix += pixoff;
         }
     }
+    self->damaged = TRUE;
 
     Py_RETURN_NONE;
 }
@@ -2257,6 +2674,11 @@ pixbuf_clear_alpha(PyPixbuf *self, PyObject *args)
     if (!PyArg_ParseTuple(args, "f", &value))
         return NULL;
 
+    if (PyPixbuf_Unshare(self))
+        return NULL;
+
+    pix = self->data;
+
     for (y=0; y < self->height; y++)
     {
         for (x=0; x < self->width; x++)
@@ -2265,6 +2687,7 @@ pixbuf_clear_alpha(PyPixbuf *self, PyObject *args)
             pix += pixoff;
         }
     }
+    self->damaged = TRUE;
 
     Py_RETURN_NONE;
 }
@@ -2318,6 +2741,19 @@ pixbuf_getbuffer(PyPixbuf *self, Py_ssize_t segment, void **ptrptr)
     return self->bpr * self->height;
 }
 
+static Py_ssize_t
+pixbuf_getwritebuffer(PyPixbuf *self, Py_ssize_t segment, void **ptrptr)
+{
+    if (PyPixbuf_Unshare(self))
+        return -1;
+
+    /* The pointer may be kept by the caller (cairo surface...) */
+    if (NULL != self->data_alloc)
+        PyPixbuf_DATA(self)->exported = TRUE;
+
+    return pixbuf_getbuffer(self, segment, ptrptr);
+}
+
 static PyObject *
 pixbuf_scroll(PyPixbuf *self, PyObject *args)
 {
@@ -2341,6 +2777,10 @@ pixbuf_scroll(PyPixbuf *self, PyObject *args)
     if ((dy >= self->height) || (-dy >= self->height))
         return pixbuf_clear(self);
 
+    if (PyPixbuf_Unshare(self))
+        return NULL;
+
+    ptr_src = ptr_dst = self->data;
     pixel_size = self->bpp;
 
     if (dx >= 0)
@@ -2388,18 +2828,28 @@ pixbuf_slow_transform_affine(PyPixbuf *self, PyObject *args)
 {
 	PyObject *ret = NULL;
     float coeffs[6]; /* Affine matrix coefficients */
-    PyObject *get_tile_cb; /* Python callable that gives the pixbuf container object of a given point */
+    PyObject *get_tile_cb; /* UnboundedTileManager or Python callable that gives the pixbuf container object of a given point */
     PyPixbuf *pb_dst; /* pixbuf destination */
     unsigned char ss=PB_SS_NONE; /* sub-sampling pixels? */
     void *dst_row_ptr;
 	int ix, iy;
+	TileSampler sampler;
 
     if (!PyArg_ParseTuple(args, "OO!(ffffff)|B", &get_tile_cb, &PyPixbuf_Type,
 						  &pb_dst, &coeffs[0], &coeffs[3], &coeffs[1],
 						  &coeffs[4], &coeffs[2], &coeffs[5], &ss))
         return NULL;
 
+	if ((ss != PB_SS_NONE) && (ss != PB_SS_BILINEAR))
+		return PyErr_Format(PyExc_ValueError, "unknown sampling value %u", ss);
+
+	if (PyPixbuf_Unshare(pb_dst))
+		return NULL;
+
     dst_row_ptr = pb_dst->data;
+	if (sampler_init(&sampler, get_tile_cb))
+		return NULL;
+	sampler_release_gil(&sampler);
 
     /* destination row-col scanline */
     for (iy=pb_dst->y; iy < (pb_dst->y + pb_dst->height); iy++, dst_row_ptr += pb_dst->bpr)
@@ -2410,46 +2860,58 @@ pixbuf_slow_transform_affine(PyPixbuf *self, PyObject *args)
         {
             uint16_t color[MAX_CHANNELS];
 
-			switch (ss)
+			if (ss == PB_SS_NONE)
 			{
-			case PB_SS_NONE:
-				if (pixel_sampling_direct(get_tile_cb, ix, iy, color, coeffs))
-					goto clear_cache;
-				break;
-            case PB_SS_BILINEAR:
-				if (pixel_sampling_bilinear(get_tile_cb, ix, iy, color, coeffs,
-											pb_dst->nc))
+				if (pixel_sampling_direct(&sampler, ix, iy, color, coeffs))
 					goto clear_cache;
-			default:
-				PyErr_Format(PyExc_ValueError, "unknown sampling value %u", ss);
-				goto clear_cache;
 			}
+			else if (pixel_sampling_bilinear(&sampler, ix, iy, color, coeffs,
+											 pb_dst->nc))
+				goto clear_cache;
 
             pb_dst->write2pixel(dst_data, color);
         }
     }
 
 	ret = Py_None;
-	Py_INCREF(ret);
 
 clear_cache:
-	Py_CLEAR(g_cache_pb);
+	sampler_acquire_gil(&sampler);
+	sampler_clear(&sampler);
+	Py_XINCREF(ret);
 	return ret;
 }
 
+/* Compose source pixels read from tiles of an UnboundedTileManager (or given
+ * by a get_tile_cb() callable) over self pixels.
+ * The GIL is released during the whole operation (except to call get_tile_cb),
+ * so different destination pixbufs can be blended concurrently by many threads.
+ * Note: source tiles must not be modified meanwhile.
+ */
 static PyObject *
 pixbuf_blend(PyPixbuf *self, PyObject *args)
 {
 	PyObject *get_tile_cb;
+	PyObject *ret = NULL;
 	float coeffs[4];
 	float opacity;
     unsigned int subsampling, mipmap_level=0;
+	TileSampler sampler;
 
     if (!PyArg_ParseTuple(args, "OIfffff|I", &get_tile_cb, &subsampling, &opacity,
 						  &coeffs[0], &coeffs[1], &coeffs[2], &coeffs[3], &mipmap_level))
         return NULL;
 
-	assert(self->pixfmt == pb_fg->pixfmt);
+	if ((subsampling != PB_SS_NONE) && (subsampling != PB_SS_BRESENHAM))
+		return PyErr_Format(PyExc_ValueError, "unknown sampling value %u",
+							subsampling);
+
+	if (mipmap_level > 16)
+		return PyErr_Format(PyExc_ValueError, "invalid MIP-map level %u",
+							mipmap_level);
+
+	if (PyPixbuf_Unshare(self))
+		return NULL;
 
 	const blendfunc blendfunc = blend_fg;
 	const int n_chan = self->nc;
@@ -2461,8 +2923,13 @@ pixbuf_blend(PyPixbuf *self, PyObject *args)
 	const int x_max = self->x + self->width;
 	const int y_max = self->y + self->height;
 
+	if (sampler_init(&sampler, get_tile_cb))
+		return NULL;
+	sampler.level = mipmap_level;
+	sampler_release_gil(&sampler);
+
     /* row-col scanline on self (i.e. destination) */
-	if (subsampling == PB_SS_NONE)
+	if ((subsampling == PB_SS_NONE) && !mipmap_level)
 	{
 		const float ox0 = (self->x + .5f) * coeffs[0] + coeffs[2];
 		const float oy0 = (self->y + .5f) * coeffs[1] + coeffs[3];
@@ -2482,12 +2949,12 @@ pixbuf_blend(PyPixbuf *self, PyObject *args)
 			while (ix < x_max)
 			{
 				int iox = floorf(ox);
+				PyPixbuf *src_pb;
 
-				PyPixbuf *src_pb = (PyPixbuf *)PyObject_CallFunction(get_tile_cb, "iii", iox, ioy, 0); /* NR */
-				if (!src_pb)
-					return NULL;
+				if (sampler_get_tile(&sampler, iox, ioy, &src_pb)) /* BR */
+					goto clear_cache;
 
-				if ((PyObject *)src_pb != Py_None)
+				if (NULL != src_pb)
 				{
 					const int iox_max = src_pb->x + src_pb->width;
 					void *src_data = src_pb->data + (ioy - src_pb->y) * src_pb->bpr - src_pb->x * src_pb->bpp;
@@ -2503,9 +2970,10 @@ pixbuf_blend(PyPixbuf *self, PyObject *args)
 							//blendfunc(n_chan, dst_color, fg_color, dst_color);
 							const uint32_t fg_a = (fg_color[3] * iopa) / (1<<15);
 							const uint32_t fg_a_1 = (1<<15) - fg_a;
-							dst_color[0] = ((uint32_t)dst_color[0] * fg_a_1) / (1<<15) + fg_color[0];
-							dst_color[1] = ((uint32_t)dst_color[1] * fg_a_1) / (1<<15) + fg_color[1];
-							dst_color[2] = ((uint32_t)dst_color[2] * fg_a_1) / (1<<15) + fg_color[2];
+							/* colors are premultiplied by alpha, so by opacity too */
+							dst_color[0] = ((uint32_t)dst_color[0] * fg_a_1 + fg_color[0] * iopa) / (1<<15);
+							dst_color[1] = ((uint32_t)dst_color[1] * fg_a_1 + fg_color[1] * iopa) / (1<<15);
+							dst_color[2] = ((uint32_t)dst_color[2] * fg_a_1 + fg_color[2] * iopa) / (1<<15);
 							dst_color[3] = ((uint32_t)dst_color[3] * fg_a_1) / (1<<15) + fg_a;
 
 							self->write2pixel(dst_data, dst_color);
@@ -2523,8 +2991,6 @@ pixbuf_blend(PyPixbuf *self, PyObject *args)
 					ix++;
 					ox += dox;
 				}
-
-				Py_DECREF(src_pb);
 			}
 
 			dst_row_ptr += self->bpr;
@@ -2532,7 +2998,7 @@ pixbuf_blend(PyPixbuf *self, PyObject *args)
 			oy += doy;
 		}
 	}
-	else if (subsampling == PB_SS_BRESENHAM)
+	else
 	{
 		int iy;
 		for (iy=self->y; iy < self->y + self->height; iy++)
@@ -2544,16 +3010,25 @@ pixbuf_blend(PyPixbuf *self, PyObject *args)
 			{
 				self->readpixel(dst_data, dst_color);
 
-				if (pixel_sampling_bresenham_redux(get_tile_cb, ix, iy, fg_color,
-												   coeffs, n_chan))
+				if (subsampling == PB_SS_BRESENHAM)
+				{
+					if (pixel_sampling_bresenham_redux(&sampler, ix, iy, fg_color,
+													   coeffs, n_chan))
+						goto clear_cache;
+				}
+				else if (get_pixel_color(&sampler,
+										 floorf((ix + .5f) * coeffs[0] + coeffs[2]),
+										 floorf((iy + .5f) * coeffs[1] + coeffs[3]),
+										 fg_color))
 					goto clear_cache;
 
 				//blendfunc(n_chan, dst_color, fg_color, dst_color);
 				const uint32_t fg_a = (fg_color[3] * iopa) / (1<<15);
 				const uint32_t fg_a_1 = (1<<15) - fg_a;
-				dst_color[0] = ((uint32_t)dst_color[0] * fg_a_1) / (1<<15) + fg_color[0];
-				dst_color[1] = ((uint32_t)dst_color[1] * fg_a_1) / (1<<15) + fg_color[1];
-				dst_color[2] = ((uint32_t)dst_color[2] * fg_a_1) / (1<<15) + fg_color[2];
+				/* colors are premultiplied by alpha, so by opacity too */
+				dst_color[0] = ((uint32_t)dst_color[0] * fg_a_1 + fg_color[0] * iopa) / (1<<15);
+				dst_color[1] = ((uint32_t)dst_color[1] * fg_a_1 + fg_color[1] * iopa) / (1<<15);
+				dst_color[2] = ((uint32_t)dst_color[2] * fg_a_1 + fg_color[2] * iopa) / (1<<15);
 				dst_color[3] = ((uint32_t)dst_color[3] * fg_a_1) / (1<<15) + fg_a;
 
 				// for debug
@@ -2570,16 +3045,14 @@ pixbuf_blend(PyPixbuf *self, PyObject *args)
 			dst_row_ptr += self->bpr;
 		}
 	}
-	else
-	{
-		PyErr_Format(PyExc_ValueError, "unknown sampling value %u",
-					 subsampling);
-		goto clear_cache;
-	}
+
+	ret = Py_None;
 
 clear_cache:
-	Py_CLEAR(g_cache_pb);
-	Py_RETURN_NONE;
+	sampler_acquire_gil(&sampler);
+	sampler_clear(&sampler);
+	Py_XINCREF(ret);
+	return ret;
 }
 
 static struct PyMethodDef pixbuf_methods[] = {
@@ -2598,6 +3071,7 @@ static struct PyMethodDef pixbuf_methods[] = {
     {"scroll", (PyCFunction)pixbuf_scroll, METH_VARARGS, NULL},
     {"slow_transform_affine", (PyCFunction)pixbuf_slow_transform_affine, METH_VARARGS, NULL},
     {"blend", (PyCFunction)pixbuf_blend, METH_VARARGS, NULL},
+    {"gen_mipmap", (PyCFunction)pixbuf_gen_mipmap, METH_VARARGS, NULL},
 
     {NULL} /* sentinel */
 };
@@ -2611,6 +3085,7 @@ static PyMemberDef pixbuf_members[] = {
     {"stride", T_UINT, offsetof(PyPixbuf, bpr), RO, NULL},
     {"ro", T_BYTE, offsetof(PyPixbuf, readonly), 0, NULL},
     {"damaged", T_BOOL, offsetof(PyPixbuf, damaged), 0, NULL},
+    {"mipmap_levels", T_UINT, offsetof(PyPixbuf, mipmap_levels), RO, NULL},
 
     {NULL}
 };
@@ -2623,7 +3098,7 @@ static PyGetSetDef pixbuf_getseters[] = {
 
 static PyBufferProcs pixbuf_as_buffer = {
     bf_getreadbuffer  : (readbufferproc)pixbuf_getbuffer,
-    bf_getwritebuffer : (writebufferproc)pixbuf_getbuffer,
+    bf_getwritebuffer : (writebufferproc)pixbuf_getwritebuffer,
     bf_getsegcount    : (segcountproc)pixbuf_getsegcount,
 };
 
@@ -2744,5 +3219,9 @@ INITFUNC(void)
     add_constants(m);
 
     ADD_TYPE(m, "Pixbuf", &PyPixbuf_Type);
+
+    /* Optional: direct tiles access for blending */
+    if (!import_tilemgr())
+        PyErr_Clear();
 }
 
@@ -114,8 +114,54 @@ typedef struct PyPixbuf_STRUCT {
     writefunc      writepixel_alpha_locked;     /* Function to change one pixel for given opacity and color, Alpha not modified if exists */
     write2func     write2pixel;                 /* Function to change one pixel using all color information */
     readfunc       readpixel;                   /* Function to get color of specific pixel */
-    uint8_t *      data_alloc;                  /* Pixels data (from malloc) */
+    uint8_t *      data_alloc;                  /* Pixels data (from malloc), starts with a PyPixbufData header */
     uint8_t *      data;                        /* Pixels data (aligned) */
+    uint8_t *      mipmap;                      /* MIP-map pyramid pixels data (from malloc), NULL if not built */
+    unsigned int   mipmap_levels;               /* Number of levels in the pyramid, full size level excluded */
 } PyPixbuf;
 
+/* Allocated pixels data may be shared by many pixbufs (copy-on-write).
+ * Pixels data follow this header, 16-bytes aligned.
+ * Shared data must be un-shared by PyPixbuf_Unshare() before any write.
+ */
+typedef struct PyPixbufData_STRUCT {
+    int            refcnt;                      /* Number of pixbufs using these data */
+    int            exported;                    /* Pointer given to the outside, never share it */
+} PyPixbufData;
+
+#define PyPixbuf_DATA(pb) ((PyPixbufData *)(pb)->data_alloc)
+#define PyPixbuf_ALIGN_DATA(ptr) ((void*)((((unsigned long)(ptr))+sizeof(PyPixbufData)+15) & ~15))
+#define PyPixbuf_ALLOC_SIZE(size) ((size) + sizeof(PyPixbufData) + 15)
+
+static int PyPixbuf_Unshare(PyPixbuf *pb) __attribute__((unused));
+
+/* Give its own pixels data to the pixbuf if shared (GIL must be held).
+ * Return -1 and set a Python exception on error.
+ */
+static int
+PyPixbuf_Unshare(PyPixbuf *pb)
+{
+    if ((NULL != pb->data_alloc) && (PyPixbuf_DATA(pb)->refcnt > 1))
+    {
+        Py_ssize_t size = pb->bpr * pb->height;
+        uint8_t *data_alloc = AllocVecTaskPooled(PyPixbuf_ALLOC_SIZE(size));
+
+        if (NULL == data_alloc)
+        {
+            PyErr_NoMemory();
+            return -1;
+        }
+
+        ((PyPixbufData *)data_alloc)->refcnt = 1;
+        ((PyPixbufData *)data_alloc)->exported = 0;
+        memcpy(PyPixbuf_ALIGN_DATA(data_alloc), pb->data, size);
+
+        PyPixbuf_DATA(pb)->refcnt--;
+        pb->data_alloc = data_alloc;
+        pb->data = PyPixbuf_ALIGN_DATA(data_alloc);
+    }
+
+    return 0;
+}
+
 #endif /* _PIXBUFMODULE_H */
@@ -25,6 +25,7 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 #include "common.h"
 #include "_pixbufmodule.h"
+#include "_tilemgrmodule.h"
 
 #ifdef __MORPHOS__
   #include <libraries/png.h>
@@ -47,82 +48,153 @@ OTHER DEALINGS IN THE SOFTWARE.
 #define MODNAME "_savers"
 #endif
 
-static jmp_buf gPNG_JmpBuf;
-static png_structp gPNG_png_ptr;
-static png_infop gPNG_info_ptr;
+typedef struct PyPNGEncoder_STRUCT {
+    PyObject_HEAD
 
-static char *gOutputBuffer = NULL;
-static Py_ssize_t gOutputAllocLength;
-static Py_ssize_t gOutputWriteLength;
-static Py_ssize_t gOutputRowIndex;
-static Py_ssize_t gOutputRowIndexMax;
+    png_structp     png_ptr;
+    png_infop       info_ptr;
+    PyObject *      file;               /* Output file object, NULL to encode in memory */
+    char *          buffer;             /* Output buffer if no file given */
+    Py_ssize_t      alloc_length;
+    Py_ssize_t      write_length;
+    uint32_t        width, height;
+    uint32_t        row_index;
+    int             busy;               /* An encoding is running (maybe without the GIL) */
+    PyThreadState * thread_state;       /* Not NULL when the GIL is released */
+    char            error[128];         /* Last libpng error message */
+} PyPNGEncoder;
+
+static PyTypeObject PyPNGEncoder_Type;
+
+/* Used by png_init/png_write_row/png_fini functions */
+static PyPNGEncoder *gEncoder = NULL;
 
 
 /******************************************************************************/
 
 static void
-writepng_cleanup(void)
+encoder_cleanup(PyPNGEncoder *self)
 {
-	png_destroy_write_struct(&gPNG_png_ptr, &gPNG_info_ptr);
+    if (NULL != self->png_ptr)
+        png_destroy_write_struct(&self->png_ptr, &self->info_ptr);
+    self->png_ptr = NULL;
+    self->info_ptr = NULL;
 }
 
 static void
-writepng_error_handler(png_structp png_ptr, png_const_charp msg)
+encoder_release_gil(PyPNGEncoder *self)
 {
-    PyErr_Format(PyExc_SystemError, "[libpng error] %s\n", msg);
-	writepng_cleanup();
-    longjmp(gPNG_JmpBuf, 1);
+    self->thread_state = PyEval_SaveThread();
 }
 
-static int
-writepng_encode_finish(void)
+static void
+encoder_acquire_gil(PyPNGEncoder *self)
 {
-    if (setjmp(gPNG_JmpBuf))
-        return 2;
+    PyThreadState *ts = self->thread_state;
 
-    png_write_end(gPNG_png_ptr, NULL);
-    return 0;
+    self->thread_state = NULL;
+    PyEval_RestoreThread(ts);
 }
 
+/* Called after a longjmp from the error handler, GIL must be held */
 static void
-mypngwrite(png_structp png_ptr, png_bytep data, png_size_t length)
+encoder_failed(PyPNGEncoder *self)
 {
-    if (gOutputBuffer)
+    /* Keep errors raised by the output file write method */
+    if (!PyErr_Occurred())
+        PyErr_Format(PyExc_SystemError, "[libpng error] %s", self->error);
+    encoder_cleanup(self);
+    self->busy = FALSE;
+}
+
+static void
+encoder_error_handler(png_structp png_ptr, png_const_charp msg)
+{
+    PyPNGEncoder *self = png_get_error_ptr(png_ptr);
+
+    /* The GIL may be released here, so the Python exception
+     * is set later by encoder_failed().
+     */
+    strncpy(self->error, msg, sizeof(self->error)-1);
+    longjmp(png_jmpbuf(png_ptr), 1);
+}
+
+static void
+encoder_write(png_structp png_ptr, png_bytep data, png_size_t length)
+{
+    PyPNGEncoder *self = png_get_io_ptr(png_ptr);
+
+    /* Streaming mode: data are directly given to the file object */
+    if (NULL != self->file)
     {
-        if (gOutputWriteLength+length > gOutputAllocLength)
-        {
-            Py_ssize_t new_length = gOutputAllocLength + MAX(length, 1024);
-            char *ptr = malloc(new_length);
+        PyObject *res;
+        int released = NULL != self->thread_state;
 
-            if (ptr)
-            {
-                gOutputAllocLength = new_length;
-                memcpy(ptr, gOutputBuffer, gOutputWriteLength);
-            }
-            else
-                PyErr_NoMemory();
+        if (released)
+            encoder_acquire_gil(self);
+
+        res = PyObject_CallMethod(self->file, "write", "s#", data, (int)length); /* NR */
+        Py_XDECREF(res);
 
-            free(gOutputBuffer);
-            gOutputBuffer = ptr;
+        if (released)
+            encoder_release_gil(self);
 
-            if (!gOutputBuffer)
-                return;
+        if (NULL == res)
+            png_error(png_ptr, "output file write failed");
+    }
+    else
+    {
+        if (self->write_length+length > self->alloc_length)
+        {
+            /* Geometric growth, avoid quadratic copies on big images */
+            Py_ssize_t new_length = MAX(self->alloc_length * 2, self->write_length + length);
+            char *ptr = realloc(self->buffer, new_length);
+
+            if (NULL == ptr)
+                png_error(png_ptr, "not enough memory for the output buffer");
+
+            self->buffer = ptr;
+            self->alloc_length = new_length;
         }
 
-        memcpy(gOutputBuffer + gOutputWriteLength, data, length);
-        gOutputWriteLength += length;
+        memcpy(self->buffer + self->write_length, data, length);
     }
+
+    self->write_length += length;
 }
 
 static void
-mypngflush(png_structp png_ptr)
+encoder_flush(png_structp png_ptr)
 {
-	/* nothing */
+    /* nothing */
 }
 
 static int
-writepng_init(uint32_t width, uint32_t height)
+encoder_check(PyPNGEncoder *self)
 {
+    if (self->busy)
+    {
+        PyErr_Format(PyExc_SystemError, "PNG encoder is busy");
+        return -1;
+    }
+
+    if (NULL == self->png_ptr)
+    {
+        PyErr_Format(PyExc_SystemError, "PNG encoder is closed");
+        return -1;
+    }
+
+    return 0;
+}
+
+/*******************************************************************************************
+** PyPNGEncoder_Type
+*/
+
+static int
+encoder_init(PyPNGEncoder *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"width", "height", "file", "compression", "filters", NULL};
     static struct png_text_struct software = {
         compression:        PNG_TEXT_COMPRESSION_NONE,
         key:                "Software",
@@ -131,176 +203,677 @@ writepng_init(uint32_t width, uint32_t height)
         itxt_length:        0,
         lang:               NULL,
     };
-    int color_type, interlace_type;
+    unsigned int width, height;
+    int compression = Z_DEFAULT_COMPRESSION, filters = PNG_ALL_FILTERS;
+    PyObject *file = NULL;
 
-    gPNG_png_ptr = png_create_write_struct(PNG_LIBPNG_VER_STRING, gPNG_JmpBuf,
-										   writepng_error_handler, NULL);
-    if (!gPNG_png_ptr) {
-		PyErr_Format(PyExc_MemoryError, "can't allocate the png structure");
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "II|Oii:PNGEncoder", kwlist,
+                                     &width, &height, &file, &compression, &filters))
         return -1;
-	}
 
-	if (setjmp(gPNG_JmpBuf))
+    if ((compression < Z_DEFAULT_COMPRESSION) || (compression > Z_BEST_COMPRESSION))
+    {
+        PyErr_Format(PyExc_ValueError, "Invalid compression level %d", compression);
         return -1;
+    }
 
-    gPNG_info_ptr = png_create_info_struct(gPNG_png_ptr);
+    if (self->busy || self->png_ptr)
+    {
+        PyErr_Format(PyExc_SystemError, "PNG encoder already initialized");
+        return -1;
+    }
 
-    png_set_write_fn(gPNG_png_ptr, NULL, mypngwrite, mypngflush);
-    png_set_compression_level(gPNG_png_ptr, Z_DEFAULT_COMPRESSION);
+    if (Py_None == file)
+        file = NULL;
+    Py_XINCREF(file);
+    Py_CLEAR(self->file);
+    self->file = file;
+
+    free(self->buffer);
+    self->buffer = NULL;
+    self->alloc_length = self->write_length = 0;
+    self->width = width;
+    self->height = height;
+    self->row_index = 0;
+    self->error[0] = '\0';
+
+    self->png_ptr = png_create_write_struct(PNG_LIBPNG_VER_STRING, self,
+                                            encoder_error_handler, NULL);
+    if (NULL == self->png_ptr)
+    {
+        PyErr_Format(PyExc_MemoryError, "can't allocate the png structure");
+        return -1;
+    }
+
+    if (setjmp(png_jmpbuf(self->png_ptr)))
+    {
+        encoder_failed(self);
+        return -1;
+    }
 
-    color_type = PNG_COLOR_TYPE_RGBA;
-    interlace_type = PNG_INTERLACE_NONE;
+    self->info_ptr = png_create_info_struct(self->png_ptr);
+    if (NULL == self->info_ptr)
+        png_error(self->png_ptr, "can't allocate the png info structure");
 
-    png_set_IHDR(gPNG_png_ptr, gPNG_info_ptr,
-				 width, height, 8, color_type, interlace_type,
-				 PNG_COMPRESSION_TYPE_DEFAULT, PNG_FILTER_TYPE_DEFAULT);
+    png_set_write_fn(self->png_ptr, self, encoder_write, encoder_flush);
+    png_set_compression_level(self->png_ptr, compression);
+    png_set_filter(self->png_ptr, PNG_FILTER_TYPE_BASE, filters);
 
-    png_set_gAMA(gPNG_png_ptr, gPNG_info_ptr, 2.2); /* FIXME: obtain gamma from system */
-    png_set_text(gPNG_png_ptr, gPNG_info_ptr, &software, 1);
+    png_set_IHDR(self->png_ptr, self->info_ptr,
+                 width, height, 8, PNG_COLOR_TYPE_RGBA, PNG_INTERLACE_NONE,
+                 PNG_COMPRESSION_TYPE_DEFAULT, PNG_FILTER_TYPE_DEFAULT);
 
-    png_write_info(gPNG_png_ptr, gPNG_info_ptr);
+    png_set_gAMA(self->png_ptr, self->info_ptr, 2.2); /* FIXME: obtain gamma from system */
+    png_set_text(self->png_ptr, self->info_ptr, &software, 1);
 
-    png_set_packing(gPNG_png_ptr);
+    png_write_info(self->png_ptr, self->info_ptr);
+
+    png_set_packing(self->png_ptr);
 
     return 0;
 }
 
-/*************************************************************************************************************/
+static void
+encoder_dealloc(PyPNGEncoder *self)
+{
+    encoder_cleanup(self);
+    Py_CLEAR(self->file);
+    free(self->buffer);
+    self->ob_type->tp_free((PyObject *)self);
+}
 
 static PyObject *
-mod_png_init(PyObject *self, PyObject *args)
+encoder_write_row(PyPNGEncoder *self, PyObject *args)
 {
-	int width, height;
+    char *row_pointer;
+    int length;
 
-	if (gOutputBuffer)
-		return PyErr_Format(PyExc_SystemError, "PNG saver is busy");
+    if (!PyArg_ParseTuple(args, "t#", &row_pointer, &length))
+        return NULL;
 
-    if (!PyArg_ParseTuple(args, "II", &width, &height))
+    if (encoder_check(self))
         return NULL;
 
-	gOutputBuffer = calloc(1024, 1);
-    if (gOutputBuffer)
+    if (self->row_index >= self->height)
+        return PyErr_Format(PyExc_SystemError, "max row count reached, please call finish()");
+
+    if (length < self->width * 4)
+        return PyErr_Format(PyExc_ValueError, "row too short, %u bytes needed", self->width * 4);
+
+    if (setjmp(png_jmpbuf(self->png_ptr)))
     {
-        gOutputWriteLength = 0;
-        gOutputAllocLength = 1024;
-		gOutputRowIndex = 0;
-		gOutputRowIndexMax = height;
-
-		if (!writepng_init(width, height)) {
-			Py_RETURN_NONE;
-		} else
-			free(gOutputBuffer);
-	} else
-        return PyErr_Format(PyExc_IOError, "Can't allocate the output string");
-
-	gOutputBuffer = NULL;
-	return NULL;
+        encoder_failed(self);
+        return NULL;
+    }
+
+    png_write_row(self->png_ptr, (png_bytep)row_pointer);
+    return PyInt_FromLong(self->row_index++);
 }
 
 static PyObject *
-mod_png_fini(PyObject *self)
+encoder_write_pixbuf(PyPNGEncoder *self, PyObject *args)
 {
-	PyObject *output = NULL;
+    PyPixbuf *pixbuf;
+    PyPixbufData *data;
+    uint8_t *data_alloc, *ptr;
+    unsigned int y, bpr, rows = UINT_MAX;
+    volatile int res = 0;
 
-	if (!gOutputBuffer)
-		return PyErr_Format(PyExc_SystemError, "PNG saver not initialized yet");
+    if (!PyArg_ParseTuple(args, "O!|I", PyPixbuf_Type, &pixbuf, &rows))
+        return NULL;
 
-	if (!writepng_encode_finish())
-		output = PyString_FromStringAndSize(gOutputBuffer, gOutputWriteLength); /* NR */
+    if (encoder_check(self))
+        return NULL;
+
+    if (pixbuf->pixfmt != PyPixbuf_PIXFMT_RGBA_8_NOA)
+        return PyErr_Format(PyExc_TypeError, "pixbuf format must be FORMAT_RGBA8_NOA");
+
+    if (pixbuf->width != self->width)
+        return PyErr_Format(PyExc_ValueError, "pixbuf width must be %u, not %u", self->width, pixbuf->width);
+
+    rows = MIN(rows, pixbuf->height);
+    if (self->row_index + rows > self->height)
+        return PyErr_Format(PyExc_SystemError, "max row count reached, please call finish()");
 
-	free(gOutputBuffer);
-	gOutputBuffer = NULL;
+    /* Pixels data are shared during the encoding,
+     * so writers use their own copy and never free ours.
+     */
+    data_alloc = pixbuf->data_alloc;
+    if (NULL != data_alloc)
+        ((PyPixbufData *)data_alloc)->refcnt++;
 
-	return output;
+    /* The pixbuf object must not be accessed without the GIL */
+    ptr = pixbuf->data;
+    bpr = pixbuf->bpr;
+
+    self->busy = TRUE;
+    encoder_release_gil(self);
+
+    if (setjmp(png_jmpbuf(self->png_ptr)))
+        res = -1;
+    else
+    {
+        for (y=0; y < rows; y++, ptr += bpr)
+        {
+            png_write_row(self->png_ptr, ptr);
+            self->row_index++;
+        }
+    }
+
+    encoder_acquire_gil(self);
+    self->busy = FALSE;
+
+    if (NULL != data_alloc)
+    {
+        data = (PyPixbufData *)data_alloc;
+        if (!--data->refcnt)
+            FreeVecTaskPooled(data_alloc);
+    }
+
+    if (res)
+    {
+        encoder_failed(self);
+        return NULL;
+    }
+
+    return PyInt_FromLong(self->row_index);
 }
 
 static PyObject *
-mod_png_write_row(PyObject *self, PyObject *args)
+encoder_finish(PyPNGEncoder *self)
 {
-	char *row_pointer;
-	int length;
+    PyObject *output;
 
-	if (!gOutputBuffer)
-		return PyErr_Format(PyExc_SystemError, "PNG saver not initialized yet");
+    if (encoder_check(self))
+        return NULL;
 
-	if (!gOutputRowIndex >= gOutputRowIndexMax)
-		return PyErr_Format(PyExc_SystemError, "max row count reached, please call png_fini");
+    if (self->row_index < self->height)
+        return PyErr_Format(PyExc_SystemError, "%u rows missing", self->height - self->row_index);
 
-	if (!PyArg_ParseTuple(args, "t#", &row_pointer, &length))
+    if (setjmp(png_jmpbuf(self->png_ptr)))
+    {
+        encoder_failed(self);
         return NULL;
+    }
+
+    png_write_end(self->png_ptr, NULL);
+    encoder_cleanup(self);
 
-	if (setjmp(gPNG_JmpBuf)) {
-		free(gOutputBuffer);
-		gOutputBuffer = NULL;
-		return NULL;
-	}
+    if (NULL != self->file)
+    {
+        /* Streaming mode: return the number of written bytes */
+        Py_CLEAR(self->file);
+        return PyInt_FromSsize_t(self->write_length); /* NR */
+    }
 
-	png_write_row(gPNG_png_ptr, row_pointer);
-	return PyInt_FromLong(gOutputRowIndex++);
+    output = PyString_FromStringAndSize(self->buffer, self->write_length); /* NR */
+    free(self->buffer);
+    self->buffer = NULL;
+
+    return output;
+}
+
+static struct PyMethodDef encoder_methods[] = {
+    {"write_row", (PyCFunction)encoder_write_row, METH_VARARGS, NULL},
+    {"write_pixbuf", (PyCFunction)encoder_write_pixbuf, METH_VARARGS, NULL},
+    {"finish", (PyCFunction)encoder_finish, METH_NOARGS, NULL},
+    {NULL} /* sentinel */
+};
+
+static PyMemberDef encoder_members[] = {
+    {"width", T_UINT, offsetof(PyPNGEncoder, width), RO, NULL},
+    {"height", T_UINT, offsetof(PyPNGEncoder, height), RO, NULL},
+    {"rows", T_UINT, offsetof(PyPNGEncoder, row_index), RO, NULL},
+    {NULL}
+};
+
+static PyTypeObject PyPNGEncoder_Type = {
+    PyObject_HEAD_INIT(NULL)
+
+    tp_name         : "_savers.PNGEncoder",
+    tp_basicsize    : sizeof(PyPNGEncoder),
+    tp_flags        : Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    tp_doc          : "PNGEncoder(width, height, file=None, compression=-1, filters=FILTER_ALL)\n\n"
+                      "Encode RGBA8 rows as a PNG image, written into the file object 'file'\n"
+                      "or returned by finish() as a string.",
+
+    tp_new          : (newfunc)PyType_GenericNew,
+    tp_init         : (initproc)encoder_init,
+    tp_dealloc      : (destructor)encoder_dealloc,
+    tp_methods      : encoder_methods,
+    tp_members      : encoder_members,
+};
+
+/*************************************************************************************************************/
+
+static PyObject *
+mod_png_init(PyObject *self, PyObject *args)
+{
+    if (NULL != gEncoder)
+        return PyErr_Format(PyExc_SystemError, "PNG saver is busy");
+
+    gEncoder = (PyPNGEncoder *)PyObject_Call((PyObject *)&PyPNGEncoder_Type, args, NULL); /* NR */
+    if (NULL == gEncoder)
+        return NULL;
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+mod_png_fini(PyObject *self)
+{
+    PyObject *output;
+
+    if (NULL == gEncoder)
+        return PyErr_Format(PyExc_SystemError, "PNG saver not initialized yet");
+
+    output = encoder_finish(gEncoder); /* NR */
+    Py_CLEAR(gEncoder);
+
+    return output;
+}
+
+static PyObject *
+mod_png_write_row(PyObject *self, PyObject *args)
+{
+    PyObject *res;
+
+    if (NULL == gEncoder)
+        return PyErr_Format(PyExc_SystemError, "PNG saver not initialized yet");
+
+    res = encoder_write_row(gEncoder, args); /* NR */
+    if ((NULL == res) && (NULL == gEncoder->png_ptr))
+        Py_CLEAR(gEncoder);
+
+    return res;
 }
 
 static PyObject *
 mod_save_pixbuf_as_png_buffer(PyObject *self, PyObject *args)
 {
     PyPixbuf *pixbuf;
-	PyObject *output = NULL;
+    PyPNGEncoder *encoder;
+    PyObject *write_args, *output = NULL;
+    int compression = Z_DEFAULT_COMPRESSION, filters = PNG_ALL_FILTERS;
 
-	if (gOutputBuffer)
-		return PyErr_Format(PyExc_SystemError, "PNG saver is busy with a pixbuf");
+    if (!PyArg_ParseTuple(args, "O!|ii", PyPixbuf_Type, &pixbuf, &compression, &filters))
+        return NULL;
 
-    if (!PyArg_ParseTuple(args, "O!", PyPixbuf_Type, &pixbuf))
+    encoder = (PyPNGEncoder *)PyObject_CallFunction((PyObject *)&PyPNGEncoder_Type, "IIOii",
+                                                    pixbuf->width, pixbuf->height,
+                                                    Py_None, compression, filters); /* NR */
+    if (NULL == encoder)
         return NULL;
 
-    gOutputBuffer = calloc(1024, 1);
-    if (NULL != gOutputBuffer)
+    write_args = Py_BuildValue("(O)", pixbuf); /* NR */
+    if (NULL != write_args)
+    {
+        PyObject *res = encoder_write_pixbuf(encoder, write_args); /* NR */
+
+        Py_DECREF(write_args);
+        if (NULL != res)
+        {
+            Py_DECREF(res);
+            output = encoder_finish(encoder); /* NR */
+        }
+    }
+
+    Py_DECREF(encoder);
+    return output;
+}
+
+/*******************************************************************************************
+** PNG decoding
+*/
+
+typedef struct PNGDecoder_STRUCT {
+    png_structp     png_ptr;
+    png_infop       info_ptr;
+    const char *    data;               /* PNG file contents */
+    Py_ssize_t      size;
+    Py_ssize_t      offset;
+    PyThreadState * thread_state;       /* Not NULL when the GIL is released */
+    char            error[128];         /* Last libpng error message */
+} PNGDecoder;
+
+static void
+decoder_error_handler(png_structp png_ptr, png_const_charp msg)
+{
+    PNGDecoder *dec = png_get_error_ptr(png_ptr);
+
+    strncpy(dec->error, msg, sizeof(dec->error)-1);
+    longjmp(png_jmpbuf(png_ptr), 1);
+}
+
+static void
+decoder_warning_handler(png_structp png_ptr, png_const_charp msg)
+{
+    /* silent */
+}
+
+static void
+decoder_read(png_structp png_ptr, png_bytep data, png_size_t length)
+{
+    PNGDecoder *dec = png_get_io_ptr(png_ptr);
+
+    if (dec->offset + length > dec->size)
+        png_error(png_ptr, "truncated PNG data");
+
+    memcpy(data, dec->data + dec->offset, length);
+    dec->offset += length;
+}
+
+/* Copy a band of decoded rows (RGBA8, no alpha-premul) into the tiles
+ * of the given tile manager, tiles fully transparent are not created.
+ * The band starts at document position (x, y) and its rows cover
+ * complete rows of tiles.
+ * Tiles are obtained with the GIL held, pixels are converted without it.
+ */
+static int
+decoder_store_band(PyObject *tilemgr, int tile_size, uint8_t *band,
+                   unsigned int width, unsigned int height, int x, int y)
+{
+    unsigned int stride = width * 4;
+    int tx, txmin, txmax, ty, tymin, tymax, i, count = 0;
+    PyPixbuf **tiles;
+    PyThreadState *ts;
+
+    txmin = floor_div(x, tile_size);
+    txmax = floor_div(x + (int)width - 1, tile_size);
+    tymin = floor_div(y, tile_size);
+    tymax = floor_div(y + (int)height - 1, tile_size);
+
+    tiles = malloc((txmax - txmin + 1) * (tymax - tymin + 1) * sizeof(PyPixbuf *));
+    if (NULL == tiles)
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    for (ty = tymin; ty <= tymax; ty++)
+    {
+        /* Rows of the band in this row of tiles */
+        int row0 = MAX(ty * tile_size - y, 0);
+        int row1 = MIN((ty + 1) * tile_size - y, (int)height);
+
+        for (tx = txmin; tx <= txmax; tx++)
+        {
+            /* Columns of the band in this tile */
+            int col0 = MAX(tx * tile_size - x, 0);
+            int col1 = MIN((tx + 1) * tile_size - x, (int)width);
+            int row, empty = TRUE;
+            PyPixbuf *pb;
+
+            /* Search for a non transparent pixel */
+            for (row = row0; empty && (row < row1); row++)
+            {
+                uint8_t *alpha = &band[row * stride + col0 * 4 + 3];
+                int col;
+
+                for (col = col0; col < col1; col++, alpha += 4)
+                {
+                    if (*alpha)
+                    {
+                        empty = FALSE;
+                        break;
+                    }
+                }
+            }
+
+            if (empty)
+                continue;
+
+            pb = (PyPixbuf *)TileMgrAPI->get_writable_tile(tilemgr, tx * tile_size, ty * tile_size); /* BR */
+            if (NULL == pb)
+                goto error;
+
+            if (pb->pixfmt != PyPixbuf_PIXFMT_ARGB_15X)
+            {
+                PyErr_Format(PyExc_TypeError, "Don't know how to blit from format 0x%08x to format 0x%08x",
+                             PyPixbuf_PIXFMT_RGBA_8_NOA, pb->pixfmt);
+                goto error;
+            }
+
+            /* Copy-on-write */
+            if (PyPixbuf_Unshare(pb))
+                goto error;
+
+            Py_INCREF(pb);
+            tiles[count++] = pb;
+        }
+    }
+
+    ts = PyEval_SaveThread();
+
+    for (i=0; i < count; i++)
     {
-        gOutputWriteLength = 0;
-        gOutputAllocLength = 1024;
+        PyPixbuf *pb = tiles[i];
+        int row0 = MAX(pb->y - y, 0);
+        int row1 = MIN(pb->y + pb->height - y, (int)height);
+        int col0 = MAX(pb->x - x, 0);
+        int col1 = MIN(pb->x + pb->width - x, (int)width);
+        int row, col;
+
+        TileMgrAPI->lock_tile(tilemgr, pb->x, pb->y, TRUE);
 
-        if (!writepng_init(pixbuf->width, pixbuf->height))
+        for (row = row0; row < row1; row++)
         {
-            uint32_t y;
+            uint8_t *src = &band[row * stride + col0 * 4];
+            uint8_t *dst = pb->data + (y + row - pb->y) * pb->bpr + (x + col0 - pb->x) * pb->bpp;
+
+            for (col = col0; col < col1; col++, src += 4, dst += pb->bpp)
+            {
+                /* 8bits -> 15bits with alpha pre-multiplication, as rgba8_noa_to_argb15x() */
+                uint32_t alpha = (((uint32_t)src[3] << 15) + ROUND_ERROR_8BITS) / 255;
+                uint16_t color[4];
 
-			if (setjmp(gPNG_JmpBuf))
-				goto out;
+                color[0] = ((uint32_t)src[0] * alpha + ROUND_ERROR_8BITS) / 255;
+                color[1] = ((uint32_t)src[1] * alpha + ROUND_ERROR_8BITS) / 255;
+                color[2] = ((uint32_t)src[2] * alpha + ROUND_ERROR_8BITS) / 255;
+                color[3] = alpha;
 
-            for (y=0; y < pixbuf->height; y++)
-                png_write_row(gPNG_png_ptr, &pixbuf->data[y*pixbuf->bpr]);
+                pb->write2pixel(dst, color);
+            }
+        }
+
+        pb->damaged = TRUE;
+        TileMgrAPI->unlock_tile(tilemgr, pb->x, pb->y);
+    }
 
-            if (writepng_encode_finish())
-				goto out;
+    PyEval_RestoreThread(ts);
 
-            writepng_cleanup();
-			output = PyString_FromStringAndSize(gOutputBuffer, gOutputWriteLength); /* NR */
+    for (i=0; i < count; i++)
+        Py_DECREF(tiles[i]);
+    free(tiles);
+    return 0;
+
+error:
+    for (i=0; i < count; i++)
+        Py_DECREF(tiles[i]);
+    free(tiles);
+    return -1;
+}
+
+static PyObject *
+mod_png_load_tiles(PyObject *self, PyObject *args)
+{
+    PNGDecoder dec;
+    PyObject *tilemgr;
+    png_uint_32 width, height;
+    int size, x, y, tile_size, bit_depth, color_type, passes;
+    uint8_t * volatile band = NULL;
+    png_bytep * volatile rows = NULL;
+    volatile int failed = FALSE;
+
+    if (!PyArg_ParseTuple(args, "s#Oii", &dec.data, &size, &tilemgr, &x, &y))
+        return NULL;
+    dec.size = size;
+
+    if (!PyUnboundedTileMgr_Check(tilemgr))
+        return PyErr_Format(PyExc_TypeError, "UnboundedTileManager instance required");
+
+    tile_size = TileMgrAPI->get_tile_size(tilemgr);
+    if (tile_size <= 0)
+        return PyErr_Format(PyExc_ValueError, "Invalid tile size");
+
+    dec.offset = 0;
+    dec.thread_state = NULL;
+    dec.error[0] = '\0';
+    dec.info_ptr = NULL;
+    dec.png_ptr = png_create_read_struct(PNG_LIBPNG_VER_STRING, &dec,
+                                         decoder_error_handler, decoder_warning_handler);
+    if (NULL == dec.png_ptr)
+        return PyErr_Format(PyExc_MemoryError, "can't allocate the png structure");
+
+    if (setjmp(png_jmpbuf(dec.png_ptr)))
+    {
+        if (NULL != dec.thread_state)
+            PyEval_RestoreThread(dec.thread_state);
+        if (!PyErr_Occurred())
+            PyErr_Format(PyExc_IOError, "[libpng error] %s", dec.error);
+        goto out;
+    }
+
+    dec.info_ptr = png_create_info_struct(dec.png_ptr);
+    if (NULL == dec.info_ptr)
+        png_error(dec.png_ptr, "can't allocate the png info structure");
+
+    png_set_read_fn(dec.png_ptr, &dec, decoder_read);
+    png_read_info(dec.png_ptr, dec.info_ptr);
+    png_get_IHDR(dec.png_ptr, dec.info_ptr, &width, &height, &bit_depth, &color_type, NULL, NULL, NULL);
+
+    /* Always decode as RGBA8 */
+    if (color_type == PNG_COLOR_TYPE_PALETTE)
+        png_set_palette_to_rgb(dec.png_ptr);
+    if ((color_type == PNG_COLOR_TYPE_GRAY) && (bit_depth < 8))
+        png_set_expand_gray_1_2_4_to_8(dec.png_ptr);
+    if (png_get_valid(dec.png_ptr, dec.info_ptr, PNG_INFO_tRNS))
+        png_set_tRNS_to_alpha(dec.png_ptr);
+    else if (!(color_type & PNG_COLOR_MASK_ALPHA))
+        png_set_filler(dec.png_ptr, 0xff, PNG_FILLER_AFTER);
+    if (bit_depth == 16)
+        png_set_strip_16(dec.png_ptr);
+    if (!(color_type & PNG_COLOR_MASK_COLOR))
+        png_set_gray_to_rgb(dec.png_ptr);
+    passes = png_set_interlace_handling(dec.png_ptr);
+    png_read_update_info(dec.png_ptr, dec.info_ptr);
+
+    if (passes > 1)
+    {
+        /* Interlaced images are decoded at once */
+        png_uint_32 i;
+
+        band = malloc(width * 4 * height);
+        rows = malloc(height * sizeof(png_bytep));
+        if ((NULL == band) || (NULL == rows))
+        {
+            PyErr_NoMemory();
+            png_error(dec.png_ptr, "no memory");
         }
+
+        for (i=0; i < height; i++)
+            rows[i] = &band[i * width * 4];
+
+        dec.thread_state = PyEval_SaveThread();
+        png_read_image(dec.png_ptr, rows);
+        PyEval_RestoreThread(dec.thread_state);
+        dec.thread_state = NULL;
+
+        if (decoder_store_band(tilemgr, tile_size, band, width, height, x, y))
+            failed = TRUE;
     }
     else
-        PyErr_Format(PyExc_MemoryError, "Can't allocate the output string");
+    {
+        /* Decode bands matching rows of tiles */
+        png_uint_32 row = 0;
+
+        band = malloc(width * 4 * tile_size);
+        if (NULL == band)
+        {
+            PyErr_NoMemory();
+            png_error(dec.png_ptr, "no memory");
+        }
+
+        while (row < height)
+        {
+            png_uint_32 i, count;
+
+            /* Band ends on the next tiles row limit */
+            count = (floor_div(y + row, tile_size) + 1) * tile_size - (y + row);
+            count = MIN(count, height - row);
+
+            dec.thread_state = PyEval_SaveThread();
+            for (i=0; i < count; i++)
+                png_read_row(dec.png_ptr, &band[i * width * 4], NULL);
+            PyEval_RestoreThread(dec.thread_state);
+            dec.thread_state = NULL;
+
+            if (decoder_store_band(tilemgr, tile_size, band, width, count, x, y + row))
+            {
+                failed = TRUE;
+                break;
+            }
+
+            row += count;
+        }
+    }
+
+    if (!failed)
+        png_read_end(dec.png_ptr, NULL);
 
 out:
-	free(gOutputBuffer);
-	gOutputBuffer = NULL;
-	return output;
+    png_destroy_read_struct(&dec.png_ptr, &dec.info_ptr, NULL);
+    free(band);
+    free(rows);
+
+    if (failed || PyErr_Occurred())
+        return NULL;
+
+    return Py_BuildValue("II", width, height);
 }
 
 static PyMethodDef methods[] = {
-	{"png_init", (PyCFunction)mod_png_init, METH_VARARGS, NULL},
-	{"png_fini", (PyCFunction)mod_png_fini, METH_NOARGS, NULL},
-	{"png_write_row", (PyCFunction)mod_png_write_row, METH_VARARGS, NULL},
+    {"png_init", (PyCFunction)mod_png_init, METH_VARARGS, NULL},
+    {"png_fini", (PyCFunction)mod_png_fini, METH_NOARGS, NULL},
+    {"png_write_row", (PyCFunction)mod_png_write_row, METH_VARARGS, NULL},
     {"save_pixbuf_as_png_buffer", (PyCFunction)mod_save_pixbuf_as_png_buffer, METH_VARARGS, NULL},
+    {"png_load_tiles", (PyCFunction)mod_png_load_tiles, METH_VARARGS, NULL},
     {NULL} /* sentinel */
 };
 
+static int add_constants(PyObject *m)
+{
+    INSI(m, "FILTER_NONE", PNG_FILTER_NONE);
+    INSI(m, "FILTER_SUB", PNG_FILTER_SUB);
+    INSI(m, "FILTER_UP", PNG_FILTER_UP);
+    INSI(m, "FILTER_AVG", PNG_FILTER_AVG);
+    INSI(m, "FILTER_PAETH", PNG_FILTER_PAETH);
+    INSI(m, "FILTER_ALL", PNG_ALL_FILTERS);
+
+    return 0;
+}
+
 PyMODINIT_FUNC
 INITFUNC(void)
 {
     PyObject *m;
 
+    if (PyType_Ready(&PyPNGEncoder_Type) < 0)
+        return;
+
     m = Py_InitModule(MODNAME, methods);
     if (NULL == m)
         return;
 
+    if (add_constants(m))
+        return;
+
     if (!import_pixbuf())
         return;
-}
 
+    /* Optional: PNG decoding into tiles */
+    if (!import_tilemgr())
+        PyErr_Clear();
+
+    ADD_TYPE(m, "PNGEncoder", &PyPNGEncoder_Type);
+}
@@ -23,8 +23,11 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 OTHER DEALINGS IN THE SOFTWARE.
 ******************************************************************************/
 
+#define _TILEMGR_CORE
+
 #include "common.h"
 #include "_pixbufmodule.h"
+#include "_tilemgrmodule.h"
 
 #ifndef INITFUNC
 #define INITFUNC init_tilemgr
@@ -41,18 +44,60 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 #define TILE_DEFAULT_SIZE 64
 
+/* Initial number of slots of the tile index (must be a power of 2) */
+#define TILE_INDEX_MIN_SIZE 64
+
+/* Number of tiles pixels locks of a manager (must be a power of 2) */
+#define TILE_LOCK_COUNT 64
+
+/* Tile index key: tile coordinates packed into a 64bits integer */
+#define TILE_KEY(tx, ty) (((uint64_t)(uint32_t)(tx) << 32) | (uint32_t)(ty))
+#define TILE_KEY_X(k) ((int)(int32_t)((k) >> 32))
+#define TILE_KEY_Y(k) ((int)(int32_t)((k) & 0xffffffff))
+
+typedef struct TileIndexEntry_STRUCT {
+	uint64_t		key;
+	PyObject *		tile; /* BR, NULL if the slot is free */
+} TileIndexEntry;
+
+/* TileDict: a dict sub-type keeping tiles by their (tx, ty) tuple position.
+ * In addition to the dictionnary storage, tiles are referenced by an
+ * open-addressing hash table keyed by tile coordinates, so C code can
+ * access them without creating a tuple key. The overall bounding box is
+ * maintained at each modification.
+ * All mutating methods are overloaded to keep both storages synchronized.
+ */
+typedef struct PyTileDict_STRUCT {
+	PyDictObject	dict;
+
+	TileIndexEntry *index;
+	Py_ssize_t		index_mask;
+	Py_ssize_t		index_used;
+
+	int				txmin, txmax, tymin, tymax;
+	int				bbox_dirty;
+
+	/* Lock of the owner manager, if any (BR).
+	 * Taken for writing by index modifications (always done with the GIL),
+	 * and for reading by C API lookups done without the GIL.
+	 */
+	RWLock *		lock;
+} PyTileDict;
+
 typedef struct PyUnboundedTileMgr_STRUCT {
 	PyObject_HEAD
 
 	RWLock *		lock;
+	RWLock *		tile_locks[TILE_LOCK_COUNT]; /* tiles pixels locks, shared by position hash */
 	PyObject *		tile_class;
 	int				tile_size;
 	int				pixfmt;
 	u_int			flags;
-	PyObject *		tiles; /* dictionnary of tiles, key = tile spacial position */
+	PyTileDict *	tiles; /* dictionnary of tiles, key = tile spacial position */
 } PyUnboundedTileMgr;
 
 
+static PyTypeObject PyTileDict_Type;
 static PyTypeObject PyUnboundedTileMgr_Type;
 
 
@@ -68,29 +113,264 @@ static void device_to_tile(int *x, int *y, int w)
 	*y = floorf(ty / w);
 }
 
-static int get_tile(PyUnboundedTileMgr *self, int tx, int ty, int create,
-					PyObject **tile, PyObject **key)
+static inline Py_ssize_t tile_hash(uint64_t key)
 {
-	*key = PyTuple_New(2); /* NR */
-	if (NULL == *key)
-		return -1;
+	return (Py_ssize_t)((key * 0x9e3779b97f4a7c15ULL) >> 32);
+}
 
-	PyTuple_SetItem(*key, 0, PyInt_FromLong(tx));
-	PyTuple_SetItem(*key, 1, PyInt_FromLong(ty));
+static inline void index_lock(PyTileDict *self)
+{
+	if (NULL != self->lock)
+		rwlock_lock_write(self->lock, TRUE);
+}
 
-	if (NULL != PyErr_Occurred())
+static inline void index_unlock(PyTileDict *self)
+{
+	if (NULL != self->lock)
+		rwlock_unlock(self->lock);
+}
+
+static int parse_tile_key(PyObject *key, int *tx, int *ty)
+{
+	if (!PyTuple_Check(key) || (PyTuple_GET_SIZE(key) != 2))
 	{
-		Py_DECREF(*key);
+		PyErr_SetString(PyExc_TypeError, "tile key must be a 2-tuple of integers");
 		return -1;
 	}
 
-	*tile = PyDict_GetItem(self->tiles, *key); /* BR */
+	*tx = PyInt_AsLong(PyTuple_GET_ITEM(key, 0));
+	*ty = PyInt_AsLong(PyTuple_GET_ITEM(key, 1));
+
 	if (PyErr_Occurred())
+		return -1;
+
+	return 0;
+}
+
+static PyObject *
+index_lookup(PyTileDict *self, int tx, int ty)
+{
+	uint64_t key = TILE_KEY(tx, ty);
+	Py_ssize_t i;
+
+	if (NULL == self->index)
+		return NULL;
+
+	i = tile_hash(key) & self->index_mask;
+	while (NULL != self->index[i].tile)
+	{
+		if (self->index[i].key == key)
+			return self->index[i].tile; /* BR */
+		i = (i + 1) & self->index_mask;
+	}
+
+	return NULL;
+}
+
+static int
+index_resize(PyTileDict *self, Py_ssize_t size)
+{
+	TileIndexEntry *old = self->index;
+	Py_ssize_t i, old_size = old ? self->index_mask + 1 : 0;
+
+	self->index = PyMem_Malloc(size * sizeof(TileIndexEntry));
+	if (NULL == self->index)
+	{
+		self->index = old;
+		PyErr_NoMemory();
+		return -1;
+	}
+
+	memset(self->index, 0, size * sizeof(TileIndexEntry));
+	self->index_mask = size - 1;
+
+	for (i=0; i < old_size; i++)
+	{
+		if (NULL != old[i].tile)
+		{
+			Py_ssize_t j = tile_hash(old[i].key) & self->index_mask;
+
+			while (NULL != self->index[j].tile)
+				j = (j + 1) & self->index_mask;
+			self->index[j] = old[i];
+		}
+	}
+
+	PyMem_Free(old);
+	return 0;
+}
+
+static int
+index_insert(PyTileDict *self, int tx, int ty, PyObject *tile)
+{
+	uint64_t key = TILE_KEY(tx, ty);
+	Py_ssize_t i;
+
+	index_lock(self);
+
+	/* Replacement first: it never fails, so callers rollback only new keys */
+	if (NULL != self->index)
+	{
+		i = tile_hash(key) & self->index_mask;
+		while (NULL != self->index[i].tile)
+		{
+			if (self->index[i].key == key)
+			{
+				/* Replacement: bbox unchanged */
+				self->index[i].tile = tile;
+				index_unlock(self);
+				return 0;
+			}
+			i = (i + 1) & self->index_mask;
+		}
+	}
+
+	/* Keep the load factor under 1/2 */
+	if ((NULL == self->index) || ((self->index_used + 1) * 2 > self->index_mask + 1))
+	{
+		if (index_resize(self, self->index ? (self->index_mask + 1) * 2 : TILE_INDEX_MIN_SIZE))
+		{
+			index_unlock(self);
+			return -1;
+		}
+	}
+
+	i = tile_hash(key) & self->index_mask;
+	while (NULL != self->index[i].tile)
+		i = (i + 1) & self->index_mask;
+
+	self->index[i].key = key;
+	self->index[i].tile = tile;
+
+	if (!self->index_used++)
+	{
+		self->txmin = self->txmax = tx;
+		self->tymin = self->tymax = ty;
+		self->bbox_dirty = FALSE;
+	}
+	else if (!self->bbox_dirty)
+	{
+		if (tx < self->txmin) self->txmin = tx;
+		if (tx > self->txmax) self->txmax = tx;
+		if (ty < self->tymin) self->tymin = ty;
+		if (ty > self->tymax) self->tymax = ty;
+	}
+
+	index_unlock(self);
+	return 0;
+}
+
+static void
+index_remove(PyTileDict *self, int tx, int ty)
+{
+	uint64_t key = TILE_KEY(tx, ty);
+	Py_ssize_t i, j;
+
+	if (NULL == self->index)
+		return;
+
+	index_lock(self);
+
+	i = tile_hash(key) & self->index_mask;
+	while (self->index[i].key != key)
+	{
+		if (NULL == self->index[i].tile)
+		{
+			index_unlock(self);
+			return;
+		}
+		i = (i + 1) & self->index_mask;
+	}
+
+	if (NULL == self->index[i].tile)
+	{
+		index_unlock(self);
+		return;
+	}
+
+	/* Backward shift deletion: no tombstone needed */
+	j = i;
+	for (;;)
+	{
+		Py_ssize_t k;
+
+		j = (j + 1) & self->index_mask;
+		if (NULL == self->index[j].tile)
+			break;
+
+		k = tile_hash(self->index[j].key) & self->index_mask;
+		if ((j > i && (k <= i || k > j)) || (j < i && (k <= i && k > j)))
+		{
+			self->index[i] = self->index[j];
+			i = j;
+		}
+	}
+	self->index[i].tile = NULL;
+
+	/* Removing a tile on the border shrinks the bbox, computed on demand */
+	self->index_used--;
+	if ((tx == self->txmin) || (tx == self->txmax) || (ty == self->tymin) || (ty == self->tymax))
+		self->bbox_dirty = TRUE;
+
+	index_unlock(self);
+}
+
+static void
+index_clear(PyTileDict *self)
+{
+	index_lock(self);
+	PyMem_Free(self->index);
+	self->index = NULL;
+	self->index_mask = 0;
+	self->index_used = 0;
+	self->bbox_dirty = FALSE;
+	index_unlock(self);
+}
+
+/* Add or replace a tile at given tile coordinates */
+static int
+tiledict_set(PyTileDict *self, int tx, int ty, PyObject *tile)
+{
+	PyObject *key;
+	int err;
+
+	key = Py_BuildValue("ii", tx, ty); /* NR */
+	if (NULL == key)
+		return -1;
+
+	err = PyDict_SetItem((PyObject *)self, key, tile);
+	Py_DECREF(key);
+
+	if (err)
+		return -1;
+
+	if (index_insert(self, tx, ty, tile))
 	{
-		Py_DECREF(*key);
+		/* Stay coherent with the index */
+		key = Py_BuildValue("ii", tx, ty); /* NR */
+		if (NULL != key)
+		{
+			PyDict_DelItem((PyObject *)self, key);
+			Py_DECREF(key);
+		}
 		return -1;
 	}
 
+	return 0;
+}
+
+static void
+tiledict_clear_all(PyTileDict *self)
+{
+	index_clear(self);
+	PyDict_Clear((PyObject *)self);
+}
+
+static int get_tile(PyUnboundedTileMgr *self, int tx, int ty, int create,
+					PyObject **tile)
+{
+	*tile = index_lookup(self->tiles, tx, ty); /* BR */
+
 	if (NULL == *tile)
 	{
 		if (create)
@@ -100,20 +380,12 @@ static int get_tile(PyUnboundedTileMgr *self, int tx, int ty, int create,
 										  tx * self->tile_size,
 										  ty * self->tile_size,
 										  self->tile_size); /* NR */
-			if (NULL != *tile)
-			{
-				if (PyDict_SetItem(self->tiles, *key, *tile))
-				{
-					Py_DECREF(*key);
-					Py_DECREF(*tile);
-					return -1;
-				}
+			if (NULL == *tile)
+				return -1;
 
-				Py_INCREF(*key); /* PyDict_SetItem stoles the refcount of key! */
-			}
-			else
+			if (tiledict_set(self->tiles, tx, ty, *tile))
 			{
-				Py_DECREF(*key);
+				Py_CLEAR(*tile);
 				return -1;
 			}
 		}
@@ -124,45 +396,361 @@ static int get_tile(PyUnboundedTileMgr *self, int tx, int ty, int create,
 	return 0;
 }
 
+/* Replace a read-only tile by a fresh copy (copy-on-write).
+ * *tile is a new reference, replaced by a new reference on the copy.
+ */
+static int make_writable(PyUnboundedTileMgr *self, int tx, int ty, PyObject **tile)
+{
+	PyObject *new_tile;
+
+	if (!((PyPixbuf *)*tile)->readonly)
+		return 0;
+
+	new_tile = PyObject_CallMethod(*tile, "copy", NULL); /* NR */
+	Py_DECREF(*tile);
+	*tile = new_tile;
+
+	if (NULL == new_tile)
+		return -1;
+
+	if (tiledict_set(self->tiles, tx, ty, new_tile))
+	{
+		Py_CLEAR(*tile);
+		return -1;
+	}
+
+	return 0;
+}
+
 static int get_bbox(PyUnboundedTileMgr *self, int *txmin_p, int *txmax_p, int *tymin_p, int *tymax_p)
 {
-	PyObject *key, *tile;
-	Py_ssize_t pos;
-	int txmin, txmax, tymin, tymax;
+	PyTileDict *tiles = self->tiles;
 
 	/* Empty? */
-	if (!PyDict_Size(self->tiles))
+	if (!tiles->index_used)
+		return -1;
+
+	if (tiles->bbox_dirty)
+	{
+		Py_ssize_t i;
+
+		tiles->txmin = tiles->tymin = INT_MAX;
+		tiles->txmax = tiles->tymax = INT_MIN;
+
+		for (i=0; i <= tiles->index_mask; i++)
+		{
+			int tx, ty;
+
+			if (NULL == tiles->index[i].tile)
+				continue;
+
+			tx = TILE_KEY_X(tiles->index[i].key);
+			ty = TILE_KEY_Y(tiles->index[i].key);
+
+			if (tx < tiles->txmin)
+				tiles->txmin = tx;
+			if (tx > tiles->txmax)
+				tiles->txmax = tx;
+
+			if (ty < tiles->tymin)
+				tiles->tymin = ty;
+			if (ty > tiles->tymax)
+				tiles->tymax = ty;
+		}
+
+		tiles->bbox_dirty = FALSE;
+	}
+
+	*txmin_p = tiles->txmin;
+	*txmax_p = tiles->txmax;
+	*tymin_p = tiles->tymin;
+	*tymax_p = tiles->tymax;
+
+	return 0;
+}
+
+
+/******************************************************************************
+ ** C API
+ */
+
+static PyObject *
+api_get_tile(PyObject *self, int x, int y)
+{
+	PyUnboundedTileMgr *tilemgr = (PyUnboundedTileMgr *)self;
+	PyObject *tile;
+
+	device_to_tile(&x, &y, tilemgr->tile_size);
+
+	rwlock_lock_read(tilemgr->lock, TRUE);
+	tile = index_lookup(tilemgr->tiles, x, y); /* BR */
+	rwlock_unlock(tilemgr->lock);
+
+	return tile;
+}
+
+static PyObject *
+api_get_writable_tile(PyObject *self, int x, int y)
+{
+	PyUnboundedTileMgr *tilemgr = (PyUnboundedTileMgr *)self;
+	PyObject *tile;
+
+	device_to_tile(&x, &y, tilemgr->tile_size);
+
+	if (get_tile(tilemgr, x, y, TRUE, &tile) || make_writable(tilemgr, x, y, &tile)) /* NR */
+		return NULL;
+
+	/* Owned by the manager */
+	Py_DECREF(tile);
+	return tile; /* BR */
+}
+
+static int
+api_get_tile_size(PyObject *self)
+{
+	return ((PyUnboundedTileMgr *)self)->tile_size;
+}
+
+static RWLock *
+get_tile_lock(PyUnboundedTileMgr *self, int x, int y)
+{
+	device_to_tile(&x, &y, self->tile_size);
+	return self->tile_locks[tile_hash(TILE_KEY(x, y)) & (TILE_LOCK_COUNT-1)];
+}
+
+static void
+api_lock_tile(PyObject *self, int x, int y, int write)
+{
+	RWLock *lock = get_tile_lock((PyUnboundedTileMgr *)self, x, y);
+
+	if (write)
+		rwlock_lock_write(lock, TRUE);
+	else
+		rwlock_lock_read(lock, TRUE);
+}
+
+static void
+api_unlock_tile(PyObject *self, int x, int y)
+{
+	rwlock_unlock(get_tile_lock((PyUnboundedTileMgr *)self, x, y));
+}
+
+static TileMgr_API tilemgr_api = {
+	type			: &PyUnboundedTileMgr_Type,
+	get_tile		: api_get_tile,
+	get_writable_tile : api_get_writable_tile,
+	get_tile_size	: api_get_tile_size,
+	lock_tile		: api_lock_tile,
+	unlock_tile		: api_unlock_tile,
+};
+
+
+/******************************************************************************
+ ** PyTileDict_Type
+ */
+
+static int
+tiledict_ass_subscript(PyTileDict *self, PyObject *key, PyObject *tile)
+{
+	int tx, ty;
+
+	if (parse_tile_key(key, &tx, &ty))
 		return -1;
 
-	txmin = tymin = INT_MAX;
-	txmax = tymax = INT_MIN;
-	pos = 0;
-	while (PyDict_Next(self->tiles, &pos, &key, &tile)) /* BR */
+	if (NULL == tile)
 	{
-		int tx, ty;
+		if (PyDict_DelItem((PyObject *)self, key))
+			return -1;
+
+		index_remove(self, tx, ty);
+		return 0;
+	}
+
+	if (PyDict_SetItem((PyObject *)self, key, tile))
+		return -1;
+
+	if (index_insert(self, tx, ty, tile))
+	{
+		PyDict_DelItem((PyObject *)self, key);
+		return -1;
+	}
+
+	return 0;
+}
+
+static PyObject *
+tiledict_update(PyTileDict *self, PyObject *args, PyObject *kwds)
+{
+	PyObject *items, *update, *res, *key, *tile;
+	Py_ssize_t pos = 0;
 
-		tx = PyInt_AS_LONG(PyTuple_GET_ITEM(key, 0));
-		ty = PyInt_AS_LONG(PyTuple_GET_ITEM(key, 1));
+	/* Let the dict type handles all update() arguments forms */
+	items = PyDict_New(); /* NR */
+	if (NULL == items)
+		return NULL;
 
-		if (tx < txmin)
-			txmin = tx;
-		if (tx > txmax)
-			txmax = tx;
+	update = PyObject_GetAttrString(items, "update"); /* NR */
+	if (NULL == update)
+		goto error;
 
-		if (ty < tymin)
-			tymin = ty;
-		if (ty > tymax)
-			tymax = ty;
+	res = PyObject_Call(update, args, kwds); /* NR */
+	Py_DECREF(update);
+	if (NULL == res)
+		goto error;
+	Py_DECREF(res);
+
+	while (PyDict_Next(items, &pos, &key, &tile)) /* BR */
+	{
+		if (tiledict_ass_subscript(self, key, tile))
+			goto error;
 	}
 
-	*txmin_p = txmin;
-	*txmax_p = txmax;
-	*tymin_p = tymin;
-	*tymax_p = tymax;
+	Py_DECREF(items);
+	Py_RETURN_NONE;
 
+error:
+	Py_DECREF(items);
+	return NULL;
+}
+
+static int
+tiledict_init(PyTileDict *self, PyObject *args, PyObject *kwds)
+{
+	PyObject *res;
+
+	res = tiledict_update(self, args, kwds); /* NR */
+	if (NULL == res)
+		return -1;
+
+	Py_DECREF(res);
 	return 0;
 }
 
+static void
+tiledict_dealloc(PyTileDict *self)
+{
+	index_clear(self);
+	PyDict_Type.tp_dealloc((PyObject *)self);
+}
+
+static int
+tiledict_tp_clear(PyTileDict *self)
+{
+	index_clear(self);
+	return PyDict_Type.tp_clear((PyObject *)self);
+}
+
+static PyObject *
+tiledict_clear(PyTileDict *self)
+{
+	tiledict_clear_all(self);
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+tiledict_pop(PyTileDict *self, PyObject *args)
+{
+	PyObject *key, *tile, *def = NULL;
+
+	if (!PyArg_UnpackTuple(args, "pop", 1, 2, &key, &def))
+		return NULL;
+
+	tile = PyDict_GetItem((PyObject *)self, key); /* BR */
+	if (NULL == tile)
+	{
+		if (NULL != def)
+		{
+			Py_INCREF(def);
+			return def;
+		}
+
+		PyErr_SetObject(PyExc_KeyError, key);
+		return NULL;
+	}
+
+	Py_INCREF(tile);
+	if (tiledict_ass_subscript(self, key, NULL))
+	{
+		Py_DECREF(tile);
+		return NULL;
+	}
+
+	return tile;
+}
+
+static PyObject *
+tiledict_popitem(PyTileDict *self)
+{
+	PyObject *key, *tile, *res;
+	Py_ssize_t pos = 0;
+
+	if (!PyDict_Next((PyObject *)self, &pos, &key, &tile)) /* BR */
+	{
+		PyErr_SetString(PyExc_KeyError, "popitem(): dictionary is empty");
+		return NULL;
+	}
+
+	res = PyTuple_Pack(2, key, tile); /* NR */
+	if (NULL == res)
+		return NULL;
+
+	if (tiledict_ass_subscript(self, key, NULL))
+	{
+		Py_DECREF(res);
+		return NULL;
+	}
+
+	return res;
+}
+
+static PyObject *
+tiledict_setdefault(PyTileDict *self, PyObject *args)
+{
+	PyObject *key, *tile, *def = Py_None;
+
+	if (!PyArg_UnpackTuple(args, "setdefault", 1, 2, &key, &def))
+		return NULL;
+
+	tile = PyDict_GetItem((PyObject *)self, key); /* BR */
+	if (NULL == tile)
+	{
+		if (tiledict_ass_subscript(self, key, def))
+			return NULL;
+		tile = def;
+	}
+
+	Py_INCREF(tile);
+	return tile;
+}
+
+static PyMappingMethods tiledict_as_mapping = {
+	mp_ass_subscript : (objobjargproc)tiledict_ass_subscript,
+};
+
+static struct PyMethodDef tiledict_methods[] = {
+	{"clear", (PyCFunction)tiledict_clear, METH_NOARGS, NULL},
+	{"pop", (PyCFunction)tiledict_pop, METH_VARARGS, NULL},
+	{"popitem", (PyCFunction)tiledict_popitem, METH_NOARGS, NULL},
+	{"setdefault", (PyCFunction)tiledict_setdefault, METH_VARARGS, NULL},
+	{"update", (PyCFunction)tiledict_update, METH_VARARGS | METH_KEYWORDS, NULL},
+	{NULL} /* sentinel */
+};
+
+static PyTypeObject PyTileDict_Type = {
+	PyObject_HEAD_INIT(NULL)
+
+	tp_name			: "_tilemgr.TileDict",
+	tp_basicsize	: sizeof(PyTileDict),
+	tp_flags		: Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC | Py_TPFLAGS_BASETYPE,
+	tp_doc			: "Tiles dictionnary with spatial index",
+
+	tp_init			: (initproc)tiledict_init,
+	tp_dealloc		: (destructor)tiledict_dealloc,
+	tp_clear		: (inquiry)tiledict_tp_clear,
+	tp_as_mapping	: &tiledict_as_mapping,
+	tp_methods		: tiledict_methods,
+};
+
 
 /******************************************************************************
  ** PyUnboundedTileMgr_Type
@@ -184,6 +772,8 @@ ubtilemgr_new(PyTypeObject *type, PyObject *args)
 	self = (PyUnboundedTileMgr*)type->tp_alloc(type, 0); /* NR */
 	if (NULL != self)
 	{
+		int i;
+
 		self->tile_size = size;
 		self->pixfmt = pixfmt;
 		self->flags = 0;
@@ -192,20 +782,34 @@ ubtilemgr_new(PyTypeObject *type, PyObject *args)
 		if (writable)
 			self->flags |= PBF_WRITABLE;
 
-		self->lock = rwlock_create();
-		if (NULL != self->lock)
+		for (i=0; i < TILE_LOCK_COUNT; i++)
+		{
+			self->tile_locks[i] = rwlock_create();
+			if (NULL == self->tile_locks[i])
+				break;
+		}
+
+		if (i == TILE_LOCK_COUNT)
 		{
-			self->tiles = PyDict_New();
-			if (NULL != self->tiles)
+			self->lock = rwlock_create();
+			if (NULL != self->lock)
 			{
-				self->tile_class = tile_class;
-				Py_INCREF(tile_class);
+				self->tiles = (PyTileDict *)PyObject_CallObject((PyObject *)&PyTileDict_Type, NULL); /* NR */
+				if (NULL != self->tiles)
+				{
+					self->tiles->lock = self->lock;
+					self->tile_class = tile_class;
+					Py_INCREF(tile_class);
 
-				return (PyObject *)self;
+					return (PyObject *)self;
+				}
+				else
+					rwlock_destroy(self->lock);
 			}
-			else
-				rwlock_destroy(self->lock);
 		}
+
+		while (i--)
+			rwlock_destroy(self->tile_locks[i]);
 	}
 
 	Py_CLEAR(self);
@@ -216,21 +820,31 @@ static int
 ubtilemgr_traverse(PyUnboundedTileMgr *self, visitproc visit, void *arg)
 {
 	Py_VISIT(self->tile_class);
+	Py_VISIT(self->tiles);
 	return 0;
 }
 
 static int
 ubtilemgr_clear(PyUnboundedTileMgr *self)
 {
+	/* The dictionnary may survive to its manager */
+	if (NULL != self->tiles)
+		self->tiles->lock = NULL;
+
 	Py_CLEAR(self->tile_class);
+	Py_CLEAR(self->tiles);
 	return 0;
 }
 
 static void
 ubtilemgr_dealloc(PyUnboundedTileMgr *self)
 {
+	int i;
+
 	ubtilemgr_clear(self);
 	rwlock_destroy(self->lock);
+	for (i=0; i < TILE_LOCK_COUNT; i++)
+		rwlock_destroy(self->tile_locks[i]);
 	self->ob_type->tp_free((PyObject *)self);
 }
 
@@ -238,18 +852,16 @@ static PyObject *
 ubtilemgr_get_tile(PyUnboundedTileMgr *self, PyObject *args)
 {
 	int tx, ty, create=TRUE;
-	PyObject *tile, *key;
+	PyObject *tile;
 
 	if (!PyArg_ParseTuple(args, "ii|i", &tx, &ty, &create))
 		return NULL;
 
 	device_to_tile(&tx, &ty, self->tile_size);
 
-	if (get_tile(self, tx, ty, create, &tile, &key) < 0) /* NR */
+	if (get_tile(self, tx, ty, create, &tile) < 0) /* NR */
 		return NULL;
 
-	Py_DECREF(key);
-
 	if (NULL == tile)
 		Py_RETURN_NONE;
 
@@ -259,32 +871,15 @@ ubtilemgr_get_tile(PyUnboundedTileMgr *self, PyObject *args)
 static PyObject *
 ubtilemgr_set_tile(PyUnboundedTileMgr *self, PyObject *args)
 {
-	int tx, ty, err;
-	PyObject *tile, *key;
+	int tx, ty;
+	PyObject *tile;
 
 	if (!PyArg_ParseTuple(args, "Oii", &tile, &tx, &ty))
 		return NULL;
 
 	device_to_tile(&tx, &ty, self->tile_size);
 
-	key = PyTuple_New(2);
-	if (NULL == key)
-		return NULL;
-
-	PyTuple_SetItem(key, 0, PyInt_FromLong(tx));
-	PyTuple_SetItem(key, 1, PyInt_FromLong(ty));
-
-	if (NULL != PyErr_Occurred())
-	{
-		Py_DECREF(key);
-		PyErr_SetString(PyExc_RuntimeError, "Failed to create tile key");
-		return NULL;
-	}
-
-	err = PyDict_SetItem(self->tiles, key, tile);
-	Py_DECREF(key);
-
-	if (err)
+	if (tiledict_set(self->tiles, tx, ty, tile))
 		return NULL;
 
 	Py_RETURN_NONE;
@@ -321,8 +916,8 @@ ubtilemgr_get_tiles(PyUnboundedTileMgr *self, PyObject *args)
 		{
 			for (tx=x; tx <= w; tx++)
 			{
-				PyObject *tile, *key;
-				int res = get_tile(self, tx, ty, create, &tile, &key); /* NR */
+				PyObject *tile;
+				int res = get_tile(self, tx, ty, create, &tile); /* NR */
 
 				if (res)
 				{
@@ -332,34 +927,11 @@ ubtilemgr_get_tiles(PyUnboundedTileMgr *self, PyObject *args)
 
 				if (NULL != tile)
 				{
-					/* read-only? */
-					if (((PyPixbuf *)tile)->readonly)
+					if (make_writable(self, tx, ty, &tile))
 					{
-						PyObject *new_tile;
-
-						/* Replace by a fresh new one */
-						new_tile = PyObject_CallMethod(tile, "copy", NULL); /* NR */
-
-						Py_DECREF(tile);
-						tile = new_tile;
-
-						if (NULL == tile)
-						{
-							Py_DECREF(key);
-							Py_DECREF(tiles);
-							return NULL;
-						}
-
-						if (PyDict_SetItem(self->tiles, key, tile))
-						{
-							Py_DECREF(key);
-							Py_DECREF(tile);
-							Py_DECREF(tiles);
-							return NULL;
-						}
+						Py_DECREF(tiles);
+						return NULL;
 					}
-					else
-						Py_DECREF(key);
 
 					if (PyList_Append(tiles, tile))
 					{
@@ -406,13 +978,11 @@ ubtilemgr_foreach(PyUnboundedTileMgr *self, PyObject *args)
 	{
 		for (tx=txmin; tx <= txmax; tx++)
 		{
-			PyObject *result, *tile, *key;
+			PyObject *result, *tile;
 
-			if (get_tile(self, tx, ty, create, &tile, &key)) /* NR */
+			if (get_tile(self, tx, ty, create, &tile)) /* NR */
 				goto bye;
 
-			Py_DECREF(key);
-
 			if (NULL == tile)
 				continue;
 
@@ -446,7 +1016,7 @@ ubtilemgr_from_buffer(PyUnboundedTileMgr *self, PyObject *args)
 		return NULL;
 
 	/* Removes previous data */
-	PyDict_Clear(self->tiles);
+	tiledict_clear_all(self->tiles);
 
 	/* Convert draw area into touched tiles range */
 	txmax = txmin+w-1; tymax = tymin+h-1;
@@ -457,19 +1027,15 @@ ubtilemgr_from_buffer(PyUnboundedTileMgr *self, PyObject *args)
 	{
 		for (tx=txmin; tx <= txmax; tx++)
 		{
-			PyObject *result, *tile, *callable, *key;
+			PyObject *result, *tile, *callable;
 
 			/* A tile is created if not exist */
-			if (get_tile(self, tx, ty, TRUE, &tile, &key)) /* BR */
+			if (get_tile(self, tx, ty, TRUE, &tile)) /* NR */
 				return NULL;
 
-			Py_DECREF(key);
-
 			if (NULL == tile)
 				continue;
 
-			Py_INCREF(tile);
-
 			callable = PyObject_GetAttrString(tile, "from_buffer"); /* NR */
 			if (NULL == callable)
 			{
@@ -566,6 +1132,9 @@ INITFUNC(void)
 {
 	PyObject *m;
 
+	PyTileDict_Type.tp_base = &PyDict_Type;
+	PyTileDict_Type.tp_traverse = PyDict_Type.tp_traverse;
+	if (PyType_Ready(&PyTileDict_Type) < 0) return;
 	if (PyType_Ready(&PyUnboundedTileMgr_Type) < 0) return;
 
 	m = Py_InitModule(MODNAME, methods);
@@ -574,5 +1143,8 @@ INITFUNC(void)
 
 	add_constants(m);
 
+	PyModule_AddObject(m, "_C_API", PyCObject_FromVoidPtr(&tilemgr_api, NULL));
+
+	ADD_TYPE(m, "TileDict", &PyTileDict_Type);
 	ADD_TYPE(m, "UnboundedTileManager", &PyUnboundedTileMgr_Type);
 }
@@ -0,0 +1,90 @@
+/******************************************************************************
+Copyright (c) 2009-2013 Guillaume Roguez
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+******************************************************************************/
+
+#ifndef _TILEMGRMODULE_H
+#define _TILEMGRMODULE_H
+
+/* C API exported by the _tilemgr module as the _C_API CObject */
+typedef struct TileMgr_API_STRUCT {
+    PyTypeObject * type;                        /* UnboundedTileManager type */
+
+    /* Return the tile containing the given device point or NULL if none (BR).
+     * Tiles are never created and no Python exception is set, so it can be
+     * called without the GIL as long as the manager is not modified meanwhile.
+     */
+    PyObject *     (*get_tile)(PyObject *tilemgr, int x, int y);
+
+    /* Return the tile containing the given device point to modify it (BR).
+     * The tile is created if needed, and a read-only tile is replaced
+     * by a copy (copy-on-write). GIL must be held.
+     * Return NULL and set a Python exception on error.
+     */
+    PyObject *     (*get_writable_tile)(PyObject *tilemgr, int x, int y);
+
+    int            (*get_tile_size)(PyObject *tilemgr);
+
+    /* Lock pixels of the tile at the given device point, for reading (write=0)
+     * or for writing. Tiles share a few locks by position, so a thread must
+     * hold only one of them at a time and never wait for the GIL meanwhile.
+     * Can be called without the GIL.
+     */
+    void           (*lock_tile)(PyObject *tilemgr, int x, int y, int write);
+    void           (*unlock_tile)(PyObject *tilemgr, int x, int y);
+} TileMgr_API;
+
+#ifndef _TILEMGR_CORE
+
+static TileMgr_API *TileMgrAPI=NULL;
+#define PyUnboundedTileMgr_Check(op) (NULL != TileMgrAPI && PyObject_TypeCheck(op, TileMgrAPI->type))
+
+static TileMgr_API *import_tilemgr(void) __attribute__((unused));
+
+static TileMgr_API *
+import_tilemgr(void)
+{
+    PyObject *_tilemgr = PyImport_ImportModule("model._tilemgr"); /* NR */
+
+    if (NULL != _tilemgr)
+    {
+        PyObject *api = PyObject_GetAttrString(_tilemgr, "_C_API"); /* NR */
+
+        /* Note: the module keeps a reference on the API object */
+        if (NULL != api)
+        {
+            if (PyCObject_Check(api))
+                TileMgrAPI = PyCObject_AsVoidPtr(api);
+            else
+                PyErr_SetString(PyExc_TypeError, "invalid _tilemgr C API object");
+            Py_DECREF(api);
+        }
+
+        Py_DECREF(_tilemgr);
+    }
+    return TileMgrAPI;
+}
+
+#endif /* _TILEMGR_CORE */
+
+#endif /* _TILEMGRMODULE_H */
@@ -86,6 +86,28 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 #define CLEAR(v) memset(v, 0, sizeof(v))
 
+/* Pseudo-random value of an integer position.
+ * Used to jitter positions of stratified samples, the same cell of
+ * the sampling grid giving always the same sample.
+ */
+static inline uint32_t
+hash_2d(int x, int y)
+{
+    uint32_t h = (uint32_t)x * 0x8da6b343u ^ (uint32_t)y * 0xd8163841u;
+
+    h ^= h >> 15;
+    h *= 0x2c1b3c6du;
+    h ^= h >> 12;
+    return h;
+}
+
+/* Floor of a / b, for b > 0 */
+static inline int
+floor_div(int a, int b)
+{
+    return (a >= 0 ? a : a - b + 1) / b;
+}
+
 /* T_BOOL is present after >= 2.6 */
 #ifndef T_BOOL
 #define T_BOOL T_BYTE
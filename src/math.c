@@ -135,44 +135,41 @@ float noise_2d(float x, float y)
     return 40.0f * (n0 + n1 + n2);
 }
 
+/* Random generators state is given by the caller,
+ * so a sequence can be replayed by giving the same initial seed.
+ */
 #ifdef __MORPHOS__
 #include <exec/system.h>
 //+ myrand1
-float myrand1(void)
+float myrand1(unsigned int *seed)
 {
-    static unsigned int seed=0;
-
-    seed = FastRand(seed);
-    return (float)seed / 0xffffffff;
+    *seed = FastRand(*seed);
+    return (float)*seed / 0xffffffff;
 }
 //-
 //+ myrand2
-float myrand2(void)
+float myrand2(unsigned int *seed)
 {
-    static unsigned int seed=0x1fa9b36;
-
-    seed = FastRand(seed);
-    return (float)seed / 0xffffffff;
+    *seed = FastRand(*seed);
+    return (float)*seed / 0xffffffff;
 }
 //-
 #else
 //+ myrand1
-float myrand1(void)
+float myrand1(unsigned int *seed)
 {
-    static unsigned int seed=0;
     int v;
 
-    v = rand_r(&seed);
+    v = rand_r(seed);
     return (float)v / RAND_MAX;
 }
 //-
 //+ myrand2
-float myrand2(void)
+float myrand2(unsigned int *seed)
 {
-    static unsigned int seed=0x1fa9b36;
     int v;
 
-    v = rand_r(&seed);
+    v = rand_r(seed);
     return (float)v / RAND_MAX;
 }
 //-
@@ -36,8 +36,8 @@ OTHER DEALINGS IN THE SOFTWARE.
 #endif
 
 extern float noise_2d(float x, float y);
-extern float myrand1(void);
-extern float myrand2(void);
+extern float myrand1(unsigned int *seed);
+extern float myrand2(unsigned int *seed);
 extern void rgb_to_hsv(float *rgb, float *hsv);
 extern void hsv_to_rgb(float *hsv, float *rgb);
 extern void my_Py_DECREF(PyObject *o);
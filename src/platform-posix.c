@@ -46,7 +46,7 @@ int rwlock_lock_write(RWLock *lock, int wait)
         return 1;
     }
 
-    return pthread_rwlock_tryrdlock((pthread_rwlock_t *)lock);
+    return pthread_rwlock_trywrlock((pthread_rwlock_t *)lock) ? 0 : 1;
 }
 
 void rwlock_unlock(RWLock *lock)
@@ -0,0 +1,53 @@
+from model import _brush, _pixbuf
+from model.devices import DeviceState
+from model.surface import UnboundedTiledSurface
+import math
+import time
+
+# 'chalk' default brush values, grain set per run
+CHALK = dict(radius_min=7.0, radius_max=7.0, opacity_min=.8, opacity_max=.8,
+             hardness=0.3, opa_comp=1.8, spacing=.5)
+LENGTH = 20000.0
+STEP = 4.0
+
+
+def states():
+    for i in xrange(int(LENGTH / STEP)):
+        state = DeviceState()
+        state.spos = (i * STEP, 200. + 100. * math.sin(i * .01))
+        state.vpos = (int(state.spos[0]), int(state.spos[1]))
+        state.time = i * .005
+        state.pressure = 1.0
+        state.xtilt = state.ytilt = 0.0
+        yield state
+
+
+def run(grain, radius):
+    brush = _brush.Brush()
+    for name, value in CHALK.iteritems():
+        setattr(brush, name, value)
+    brush.radius_min = brush.radius_max = radius
+    brush.grain = grain
+    brush.surface = UnboundedTiledSurface(_pixbuf.FORMAT_ARGB15X)
+
+    l = list(states())
+    t = time.time()
+    brush.stroke_start(l[0])
+    for state in l:
+        brush.draw_stroke(state)
+    brush.stroke_end()
+    return time.time() - t
+
+
+# Texture generation is done at first grain use
+t = time.time()
+run(.8, 1.0)
+print "Grain texture setup: %.3fs" % (time.time() - t)
+
+print "Chalk dabs pixels/second (estimated from spacing):"
+for radius in (7.0, 20.0, 50.0):
+    # approximate pixels covered by dabs along the stroke
+    pixels = LENGTH / (CHALK['spacing'] * radius) * math.pi * radius ** 2
+    for grain in (0.0, .8):
+        dt = min(run(grain, radius) for i in xrange(3))
+        print "  radius=%-4g grain=%-3g %8.2f Mpixels/s" % (radius, grain, pixels / dt / 1e6)
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import zipfile
+
+from model import _pixbuf, _savers
+from model.document import Document
+from model.surface import UnboundedTiledSurface
+
+filename = os.path.join(tempfile.gettempdir(), "test_load.ora")
+x0, y0, w, h = -37, 21, 150, 90
+
+# Opaque and transparent pixels, spanning negative and positive tiles
+data = ''.join(chr(x & 255) + chr(y & 255) + chr((x ^ y) & 255) + ('\x00' if (x + y) % 7 else '\xff')
+               for y in range(h) for x in range(w))
+
+stack = """<image w="%u" h="%u" x="%d" y="%d"><stack>
+<layer name="layer" src="data/layer_1.png" x="0" y="0" w="%u" h="%u"/>
+</stack></image>""" % (w, h, x0, y0, w, h)
+
+print "Test ORA load round-trip:",
+try:
+    pixbuf = _pixbuf.Pixbuf(_pixbuf.FORMAT_RGBA8_NOA, w, h)
+    pixbuf.from_buffer(_pixbuf.FORMAT_RGBA8_NOA, data, w*4, 0, 0, w, h)
+
+    z = zipfile.ZipFile(filename, 'w')
+    z.writestr('mimetype', 'image/openraster')
+    z.writestr('stack.xml', stack)
+    z.writestr('data/layer_1.png', _savers.save_pixbuf_as_png_buffer(pixbuf))
+    z.close()
+
+    doc = Document('test')
+    del doc[:]
+    doc.load_from_ora(filename)
+    assert len(doc) == 1
+
+    # Reference: same pixels converted by the tiles manager
+    ref = UnboundedTiledSurface(doc[0].surface.pixfmt)
+    ref.from_buffer(_pixbuf.FORMAT_RGBA8_NOA, data, w*4, x0, y0, w, h)
+
+    surface = doc[0].surface
+    assert sorted(surface.tiles.keys()) == sorted(ref.tiles.keys())
+    for y in range(y0, y0+h):
+        for x in range(x0, x0+w):
+            assert surface.read_pixel(x, y) == ref.read_pixel(x, y)
+except:
+    print "Failed"
+    raise
+else:
+    print "Ok"
+finally:
+    if os.path.exists(filename):
+        os.remove(filename)
@@ -0,0 +1,39 @@
+import random
+
+import cairo
+
+from model import _pixbuf, _cutils
+from model.layer import TiledLayer
+from model.surface import UnboundedTiledSurface
+from model.workers import WorkerPool
+
+w, h = 300, 220
+
+random.seed(0)
+data = ''.join(chr(random.randint(0, 255)) for i in xrange(w * h * 4))
+
+layer = TiledLayer(_pixbuf.FORMAT_ARGB15X, 'layer')
+layer.surface.from_buffer(_pixbuf.FORMAT_RGBA8_NOA, data, w*4, -70, -50, w, h)
+layer.matrix = cairo.Matrix(x0=3.5, y0=-1.25)
+
+
+def render(scale, pool):
+    surface = UnboundedTiledSurface(_pixbuf.FORMAT_ARGB15X)
+    clip = _cutils.Area(-400, -300, 800, 600)
+    layer.rasterize_to_surface(surface, clip, cairo.Matrix(scale, 0, 0, scale, 0, 0), pool)
+    return dict((pos, str(buffer(tile))) for pos, tile in surface.tiles.iteritems())
+
+print "Test pooled layer rasterizing is identical to serial one:",
+pool = WorkerPool(4)
+try:
+    for scale in (1.0, 0.3, 0.6, 2.5):
+        serial = render(scale, None)
+        assert serial
+        assert render(scale, pool) == serial, "scale %g" % scale
+except:
+    print "Failed"
+    raise
+else:
+    print "Ok"
+finally:
+    pool.close()
@@ -0,0 +1,45 @@
+from model._cutils import Region, Area
+import random
+
+
+def overlap(a, b):
+    return not (a[0] + a[2] <= b[0] or b[0] + b[2] <= a[0] or
+                a[1] + a[3] <= b[1] or b[1] + b[3] <= a[1])
+
+
+def check(region, areas):
+    rects = [tuple(a) for a in region]
+    for i, a in enumerate(rects):
+        assert a[2] > 0 and a[3] > 0
+        for b in rects[i + 1:]:
+            assert not overlap(a, b)
+    for a in areas:
+        assert Region([a]).intersect(region).pixels == a[2] * a[3]
+
+
+print "Test regions union/intersect/subtract:",
+try:
+    rnd = random.Random(0)
+    for n in range(50):
+        areas = [(rnd.randint(0, 3000), rnd.randint(0, 3000), rnd.randint(1, 80), rnd.randint(1, 80))
+                 for i in range(100)]
+        region = Region(areas)
+        check(region, areas)
+
+        clip = (500, 500, 1000, 1000)
+        inter = region.intersect(clip)
+        sub = region.subtract(Area(*clip))
+        check(inter, [])
+        check(sub, [])
+        assert inter.pixels + sub.pixels == region.pixels
+        assert not sub.intersect(clip)
+
+    # Far areas are not merged in a big one
+    region = Region([(0, 0, 20, 20), (1000, 1000, 20, 20)])
+    assert len(region) == 2 and region.pixels == 800
+    assert tuple(region.bbox) == (0, 0, 1020, 1020)
+except:
+    print "Failed"
+    raise
+else:
+    print "Ok"
@@ -44,6 +44,7 @@ import model.brush
 
 import view.context as ctx
 import view.operator as operator
+import view.render
 
 import app
 import operators
@@ -205,8 +206,22 @@ class DocumentMediator(GenericMediator):
         self.viewComponent.open_window(name)
 
     # notification handlers
+    @mvcHandler(main.DOC_SAVE_PROGRESS)
+    def _on_doc_save_progress(self, docproxy, stored, total):
+        win = self.get_win(docproxy)
+        if win:
+            win.set_save_progress(stored, total)
+
+            # Saving runs in the GUI thread, let GTK redraw the progress
+            while gtk.events_pending():
+                gtk.main_iteration(False)
+
     @mvcHandler(main.DOC_SAVE_RESULT)
     def _on_doc_save_result(self, docproxy, result, err=None):
+        win = self.get_win(docproxy)
+        if win:
+            win.set_save_progress(0)
+
         if not result:
             msg = "%s:\n'%s'\n\n%s:\n\n%s" % (_T("Failed to save document"),
                                               docproxy.docname,
@@ -232,6 +247,11 @@ class DocumentMediator(GenericMediator):
 
     # public API
 
+    def get_win(self, docproxy):
+        for win in gtk.window_list_toplevels():
+            if isinstance(win, DocWindow) and win.docproxy is docproxy:
+                return win
+
     def register_viewport(self, viewport):
         self.facade.registerMediator(DocViewportMediator(viewport))
 
@@ -288,13 +308,33 @@ class DocViewportMediator(GenericMediator):
             area = self.viewComponent.get_view_area(*area)
         self.viewComponent.repaint(area)
 
+    def _repaint(self, docproxy, area, layer=None):
+        "Redraw given document area (or Region) modified on layer. If area is None => full redraw."
+
+        # Cached tiles are shared by viewports of the document,
+        # rendering is done at expose time, after all invalidations.
+        view.render.TileCache.get(docproxy).invalidate(area, layer)
+
+        vp = self.viewComponent
+        if vp.docproxy is not docproxy: return
+        if area:
+            area = vp.get_view_area(area)
+        vp.repaint_doc(area)
+
     @mvcHandler(model.LayerProxy.LAYER_DIRTY)
     def _on_layer_dirty(self, docproxy, layer, area=None):
-        "Redraw given area. If area is None => full redraw."
+        "Redraw given area (or Region). If area is None => full redraw."
 
+        # layer to document space
         if area:
-            area = self.viewComponent.get_view_area(*area)
-        self.viewComponent.repaint_doc(area)
+            area = area.transform(layer.matrix.transform_point)
+        self._repaint(docproxy, area, layer)
+
+    @mvcHandler(model.DocumentProxy.DOC_DIRTY)
+    def _on_doc_dirty(self, docproxy, area=None):
+        "Redraw given area (or Region). If area is None => full redraw."
+
+        self._repaint(docproxy, area)
 
     @mvcHandler(model.DocumentProxy.DOC_LAYER_ADDED)
     @mvcHandler(main.DOC_LAYER_STACK_CHANGED)
@@ -304,9 +344,7 @@ class DocViewportMediator(GenericMediator):
         "Specific layer repaint, limited to its area."
 
         if not layer.empty:
-            area = layer.area
-            vp = self.viewComponent
-            vp.repaint_doc(vp.get_view_area(*area))
+            self._repaint(docproxy, layer.document_relative_area(*layer.area), layer)
 
     @mvcHandler(model.BrushProxy.BRUSH_PROP_CHANGED)
     def _on_brush_prop_changed(self, brush, name):
@@ -24,10 +24,12 @@
 ###############################################################################
 
 import gtk
+import gobject
 
 import view
 import utils
 import main
+import model
 import view.context as ctx
 
 from utils import _T
@@ -47,6 +49,10 @@ class Application(view.mixin.ApplicationMixin):
     _last_filename = None
 
     def __init__(self):
+        # Let worker threads (painting, brush previews) run during the main loop,
+        # must be done before any of them is started.
+        gobject.threads_init()
+
         self._open_doc = None # last open document filename
         self.create_ui()
 
@@ -59,11 +65,24 @@ class Application(view.mixin.ApplicationMixin):
         d['BrushHouse'] = BrushHouseWindow()
 
     def run(self):
+        # Repaint merged damages even if no more device events come
+        model.LayerProxy.damage.scheduler = self._schedule_damages_flush
+
+        # Repaint strokes drawn by the painting thread as soon as possible
+        model.painter.scheduler = gobject.idle_add
+
         gtk.main()
 
     def quit(self):
         gtk.main_quit()
 
+    def _schedule_damages_flush(self, delay):
+        gobject.timeout_add(int(delay * 1000), self._on_damages_flush)
+
+    def _on_damages_flush(self):
+        model.LayerProxy.flush_damages()
+        return False
+
     def open_window(self, name):
         ctx.windows[name].present()
 
@@ -117,10 +117,12 @@ class BrushEditorWindow(SubWindow):
         self.prop['hi_speed_track']    = self._add_slider(table, 'hi_speed_track', 0.0, 2.0, 0.0, .01, 0.1)
         self.prop['smudge']            = self._add_slider(table, 'smudge', 0.0, 1.0, 0.0, .01, 0.1)
         self.prop['smudge_var']        = self._add_slider(table, 'smudge_var', 0.0, 1.0, 0.0, .01, 0.1)
+        self.prop['smudge_samples']    = self._add_slider(table, 'smudge_samples', 0, 4096, 512, 16, 128)
         self.prop['grain']             = self._add_slider(table, 'grain', 0.0, 1.0, 0.0, .01, 0.1)
         self.prop['dab_radius_jitter'] = self._add_slider(table, 'dab_radius_jitter', 0.0, 1.0, 0.0, .01, 0.1)
         self.prop['dab_pos_jitter']    = self._add_slider(table, 'dab_pos_jitter', 0.0, 5.0, 0.0, .01, 0.1)
         self.prop['direction_jitter']  = self._add_slider(table, 'direction_jitter', 0.0, 1.0, 0.0, .01, 0.1)
+        self.prop['accumulate']        = self._add_slider(table, 'accumulate', 0, 2, 0, 1, 1)
 
         self.set_title('Brush Editor')
         self.set_default_size(320, 100)
@@ -28,13 +28,16 @@ import gtk.gdk as gdk
 
 import utils
 
-from model.brush import Brush, DrawableBrush
+from model.brush import Brush
+from model.brushpreview import preview_cache
 from model import _pixbuf
 from .common import SubWindow
 
 __all__ = [ 'BrushHouseWindow' ]
 
 TABLE_WIDTH = 5
+PREVIEW_WIDTH = 128
+PREVIEW_HEIGHT = 60
 
 class BrushHouseWindow(SubWindow):
     _current_cb = utils.idle_cb
@@ -47,7 +50,7 @@ class BrushHouseWindow(SubWindow):
         self._brushes = {}
         self._all = None
         self._selected = None # selected button
-        self._drawbrush = DrawableBrush() # used for preview
+        self._preview_timer = None
 
         # UI
         topbox = gtk.VBox()
@@ -170,23 +173,31 @@ class BrushHouseWindow(SubWindow):
 
     def refresh_brush(self, bt):
         bt = bt.allbt
-        brush = bt.brush
+        buf = preview_cache.render(bt.brush, PREVIEW_WIDTH, PREVIEW_HEIGHT, _pixbuf.FORMAT_RGBA8_NOA)
+        self._set_preview(bt, buf)
 
-        self._drawbrush.set_from_brush(brush)
-        width = 128
-        height = 60
-
-        buf = self._drawbrush.paint_rgb_preview(width, height, fmt=_pixbuf.FORMAT_RGBA8_NOA)
+    def _set_preview(self, bt, buf):
         pixbuf = gdk.pixbuf_new_from_data(buf, gdk.COLORSPACE_RGB, True, 8,
                                           buf.width, buf.height, buf.stride)
         icon_image = gtk.image_new_from_pixbuf(pixbuf)
         bt.set_image(icon_image)
-        bt.set_size_request(width+15, height+5)
+        bt.set_size_request(buf.width+15, buf.height+5)
         if bt.bt2:
             bt.bt2.set_image(icon_image)
-            bt.bt2.set_size_request(width+15, height+5)
+            bt.bt2.set_size_request(buf.width+15, buf.height+5)
         bt.show_all()
 
+    def _on_preview_timer(self):
+        for brush, buf in preview_cache.pop_ready():
+            bt = self._brushes.get(brush)
+            if bt and not brush.icon:
+                self._set_preview(bt, buf)
+
+        if preview_cache.pending:
+            return True
+        self._preview_timer = None
+        return False
+
     def _mkbrushbt(self, frame, brush):
         if brush.icon:
             icon_image = gtk.image_new_from_file(brush.icon)
@@ -194,14 +205,19 @@ class BrushHouseWindow(SubWindow):
             width = pixbuf.get_property('width')
             height = pixbuf.get_property('height')
         else:
-            self._drawbrush.set_from_brush(brush)
-            width = 128
-            height = 60
-
-            buf = self._drawbrush.paint_rgb_preview(width, height, fmt=_pixbuf.FORMAT_RGBA8_NOA)
-            pixbuf = gdk.pixbuf_new_from_data(buf, gdk.COLORSPACE_RGB, True, 8,
-                                              buf.width, buf.height, buf.stride)
-            icon_image = gtk.image_new_from_pixbuf(pixbuf)
+            width = PREVIEW_WIDTH
+            height = PREVIEW_HEIGHT
+
+            buf = preview_cache.get(brush, width, height, _pixbuf.FORMAT_RGBA8_NOA)
+            if buf is None:
+                # Not cached, rendered in background (see _on_preview_timer)
+                icon_image = gtk.Image()
+                if self._preview_timer is None:
+                    self._preview_timer = gobject.timeout_add(100, self._on_preview_timer)
+            else:
+                pixbuf = gdk.pixbuf_new_from_data(buf, gdk.COLORSPACE_RGB, True, 8,
+                                                  buf.width, buf.height, buf.stride)
+                icon_image = gtk.image_new_from_pixbuf(pixbuf)
 
         bt = gtk.ToggleButton()
         bt.set_image(icon_image)
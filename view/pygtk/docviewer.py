@@ -258,6 +258,11 @@ class DocWindow(gtk.Window):
         self._drbox = drbox = gtk.HBox(False, 1)
         topbox.pack_start(drbox, True)
 
+        # Save progress, only shown during document saving
+        self._progress = gtk.ProgressBar()
+        self._progress.set_no_show_all(True)
+        topbox.pack_start(self._progress, False)
+
         # Default viewport
         vp = DocViewport(self, docproxy)
         self._add_vp(vp)
@@ -297,6 +302,15 @@ class DocWindow(gtk.Window):
     def set_doc_name(self, name):
         self.set_title(self.__title_fmt % name)
 
+    def set_save_progress(self, stored, total=None):
+        "Show document saving progress, hide it if total is None"
+        if total:
+            self._progress.set_fraction(float(stored) / total)
+            self._progress.set_text(_T("Saving...") + " %u%%" % (stored * 100 / total))
+            self._progress.show()
+        else:
+            self._progress.hide()
+
     def confirm_close(self):
         dlg = gtk.Dialog(_T("Sure?"), self,
                          gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
@@ -41,7 +41,7 @@ import utils
 import model.devices
 
 from model import _pixbuf
-from model._cutils import Area
+from model._cutils import Region
 from .eventparser import GdkEventParser
 
 
@@ -141,7 +141,8 @@ class DocViewport(gtk.DrawingArea, view.render.BackgroundMixin):
         # So we don't have to support that here.
         #
 
-        area = Area(*evt.area)
+        # Only exposed rectangles are rendered, not their bounding box
+        area = Region(evt.region.get_rectangles())
         width = self.allocation.width
         height = self.allocation.height
 
@@ -195,18 +196,10 @@ class DocViewport(gtk.DrawingArea, view.render.BackgroundMixin):
         m2v_mat = self._docvp.view_matrix
         v2m_mat = self._docvp.model_matrix
 
-        # We uses here the knownledge of backend
-        # to do some optimizations
-        #ox, oy = self._doc_offset
-        #nx, ny = self._doc_offset = self._docvp.offset
-        #os = self._doc_scale
-        #ns = self._doc_scale = self._docvp.scale_idx
-
-        if 0 and os == ns and (nx != ox or ny != oy):
-            # Only translation
-            self._render_scroll(int(nx - ox), int(ny - oy), mat)
-        else:
-            # Full transformation
+        # Only translated since the last render: the document pixbuf
+        # is scrolled and only exposed strips are rendered.
+        # Zoom, rotation or first render fall back to a full render.
+        if not self._docre.render_scroll(m2v_mat):
             self._docre.render(clip, m2v_mat)
 
         self.window.draw_pixbuf(None, self._doc_gtk_pb, 0, 0, 0, 0, dither=gdk.RGB_DITHER_MAX)
@@ -267,46 +260,12 @@ class DocViewport(gtk.DrawingArea, view.render.BackgroundMixin):
 
     # Rendering
 
-    def _render_scroll(self, dx, dy, mat):
-        ## Compute and render only damaged area
-        #
-        # 4 damaged rectangles possible,
-        # but in fact only two per delta:
-        #
-        # +==================+
-        # |        #3        |      #1 exists if dx > 0
-        # |----+========+----|      #2 exists if dx < 0
-        # |    |        |    |      #3 exists if dy > 0
-        # | #1 |   OK   | #2 |      #4 exists if dy < 0
-        # |    |        |    |
-        # |----+========+----|
-        # |        #4        |
-        # +==================+
-        #
-
-        re = self._docre
-        w = self.width
-        h = self.height
-
-        if dy > 0:
-            re.render(Area(0, 0, w, dy), mat) #3
-        elif dy < 0:
-            re.render(Area(0, h+dy, w, h), mat) #4
-
-        if dx > 0:
-            if dy >= 0:
-                re.render(Area(0, dy, dx, h), mat) #1
-            else:
-                re.render(Area(0, 0, dx, h+dy), mat) #1
-        elif dx < 0:
-            if dy >= 0:
-                re.render(Area(w+dx, dy, w, h), mat) #2
-            else:
-                re.render(Area(w+dx, 0, w, h+dy), mat) #2
-
     def redraw(self, clip=None):
         if clip is None:
             self.queue_draw()
+        elif isinstance(clip, Region):
+            for area in clip:
+                self.queue_draw_area(*area)
         else:
             self.queue_draw_area(*clip)
 
@@ -318,9 +277,25 @@ class DocViewport(gtk.DrawingArea, view.render.BackgroundMixin):
         self.window.process_updates(False)
 
     def repaint_doc(self, clip=None, redraw=True):
-        self._docre.render(clip, self._docvp.view_matrix)
+        """Render again the document in clip (Area or Region), all the view if None.
+
+        With redraw, rendering is postponed to the next expose event.
+        """
+
+        if not self.view_area:
+            return
+        if clip is None:
+            clip = Region([self.view_area])
+        elif isinstance(clip, Region):
+            clip = clip.intersect(self.view_area)
+            if not clip:
+                return
         if redraw:
+            # Contents is obsolete, don't scroll it
+            self._docre.invalidate()
             self.redraw(clip)
+        else:
+            self._docre.render(clip, self._docvp.view_matrix)
 
     def repaint_tools(self, clip=None, redraw=False):
         return
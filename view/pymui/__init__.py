@@ -285,12 +285,23 @@ class DocViewportMediator(GenericMediator):
 
     @mvcHandler(model.LayerProxy.LAYER_DIRTY)
     def _on_layer_dirty(self, docproxy, layer, area=None):
-        "Redraw given area. If area is None => full redraw."
+        "Redraw given area (or Region). If area is None => full redraw."
         
         vp = self.viewComponent
         if vp.docproxy is not docproxy: return
         if area:
-            area = vp.get_view_area(*area)
+            # layer to document space
+            area = vp.get_view_area(area.transform(layer.matrix.transform_point))
+        vp.repaint_doc(area)
+
+    @mvcHandler(model.DocumentProxy.DOC_DIRTY)
+    def _on_doc_dirty(self, docproxy, area=None):
+        "Redraw given area (or Region). If area is None => full redraw."
+
+        vp = self.viewComponent
+        if vp.docproxy is not docproxy: return
+        if area:
+            area = vp.get_view_area(area)
         vp.repaint_doc(area)
 
     @mvcHandler(model.DocumentProxy.DOC_LAYER_ADDED)
@@ -225,6 +225,7 @@ class BrushEditorWindow(pymui.Window):
         self.prop['hi_speed_track']    = self._add_slider(table, 'hi_speed_track', 0.0, 2.0, 0.0, .01, 0.1)
         self.prop['smudge']            = self._add_slider(table, 'smudge', 0, 1, 0, .01, 0.1)
         self.prop['smudge_var']        = self._add_slider(table, 'smudge_var', 0, 1, 0, .01, 0.1)
+        self.prop['smudge_samples']    = self._add_slider(table, 'smudge_samples', 0, 4096, 512, 16, 128)
         self.prop['color_shift_h']     = self._add_slider(table, 'color_shift_h', -.1, .1, 0, .01, 0.1)
         self.prop['color_shift_s']     = self._add_slider(table, 'color_shift_s', -.1, .1, 0, .01, 0.1)
         self.prop['color_shift_v']     = self._add_slider(table, 'color_shift_v', -.1, .1, 0, .01, 0.1)
@@ -232,6 +233,7 @@ class BrushEditorWindow(pymui.Window):
         self.prop['dab_pos_jitter']    = self._add_slider(table, 'dab_pos_jitter', 0.0, 5.0, 0.0, .01, 0.1)
         self.prop['direction_jitter']  = self._add_slider(table, 'direction_jitter', 0.0, 1.0, 0.0, .01, 0.1)
         self.prop['alpha_lock']        = self._add_slider(table, 'alpha_lock', 0.0, 1.0, 0.0, 1.0, 1.0)
+        self.prop['accumulate']        = self._add_slider(table, 'accumulate', 0, 2, 0, 1, 1)
 
         self.Title = 'Brush Editor'
         
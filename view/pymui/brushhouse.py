@@ -35,7 +35,8 @@ import view
 import view.context as ctx
 
 from utils import _T, resolve_path
-from model.brush import Brush, DrawableBrush
+from model.brush import Brush
+from model.brushpreview import preview_cache
 from model.document import Document
 from model import _pixbuf, prefs
 
@@ -67,7 +68,6 @@ class BrushHouseWindow(pymui.Window):
         self._all = None
         self._current = None
         self._pages = []
-        self._drawbrush = DrawableBrush() # used for preview
 
         # UI
         self._top = topbox = self.RootObject = pymui.VGroup()
@@ -190,11 +190,9 @@ class BrushHouseWindow(pymui.Window):
         bt.Selected = True
 
     def _preview_icon_buffer(self, brush):
-        self._drawbrush.set_from_brush(brush)
-        self._drawbrush.smudge = 0.
         width = 128
         height = 60
-        buf = self._drawbrush.paint_rgb_preview(width, height, fmt=_pixbuf.FORMAT_ARGB8)
+        buf = preview_cache.render(brush, width, height, _pixbuf.FORMAT_ARGB8, smudge=0.)
         
         # Compose with a checker background
         cr = cairo.Context(cairo.ImageSurface.create_for_data(buf, cairo.FORMAT_ARGB32, width, height))
@@ -40,11 +40,13 @@ import utils
 
 import view
 import view.viewport
+import view.render
 import view.cairo_tools as tools
 import view.context as ctx
 import _glbackend as gl
 
 from model.devices import *
+from model._cutils import Region
 from utils import resolve_path, _T
 
 from .eventparser import MUIEventParser
@@ -52,6 +54,8 @@ from .widgets import Ruler
 from .render import DocumentOpenGLRender
 from .const import *
 
+PICK_SAMPLES = 1024  # pixels read to average the color under the cursor
+
 
 class DocViewport(pymui.Rectangle, view.viewport.BackgroundMixin):
     """DocViewport class.
@@ -130,7 +134,7 @@ class DocViewport(pymui.Rectangle, view.viewport.BackgroundMixin):
 
     @pymui.muimethod(pymui.MUIM_Setup)
     def MCC_Setup(self, msg):
-        self._ev.install(self, pymui.IDCMP_RAWKEY | pymui.IDCMP_MOUSEBUTTONS | pymui.IDCMP_MOUSEOBJECTMUI)
+        self._ev.install(self, pymui.IDCMP_RAWKEY | pymui.IDCMP_MOUSEBUTTONS | pymui.IDCMP_MOUSEOBJECTMUI | pymui.IDCMP_INTUITICKS)
         self._docrp = pymui.Raster()
         self._toolsrp = pymui.Raster()
         self._currp = pymui.Raster()
@@ -152,7 +156,12 @@ class DocViewport(pymui.Rectangle, view.viewport.BackgroundMixin):
             cl = ev.Class
             evt_type = None
 
-            if cl == pymui.IDCMP_MOUSEMOVE:
+            if cl == pymui.IDCMP_INTUITICKS:
+                # Repaint damages merged since the last motion event
+                if model.LayerProxy.damage.pending:
+                    model.LayerProxy.flush_damages()
+                return
+            elif cl == pymui.IDCMP_MOUSEMOVE:
                 if self.focus:
                     evt_type = 'cursor-motion'
             elif cl == pymui.IDCMP_MOUSEOBJECTMUI:
@@ -380,6 +389,19 @@ class DocViewport(pymui.Rectangle, view.viewport.BackgroundMixin):
     def repaint_doc(self, clip=None, redraw=True):
         if not self.width:
             return
+        if isinstance(clip, Region):
+            # Repaint only the region rectangles, but redraw their bounding box once
+            clip = clip.intersect((0, 0, self.width, self.height))
+            if not clip:
+                return
+            for area in clip:
+                self._docvp.repaint(tuple(area))
+                if redraw:
+                    self._blit_doc(*area)
+            if redraw:
+                self._clip = tuple(clip.bbox)
+                self.Redraw()
+            return
         if not clip:
             clip = (0, 0, self.width, self.height)
         self._docvp.repaint(clip)
@@ -559,44 +581,9 @@ class DocViewport(pymui.Rectangle, view.viewport.BackgroundMixin):
         # Scroll the internal docvp buffer
         self._docre.pixbuf.scroll(*delta)
 
-        ## Compute the damaged rectangles list...
-        # 4 damaged rectangles possible, but only two per delta:
-        #
-        # +==================+
-        # |        #3        |      #1 exists if dx > 0
-        # |----+========+----|      #2 exists if dx < 0
-        # |    |        |    |      #3 exists if dy > 0
-        # | #1 |   OK   | #2 |      #4 exists if dy < 0
-        # |    |        |    |
-        # |----+========+----|
-        # |        #4        |
-        # +==================+
-        #
-
-        dx, dy = delta
-        w = self.width
-        h = self.height
-        drects = []
-
-        if dy > 0:
-            drects.append([0, 0, w, dy]) #3
-        elif dy < 0:
-            drects.append([0, h+dy, w, h]) #4
-
-        if dx > 0:
-            if dy >= 0:
-                drects.append([0, dy, dx, h]) #1
-            else:
-                drects.append([0, 0, dx, h+dy]) #1
-        elif dx < 0:
-            if dy >= 0:
-                drects.append([w+dx, dy, w, h]) #2
-            else:
-                drects.append([w+dx, 0, w, h+dy]) #2
-
-        # Re-render only damaged parts
-        for area in drects:
-            self._docre.repaint(area)
+        # Re-render only exposed strips
+        for area in view.render.scroll_region(delta[0], delta[1], self.width, self.height):
+            self._docre.repaint(tuple(area))
 
         # Rasterize to the minimal viewable area
         self._clip = clip = self._check_clip(*clip)
@@ -671,7 +658,7 @@ class DocViewport(pymui.Rectangle, view.viewport.BackgroundMixin):
 
     def get_average_color(self, *pos):
         try:
-            return self._docre.pixbuf.get_average_pixel(self._curvp.radius, *pos)[:-1] # alpha last
+            return self._docre.pixbuf.get_average_pixel(self._curvp.radius, pos[0], pos[1], PICK_SAMPLES)[:-1] # alpha last
         except:
             return
 
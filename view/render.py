@@ -25,8 +25,287 @@
 
 import cairo
 import random
+import weakref
 
-from model import _pixbuf, _cutils, surface
+from math import floor
+from collections import OrderedDict
+
+from model import _pixbuf, _cutils, surface, prefs
+from model.workers import WorkerPool
+
+# Number of threads used to render documents, 0 for one per CPU
+prefs.add_default('view-render-threads', 0)
+
+# Memory used by composited tiles kept for all views, in MiB
+prefs.add_default('view-tile-cache-size', 128)
+
+
+def scroll_region(dx, dy, width, height):
+    """Return the Region exposed by scrolling a width x height view of (dx, dy).
+
+    # +==================+
+    # |      dy > 0      |
+    # |----+========+----|
+    # |    |        |    |
+    # | dx |  kept  | dx |
+    # | >0 |        | <0 |
+    # |----+========+----|
+    # |      dy < 0      |
+    # +==================+
+    """
+
+    region = _cutils.Region()
+    if dy > 0:
+        region.union_in((0, 0, width, dy))
+    elif dy < 0:
+        region.union_in((0, height + dy, width, -dy))
+    if dx > 0:
+        region.union_in((0, 0, dx, height))
+    elif dx < 0:
+        region.union_in((width + dx, 0, -dx, height))
+    return region
+
+
+class TileCache(object):
+    """Composited tiles of a document, shared by all its views.
+
+    Tiles are rendered in a cache space: the view space without the integer
+    part of its translation. So tiles are kept when a view is scrolled and
+    reused by all views with the same scale, rotation and mirror.
+    Use TileCache.get() to obtain the cache of a document proxy.
+
+    Layers below and above the active one are also kept flattened,
+    so a tile damaged by painting is rendered again by blending
+    at most three surfaces, whatever the number of layers.
+
+    invalidate() drops tiles covering modified document areas.
+    Least recently used tiles of all documents are dropped when
+    their memory is over the 'view-tile-cache-size' preference.
+    """
+
+    TILE_SIZE = surface.TILE_SIZE
+    PAD = 2  # pixels sampled around a transformed layer pixel
+    EMPTY_SIZE = 64  # memory accounted for a tile without pixels
+    MIN_SPLIT_LAYERS = 4  # below this count layers are blended directly
+
+    # Tile kinds
+    COMPOSITE, BELOW, ABOVE = range(3)
+
+    _caches = weakref.WeakKeyDictionary()  # docproxy -> TileCache
+    _lru = OrderedDict()  # (cache, kind, space, tx, ty) -> tile or None, oldest first
+    memsize = 0  # of all caches
+
+    def __init__(self):
+        self._index = {}  # (kind, space) -> set of cached (tx, ty)
+        self._split = None  # (active layer, layers) of BELOW and ABOVE tiles
+
+    @classmethod
+    def get(cls, docproxy):
+        "Return the cache of the given document proxy"
+
+        cache = cls._caches.get(docproxy)
+        if cache is None:
+            cache = cls._caches[docproxy] = cls()
+            # Tiles of a deleted document are useless
+            cache._ref = weakref.ref(docproxy, lambda ref: cache.invalidate())
+        return cache
+
+    @staticmethod
+    def get_space(m2v_mat):
+        """Return (space, ox, oy) for a model to view matrix.
+
+        'space' is the model to cache space matrix as a tuple,
+        (ox, oy) the integer position of the cache space origin in the view.
+        """
+
+        xx, yx, xy, yy, x0, y0 = m2v_mat
+        ox = int(floor(x0 + .5))
+        oy = int(floor(y0 + .5))
+        return (xx, yx, xy, yy, round(x0 - ox, 3), round(y0 - oy, 3)), ox, oy
+
+    @classmethod
+    def _size(cls, tile):
+        return tile.memsize if tile is not None else cls.EMPTY_SIZE
+
+    def _add(self, kind, space, pos, tile):
+        TileCache._lru[(self, kind, space) + pos] = tile
+        TileCache.memsize += self._size(tile)
+        self._index.setdefault((kind, space), set()).add(pos)
+
+    def _remove(self, kind, space, pos):
+        tile = TileCache._lru.pop((self, kind, space) + pos)
+        TileCache.memsize -= self._size(tile)
+        coords = self._index[(kind, space)]
+        coords.discard(pos)
+        if not coords:
+            del self._index[(kind, space)]
+
+    def _lookup(self, kind, space, coords):
+        "Return a dict of cached tiles at given coordinates, as most recently used"
+
+        lru = TileCache._lru
+        tiles = {}
+        for pos in coords:
+            key = (self, kind, space) + pos
+            if key in lru:
+                tiles[pos] = lru[key] = lru.pop(key)
+        return tiles
+
+    @classmethod
+    def trim(cls):
+        "Drop least recently used tiles until the memory limit is respected"
+
+        limit = prefs['view-tile-cache-size'] * 1024 * 1024
+        lru = cls._lru
+        while cls.memsize > limit and lru:
+            cache, kind, space, tx, ty = next(iter(lru))
+            cache._remove(kind, space, (tx, ty))
+
+    def invalidate(self, area=None, layer=None):
+        """Drop tiles covering the given document area (Area, 4-tuple or Region).
+
+        All tiles are dropped if area is None.
+        'layer' is the modified layer, if known: when it's the active one
+        the flattened layers below and above it are kept.
+        """
+
+        if layer is not None and self._split and layer is self._split[0]:
+            kinds = (self.COMPOSITE,)
+        else:
+            kinds = (self.COMPOSITE, self.BELOW, self.ABOVE)
+
+        if area is None:
+            for (kind, space), coords in self._index.items():
+                if kind in kinds:
+                    for pos in tuple(coords):
+                        self._remove(kind, space, pos)
+            return
+
+        if not isinstance(area, _cutils.Region):
+            area = _cutils.Region([area])
+
+        size = self.TILE_SIZE
+        pad = self.PAD
+        regions = {}  # same space for all kinds
+        for (kind, space), coords in self._index.items():
+            if kind not in kinds:
+                continue
+
+            region = regions.get(space)
+            if region is None:
+                region = regions[space] = area.transform(cairo.Matrix(*space).transform_point)
+
+            for x, y, w, h in region:
+                tx1 = (x - pad) // size
+                ty1 = (y - pad) // size
+                tx2 = (x + w - 1 + pad) // size
+                ty2 = (y + h - 1 + pad) // size
+
+                # Look at the smallest set: damaged or cached tiles
+                if (tx2 - tx1 + 1) * (ty2 - ty1 + 1) < len(coords):
+                    dropped = [(tx, ty) for ty in xrange(ty1, ty2 + 1) for tx in xrange(tx1, tx2 + 1)
+                               if (tx, ty) in coords]
+                else:
+                    dropped = [pos for pos in coords
+                               if tx1 <= pos[0] <= tx2 and ty1 <= pos[1] <= ty2]
+                for pos in dropped:
+                    self._remove(kind, space, pos)
+                if (kind, space) not in self._index:
+                    break
+
+    def _rasterize_layers(self, kind, document, layers, space, coords, surface, pool):
+        "Return a dict of tiles at given coordinates, rendered from layers if missing"
+
+        tiles = self._lookup(kind, space, coords)
+        missing = [pos for pos in coords if pos not in tiles]
+        if missing:
+            self._rasterize_missing(document, layers, space, missing, surface, pool)
+            for pos in missing:
+                # None for tiles without any layer pixels
+                tile = tiles[pos] = surface.get_raw_tile(pos[0] * self.TILE_SIZE, pos[1] * self.TILE_SIZE, False)
+                self._add(kind, space, pos, tile)
+            surface.clear()
+        return tiles
+
+    def _rasterize_missing(self, document, layers, space, coords, surface, pool):
+        size = self.TILE_SIZE
+        region = _cutils.Region()
+        for tx, ty in coords:
+            region.union_in((tx * size, ty * size, size, size))
+        m2c_mat = cairo.Matrix(*space)
+        for area in region:
+            document.rasterize_to_surface(surface, area, m2c_mat, layers=layers, pool=pool)
+
+    def _rasterize_split(self, document, space, coords, surface, pool):
+        "Return a dict of composited tiles, blended from cached below and above tiles"
+
+        active = document.active
+        split = (active, tuple(document))
+        if split != self._split:
+            # layers below or above the active one have changed
+            for (kind, space_), coords_ in self._index.items():
+                if kind != self.COMPOSITE:
+                    for pos in tuple(coords_):
+                        self._remove(kind, space_, pos)
+            self._split = split
+
+        i = document.index(active)
+        below = self._rasterize_layers(self.BELOW, document, document[:i], space, coords, surface, pool)
+        above = self._rasterize_layers(self.ABOVE, document, document[i + 1:], space, coords, surface, pool)
+
+        # Below tiles are copied, cached tiles are never modified
+        size = self.TILE_SIZE
+        tilemgr = surface.tile_manager
+        for pos, tile in below.iteritems():
+            if tile is not None:
+                tilemgr.set_tile(tile.copy(), pos[0] * size, pos[1] * size)
+
+        self._rasterize_missing(document, (active,), space, coords, surface, pool)
+
+        # Tiles above are blended in the same space, without any scaling
+        above_surface = surface.__class__(surface.pixfmt, size)
+        for pos, tile in above.iteritems():
+            if tile is not None:
+                above_surface.tile_manager.set_tile(tile, pos[0] * size, pos[1] * size)
+                surface.get_tile(pos[0] * size, pos[1] * size).blend(
+                    above_surface.tile_manager, _pixbuf.SAMPLING_NONE, 1.0, 1.0, 1.0, 0.0, 0.0)
+
+        tiles = {}
+        for pos in coords:
+            tiles[pos] = surface.get_raw_tile(pos[0] * size, pos[1] * size, False)
+        surface.clear()
+        return tiles
+
+    def rasterize(self, document, clip, m2v_mat, destination, surface, pool=None):
+        """Blit tiles overlapping clip (view Area) into the destination pixbuf.
+
+        Missing tiles are rendered first into 'surface', an empty tiled surface.
+        """
+
+        space, ox, oy = self.get_space(m2v_mat)
+        size = self.TILE_SIZE
+        assert surface.tile_size == size
+
+        x, y, w, h = clip
+        coords = [(tx, ty)
+                  for ty in xrange((y - oy) // size, (y + h - 1 - oy) // size + 1)
+                  for tx in xrange((x - ox) // size, (x + w - 1 - ox) // size + 1)]
+
+        tiles = self._lookup(self.COMPOSITE, space, coords)
+        missing = [pos for pos in coords if pos not in tiles]
+        if missing:
+            if len(document) < self.MIN_SPLIT_LAYERS or document.active not in document:
+                tiles.update(self._rasterize_layers(self.COMPOSITE, document, None, space, missing, surface, pool))
+            else:
+                for pos, tile in self._rasterize_split(document, space, missing, surface, pool).iteritems():
+                    tiles[pos] = tile
+                    self._add(self.COMPOSITE, space, pos, tile)
+
+        for tile in tiles.itervalues():
+            if tile is not None:
+                tile.blit(destination, tile.x + ox, tile.y + oy)
+
+        self.trim()
 
 
 class Render(object):
@@ -161,22 +440,96 @@ class ToolsCairoRender(CairoRenderBase):
 class DocumentRender(Render):
     # Full PixBuf Render implementation
 
+    _pool = None  # shared by all renders
+
     def __init__(self):
         self._s = None
+        self._mat = None  # view matrix of the whole pixbuf contents, if any
 
     def reset(self, width, height, pixel_format=_pixbuf.FORMAT_ARGB15X):
         del self._s
         self._s = surface.UnboundedTiledSurface(pixel_format)
+        self._mat = None
 
     def set_pixbuf(self, pixbuf):
         self._pb = pixbuf
+        self._mat = None
+
+    @property
+    def pool(self):
+        count = prefs['view-render-threads'] or None
+        pool = DocumentRender._pool
+        if pool is None or (count and pool.count != count):
+            if pool:
+                pool.close()
+            pool = DocumentRender._pool = WorkerPool(count)
+        return pool
 
     def render(self, clip, m2v_mat):
+        "Render the document into the pixbuf, clip is an Area or a Region"
+
+        self._update_matrix(clip, m2v_mat)
+
+        if isinstance(clip, _cutils.Region):
+            # Rectangles are rendered separately, so far areas don't render all between them
+            for area in clip:
+                self._render_area(area, m2v_mat)
+        else:
+            self._render_area(clip, m2v_mat)
+
+    def _render_area(self, clip, m2v_mat):
         assert isinstance(clip, _cutils.Area)
         self._pb.clear_area(*clip)
         self._s.clear()
-        self.docproxy.document.rasterize_to_surface(self._s, clip, m2v_mat)
-        self._s.rasterize(clip, 0, 0, destination=self._pb)
+        TileCache.get(self.docproxy).rasterize(self.docproxy.document, clip, m2v_mat,
+                                               self._pb, self._s, pool=self.pool)
+
+    def invalidate(self):
+        "Forget the pixbuf contents, so it's rendered again before any scroll"
+
+        self._mat = None
+
+    def _update_matrix(self, clip, m2v_mat):
+        "Track the matrix used to render the whole pixbuf"
+
+        mat = tuple(m2v_mat)
+        if mat != self._mat:
+            pb = self._pb
+            full = pb.width * pb.height
+            if _cutils.Region([clip]).intersect((0, 0, pb.width, pb.height)).pixels == full:
+                self._mat = mat
+            else:
+                self._mat = None  # pixels rendered with different matrices
+
+    def render_scroll(self, m2v_mat):
+        """Update the pixbuf for a view translated since the last render.
+
+        The pixbuf contents is scrolled and only exposed strips are rendered.
+        Return False if nothing was done, because the pixbuf was not fully
+        rendered, the translation is not an integer count of pixels
+        or the view was zoomed or rotated: a full render is needed.
+        """
+
+        old = self._mat
+        mat = tuple(m2v_mat)
+        if old is None or old[:4] != mat[:4] or old == mat:
+            return False
+
+        dx = mat[4] - old[4]
+        dy = mat[5] - old[5]
+        idx = int(round(dx))
+        idy = int(round(dy))
+        if abs(dx - idx) > 1e-3 or abs(dy - idy) > 1e-3:
+            return False
+
+        pb = self._pb
+        if abs(idx) >= pb.width or abs(idy) >= pb.height:
+            return False
+
+        pb.scroll(idx, idy)
+        self._mat = mat
+        self.render(scroll_region(idx, idy, pb.width, pb.height), m2v_mat)
+        return True
 
 class BackgroundMixin:
     _backcolor = None  # background as solid color
@@ -226,10 +226,15 @@ class ViewState(object):
     def get_view_area(self, *area):
         """Transform a given area from model to view coordinates.
         This function uses the full matrix coefficients.
+        A Region is transformed rectangle by rectangle into a new Region.
 
         WARNING: returns integer area values, not clipped
         on viewport bounds (possible negative values!).
         """
+        if len(area) == 1:
+            area = area[0]
+            if isinstance(area, _cutils.Region):
+                return area.transform(self.get_view_point)
         return _cutils.Area(*area).transform_in(self.get_view_point)
 
     def get_offset(self):